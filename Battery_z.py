@@ -107,29 +107,43 @@ import os                           # Provides a way of using operating system d
 import platform                     # Used to retrieve platform-identifying data like OS and architecture.
 import subprocess                   # Allows running external commands (e.g., powercfg, powershell).
 import tempfile                     # Used for creating temporary files, specifically for the battery report.
+import shutil                       # Removes the scratch directories the benchmarks create.
 import json                         # For reading and writing cache files in JSON format.
+import csv                          # Reads and writes the columnar fleet files of --score-fleet.
+import gzip                         # Compresses provider recordings (record-and-replay mode).
+import atexit                       # Flushes provider recordings and pending history samples when the process exits.
 import datetime                     # Provides classes for manipulating dates and times.
 import traceback                    # For printing stack traces when an error occurs, crucial for debugging.
 import getpass                      # To get the current user's username for a personalized greeting.
 import threading                    # For running data-fetching tasks in the background without freezing the UI.
+import concurrent.futures           # Futures for querying independent data sources concurrently.
+import queue                        # The task queue of the long-lived data collection threads.
+import weakref                      # Shuts the collection threads down when their engine is discarded.
 import time                         # Provides time-related functions, used for caching and delays.
 import re                           # Regular expressions for parsing text output from command-line tools.
 import math                         # For mathematical operations in battery health calculations.
+import bisect                       # Binary search over sorted samples and timestamps.
+import array                        # Typed float/word conversions in the telemetry archive codec.
+import struct                       # Fixed-width binary records in the history segment files.
+import mmap                         # Memory-mapped reads of history segments.
+import zlib                         # CRC32 checksums in history segment footers.
+import sqlite3                      # The optional SQLite (WAL) backend for the sample history.
+import xml.etree.ElementTree as ET  # Incremental (iterparse) parsing of the powercfg XML battery report.
 import warnings                     # To control warning messages, used here to ignore specific warnings.
+from abc import ABC, abstractmethod # The BatteryProvider interface.
 import random                       # For selecting random welcome quotes and tips.
-import winreg                       # To access the Windows Registry for fallback data retrieval.
 import ctypes                       # To call functions in DLLs/shared libraries (e.g., Windows kernel32.dll).
 from ctypes import wintypes         # Provides Windows-specific data types for ctypes.
 from pathlib import Path            # For object-oriented filesystem paths.
-from typing import Dict, List, Optional, Tuple, Any, Union # For type hinting to improve code clarity and maintainability.
+from typing import Dict, List, Optional, Tuple, Any, Union, Callable # For type hinting to improve code clarity and maintainability.
 from dataclasses import dataclass, field # For creating simple classes primarily for storing data.
 from collections import defaultdict, deque # Advanced container datatypes.
+from types import SimpleNamespace   # Lightweight attribute containers, used to mimic WMI result objects in tests.
 from enum import Enum               # For creating enumerations.
 import logging                      # For logging errors, warnings, and info to a file for debugging.
 from logging.handlers import RotatingFileHandler # For managing log files to prevent them from growing too large.
 
 # --- NEWLY ADDED IMPORTS FOR ADVANCED SENSORS AND CALCULATIONS ---
-from collections import deque       # A double-ended queue, perfect for creating a moving average filter for sensor data.
 try:                                # NumPy is a powerful library for numerical operations.
     import numpy as np              # Used here for polynomial fitting in the RUL prediction algorithm.
     NUMPY_AVAILABLE = True
@@ -143,7 +157,15 @@ except ImportError:
 # Suppress ignorable warnings to keep the console output clean.
 warnings.filterwarnings('ignore')
 
-# Attempt to import WMI, a critical library for Windows system information.
+# Attempt to import winreg, used to read the Windows install date from the Registry.
+try:
+    import winreg
+    WINREG_AVAILABLE = True
+except ImportError:
+    # winreg only exists on Windows. Other platforms fall back to other sources.
+    WINREG_AVAILABLE = False
+
+# Attempt to import WMI, the primary source of battery information on Windows.
 try:
     # wmi provides a high-level interface to Windows Management Instrumentation.
     import wmi
@@ -157,10 +179,9 @@ try:
 except ImportError:
     # Set the flag to False.
     WMI_AVAILABLE = False
-    # Print a critical error message as WMI is essential for core functionality.
-    print("[X] CRITICAL ERROR: WMI module not found. Please run 'pip install wmi'.")
-    # Exit the application because it cannot function without WMI.
-    sys.exit(1)
+    # WMI is only required by the Windows battery provider. On Linux, sysfs is used instead.
+    if platform.system() == "Windows":
+        print("[X] ERROR: WMI module not found. Battery data will be limited. Please run 'pip install wmi'.")
 
 # Attempt to import psutil, a cross-platform process and system utilities library.
 try:
@@ -214,7 +235,7 @@ try:
         QApplication, QMainWindow, QWidget, QFrame, QLabel, QPushButton,
         QVBoxLayout, QHBoxLayout, QGridLayout, QScrollArea, QSystemTrayIcon,
         QGraphicsDropShadowEffect, QGraphicsBlurEffect, QSizePolicy, QSplashScreen, QMessageBox,
-        QProgressBar, QMenuBar, QMenu, QAction, QDialog, QInputDialog, QSpacerItem
+        QProgressBar, QMenuBar, QMenu, QAction, QDialog, QInputDialog, QSpacerItem, QComboBox
     )
     # Import all necessary graphics components from PyQt5.QtGui.
     from PyQt5.QtGui import (
@@ -498,12 +519,156 @@ BASE_WINDOW_HEIGHT = 950                # The base height of the main window at
 BASE_DPI = 96.0                         # The baseline DPI for UI scaling calculations.
 REALTIME_POLL_INTERVAL = 3000           # The interval in milliseconds (3 seconds) for polling real-time sensor data.
 POWERCFG_TIMEOUT = 30                   # The timeout in seconds for the powercfg command to prevent hangs.
+REPORT_MAX_AGE_SECONDS = 3600           # A powercfg report older than this (1 hour) is regenerated in the background.
+INSTALL_DATE_RETRY_SECONDS = 86400      # A failed install date lookup is retried after this long (1 day).
+
+# --- Concurrent Data Collection ---
+COLLECTION_MAX_WORKERS = 6              # Maximum number of data sources queried at the same time during a full fetch.
+# Per-source deadlines in seconds. A source that misses its deadline is abandoned and its default value is used.
+SOURCE_DEADLINES = {
+    "system_info": 10.0,
+    "battery_report": POWERCFG_TIMEOUT + 5.0,
+    "static_info": 15.0,
+    "cycle_count": 20.0,                # Covers the 10 s PowerShell fallback.
+    "chemistry": 15.0,
+    "dynamic_status": 10.0,
+    "temperature": 10.0,
+    "install_date": 15.0,               # Covers the 10 s systeminfo fallback.
+}
+
+# --- Per-Battery Static Data Cache ---
+# How long each cached field is trusted, in seconds. Identity fields never change for a
+# given pack; full charge capacity and cycle count drift with use, so they expire sooner.
+STATIC_FIELD_TTLS = {
+    "system_manufacturer": 30 * 86400,
+    "system_model": 30 * 86400,
+    "name": 30 * 86400,
+    "manufacturer": 30 * 86400,
+    "serial": 30 * 86400,
+    "design_capacity": 30 * 86400,
+    "chemistry": 30 * 86400,
+    "full_charge_capacity": 6 * 3600,
+    "cycle_count": 3600,
+}
+STATIC_CACHE_MAX_ENTRIES = 8            # Batteries (or machines, for a roaming profile) remembered at once.
+
+# --- Real-time Smoothing (Kalman) ---
+KALMAN_POWER_PROCESS_VARIANCE = 0.05    # W² per poll: how far the true power draw may drift between polls.
+KALMAN_POWER_MEASUREMENT_VARIANCE = 4.0 # W²: initial reading noise. Adapted online from the innovations.
+KALMAN_TTE_PROCESS_VARIANCE = 3600.0    # s² per poll: drift of the reported time to empty (σ = 1 min).
+KALMAN_TTE_MEASUREMENT_VARIANCE = 810000.0  # s²: initial noise of the reported time to empty (σ = 15 min).
+KALMAN_NOISE_ADAPTATION = 0.02          # EWMA weight of each poll in the adaptive measurement-noise estimate.
+KALMAN_STEP_SIGMAS = 4.0                # Two readings in a row this many σ out (same side) are a real change in load, not noise.
+SMOOTHING_BAND_SIGMAS = 1.96            # Width of the displayed uncertainty band (95%).
+SMOOTHING_MIN_POWER_WATTS = 0.5         # Below this, time to empty is not derived from the power draw.
+TTE_WINDOW_SECONDS = 120.0              # Power readings averaged for our own time to empty (40 polls at 3 s).
+
+# --- Charge Time Prediction ---
+CHARGE_MODEL_FILE = "charge_model.json" # Learned charge-curve parameters, in BatteryZ_Data.
+CHARGE_DEFAULT_KNEE_PERCENT = 80.0      # Where constant current gives way to constant voltage, until learned.
+CHARGE_DEFAULT_TAU_SECONDS = 1200.0     # Time constant of the constant-voltage tail, until learned.
+CHARGE_FULL_PERCENT = 99.5              # The CV tail only approaches 100%; this close counts as full.
+CHARGE_RATE_SMOOTHING = 0.2             # EWMA weight of each poll in the live charge rate.
+CHARGE_FIT_BUCKET_SECONDS = 300         # Charge rates of past sessions are measured over buckets this long.
+CHARGE_CC_MAX_PERCENT = 60.0            # Buckets below this charge level are taken as constant-current.
+CHARGE_KNEE_RATE_FRACTION = 0.6         # The knee is where the rate first falls below this fraction of the CC rate.
+CHARGE_MODEL_LEARNING_RATE = 0.3        # Weight of each newly fitted session in the learned parameters.
+CHARGE_FIT_SESSIONS = 20                # Newest charge sessions looked at when learning.
+
+# --- Streaming Anomaly Detection ---
+ANOMALY_BASELINE_ALPHA = 0.002          # EWMA weight per poll of a metric's baseline (~25 min of memory at a 3 s poll).
+ANOMALY_LIMIT_SIGMAS = 4.0              # Control limit: readings this many σ above the baseline are anomalous.
+ANOMALY_WARMUP_SAMPLES = 200            # Polls a baseline needs before it is trusted (10 min at a 3 s poll).
+ANOMALY_CONFIRM_SAMPLES = 2             # Consecutive out-of-limit polls before an anomaly is reported.
+ANOMALY_ADAPT_SAMPLES = 200             # A shift that lasts this long is the new normal; the baseline follows it.
+ANOMALY_RATE_SMOOTHING = 0.3            # EWMA weight used to smooth the temperature rise rate between polls.
+ANOMALY_MIN_SIGMA = {"temperature_rise": 0.3, "power_draw": 1.0}  # σ floors (°C/min, W), so flat baselines don't alarm on noise.
+ANOMALY_SAVE_INTERVAL = 1200            # Polls between baseline saves (1 h at a 3 s poll).
+ANOMALY_BASELINE_FILE = "anomaly_baseline.json"  # Persisted baselines, in BatteryZ_Data.
+
+# --- Real-time Samples ---
+SAMPLE_FLAG_CHARGING = 0x01             # Sample flag bit: the battery was charging.
+SAMPLE_FLAG_AC_ONLINE = 0x02            # Sample flag bit: the AC adapter was plugged in.
+
+# --- Persistent Sample History ---
+HISTORY_DIR_NAME = "history"            # Sub-directory of BatteryZ_Data that holds the history stores.
+HISTORY_SAMPLE_FORMAT = "<dffffB"       # One sample record: timestamp, percent, voltage_mv, power_watts, temperature, flags (25 bytes).
+HISTORY_SEGMENT_RECORDS = 65536         # Records per segment file before it is sealed (~1.6 MB, ~2.3 days at a 3 s poll).
+HISTORY_FLUSH_RECORDS = 20              # Pending records that trigger a batched write (one minute at a 3 s poll).
+HISTORY_FLUSH_SECONDS = 60.0            # Maximum age of a pending record before it is written.
+HISTORY_ROLLUP_RESOLUTIONS = (60, 3600, 86400)  # Rollup bucket widths in seconds (minute, hour, day), aligned to the epoch.
+HISTORY_ROLLUP_METRICS = ("percent", "power_watts", "voltage_mv", "temperature")  # Sample fields summarized by the rollups.
+HISTORY_CAPACITY_FORMAT = "<ddfff"      # Imported CapacityHistory row: start, end, design, full-charge capacity (mWh), cycle count.
+HISTORY_USAGE_FORMAT = "<dfBBfff"       # Imported RecentUsage row: timestamp, duration (s), AC, entry type, charge, full-charge capacity, discharge (mWh).
+HISTORY_USAGE_ENTRY_TYPES = ("Active", "Suspend", "ReportGenerated", "ConnectedStandby", "Shutdown")  # Stored as index + 1; 0 = other.
+HISTORY_BACKENDS = ("segments", "sqlite")  # Storage engines for the history: segment files (default) or one SQLite database.
+HISTORY_SQLITE_FILE = "history.sqlite3"     # The SQLite database file, inside the history directory.
+SESSION_KINDS = ("discharge", "charge", "idle")  # Session types; "idle" is plugged in but not charging. Each has its own store.
+SESSION_FORMAT = "<ddfffffffI"          # One session record: start, end, start/end percent, energy (Wh), avg/peak power (W), avg/peak temperature, samples.
+SESSION_MAX_GAP_SECONDS = 1800          # A longer gap between samples (shutdown, long sleep) ends the session.
+SESSION_MIN_SECONDS = 60                # Shorter sessions (a charger blip) are not stored.
+SESSION_STATE_FILE = "open_session.json"  # Where the open session starts, so reopening the history replays only that session.
+ARCHIVE_CHUNK_SAMPLES = 4096           # Samples per compressed chunk in a .bza telemetry archive.
+HISTORY_CHART_OVERSAMPLING = 8          # Points loaded per chart pixel, so zooming in shows detail without re-querying.
+HISTORY_CHART_GAP_FACTOR = 10           # A time step this many times the typical spacing is drawn as a gap in the line.
+
+# --- Probabilistic (Monte Carlo) RUL ---
+MONTE_CARLO_TRAJECTORIES = 100000       # Trajectories per estimate on the NumPy path.
+MONTE_CARLO_FALLBACK_TRAJECTORIES = 10000 # Trajectories on the pure-Python path, which is ~100x slower per sample.
+MONTE_CARLO_SEED = 20240101             # Fixed seed, so the same inputs always give the same interval.
+MONTE_CARLO_USAGE_SIGMA = 0.35          # Log-normal sigma of the future usage rate around the historical rate.
+MONTE_CARLO_FADE_SIGMA = 0.10           # Relative 1-sigma noise on the capacity-fade coefficient.
+# Relative 1-sigma spread of the real cycle life around the rated value, by MANUFACTURER_DATABASE quality tier.
+QUALITY_TIER_CYCLE_SPREAD = {
+    "Premium": 0.10,
+    "Mid-range": 0.18,
+    "Budget": 0.28,
+}
+
+# --- Measured Wear Rate ---
+WEAR_LOG_FILE = "wear_log.json"         # Daily cycle count and full-charge capacity per battery, in BatteryZ_Data.
+WEAR_WINDOW_DAYS = 90                   # The wear rates are regressions over this many most recent days.
+WEAR_MIN_DAYS = 14                      # Days the window must span before its usage rate replaces the estimate.
+WEAR_MIN_CYCLES = 5                     # Cycles the window must span before a capacity loss per cycle is reported.
+DEFAULT_CYCLES_PER_DAY = 0.7            # Assumed usage when neither the wear log nor the install date gives a rate.
+
+# --- Capacity Fade Models ---
+FADE_MODEL_FILE = "fade_model.json"     # Per-battery fade model state, in BatteryZ_Data.
+FADE_FORGETTING = 0.998                 # RLS forgetting factor per observation, so the fit follows a pack whose fade speeds up.
+FADE_INITIAL_COVARIANCE = 1e4           # RLS prior covariance: the first observations set the fit almost on their own.
+FADE_MIN_OBSERVATIONS = 5               # Observations before a pack's fit is used.
+FADE_MIN_CYCLE_SPAN = 20                # Cycles the observations must span before a pack's fit is used.
+FADE_ERROR_SMOOTHING = 0.1              # EWMA weight of each one-step prediction error when comparing the models.
+FADE_TRAJECTORY_POINTS = 11             # Points in the reported SOH trajectory, from now to end of life.
+
+# --- Batch Fleet Scoring ---
+FLEET_COLUMNS = ("design_capacity_mwh", "full_charge_capacity_mwh", "cycle_count", "rated_cycles", "age_days")  # Input columns.
+FLEET_RUL_THRESHOLD_SOH = 80.0          # End-of-life health for the fleet RUL, as in estimate_remaining_life.
+FLEET_RUL_HORIZON_DAYS = 5475           # Projection horizon (15 years), as in estimate_remaining_life.
+
+# --- WMI Namespaces ---
+WMI_CIMV2_NAMESPACE = "root\\cimv2"     # The standard WMI namespace (Win32_Battery, Win32_ComputerSystemProduct, ...).
+WMI_BATTERY_NAMESPACE = "root\\wmi"     # The advanced namespace exposing the ACPI battery classes (BatteryStatus, ...).
+
+# --- Linux sysfs Paths ---
+LINUX_POWER_SUPPLY_ROOT = "/sys/class/power_supply"   # One directory per power supply (BAT0, AC, ...).
+LINUX_DMI_ROOT = "/sys/class/dmi/id"                  # System vendor and product name.
 
 # --- Global State Variables ---
 # This global variable allows the user to manually override the detected cycle count for testing or calibration.
 # It is modified via the UI and checked during the data analysis phase.
 CUSTOM_CYCLE_COUNT = None
 
+# Record-and-replay mode, set from the command line (--record / --replay / --replay-speed).
+# When RECORD_PATH is set, every raw provider response is captured to that file. When
+# REPLAY_PATH is set, a recording is fed back instead of querying the hardware.
+RECORD_PATH = None
+REPLAY_PATH = None
+REPLAY_SPEED = 1.0                      # 1.0 = real time, N = N× faster, 0 = as fast as possible.
+
+# The storage engine for the sample history (one of HISTORY_BACKENDS), set with --history-backend.
+HISTORY_BACKEND = "segments"
+
 # A list of welcome quotes. A random one is chosen on each application startup.
 WELCOME_QUOTES = [
     "Have a great day! Let's check your battery health.",
@@ -547,31 +712,31 @@ BATTERY_TIPS = [
 #              validate the execution environment and set up initial state.
 # ============================================================================
 
-# Define a function to validate that the application is running on Windows.
+# Define a function to validate that the application is running on a supported platform.
 def validate_platform() -> bool:
     """
-    Checks if the current operating system is Windows. If not, it prints an
-    error and exits. If it is Windows, it prints system details.
+    Checks that the current operating system is supported (Windows or Linux).
+    If not, it prints an error and exits. Otherwise, it prints system details.
 
     Returns:
-        bool: True if the platform is Windows, otherwise the program exits.
+        bool: True if the platform is Windows, False if it is Linux. Any other
+            platform exits the program.
     """
     # Check if the platform system is 'Windows'.
-    is_windows = platform.system() == "Windows"
-    # If it is Windows, proceed to print details.
-    if is_windows:
-        # Get the Windows version (e.g., '10', '11').
-        win_version = platform.release()
-        # Print a success message with the detected OS version.
-        print(f"[✓] Platform: Windows {win_version}")
+    system_name = platform.system()
+    is_windows = system_name == "Windows"
+    # If it is a supported platform, proceed to print details.
+    if system_name in ("Windows", "Linux"):
+        # Print a success message with the detected OS version (e.g., '10', '11', or the kernel release).
+        print(f"[✓] Platform: {system_name} {platform.release()}")
         # Print the Python version being used.
         print(f"[✓] Python: {sys.version.split()[0]}")
         # Print the system architecture (e.g., 'AMD64').
         print(f"[✓] Architecture: {platform.machine()}")
-    # If the OS is not Windows, print an error and terminate.
+    # If the OS is not supported, print an error and terminate.
     else:
         # Print a critical error message.
-        print("[X] CRITICAL ERROR: This application is designed for Windows OS only.")
+        print(f"[X] CRITICAL ERROR: Unsupported platform '{system_name}'. Windows or Linux is required.")
         # Exit the application with a non-zero status code to indicate an error.
         sys.exit(1)
     # Return the boolean result.
@@ -618,12 +783,15 @@ class BatteryData:
     # --- Voltage and Power Metrics ---
     design_voltage_mv: Optional[int] = None         # The rated design voltage in millivolts.
     current_voltage_mv: Optional[int] = None        # The current voltage in millivolts.
-    power_draw_watts: Optional[float] = None        # The current power draw or charge rate in Watts.
+    power_draw_watts: Optional[float] = None        # The current power draw or charge rate in Watts (smoothed).
+    power_draw_band_watts: Optional[float] = None   # ± uncertainty of the smoothed power draw, in Watts.
     charge_rate_mw: Optional[int] = None            # The charge rate in milliwatts (if charging).
     discharge_rate_mw: Optional[int] = None         # The discharge rate in milliwatts (if discharging).
 
     # --- Usage and Health Metrics ---
     cycle_count: Optional[int] = None               # The number of charge/discharge cycles the battery has undergone.
+    cycle_count_estimated: bool = False             # True if cycle_count was estimated from capacity fade, not reported by the battery.
+    install_date: Optional[datetime.datetime] = None # The OS install date, used as a proxy for the battery's age.
     rated_cycle_life: int = 1000                    # The manufacturer's rated cycle life, looked up or defaulted.
     temperature_celsius: Optional[float] = None     # The current battery temperature in degrees Celsius.
 
@@ -632,7 +800,9 @@ class BatteryData:
     is_charging: Optional[bool] = None              # True if the battery is currently charging.
     ac_online: Optional[bool] = None                # True if the AC adapter is plugged in.
     time_to_empty_seconds: Optional[int] = None     # Estimated time until the battery is empty, in seconds.
+    time_to_empty_range_seconds: Optional[Tuple[int, int]] = None  # (low, high) uncertainty band of the time to empty.
     time_to_full_seconds: Optional[int] = None      # Estimated time until the battery is fully charged, in seconds.
+    time_to_80_seconds: Optional[int] = None        # Estimated time until the battery reaches 80%, in seconds.
     
     # --- Metadata and Flags ---
     fetch_timestamp: Optional[datetime.datetime] = None # Timestamp of when the data was last fetched.
@@ -654,6 +824,55 @@ class BatteryData:
                 self.full_charge_capacity_mwh is not None and
                 self.design_capacity_mwh > 1000)
 
+# --- Typed Powercfg Battery Report ---
+# These dataclasses are the parsed form of the XML report written by `powercfg /batteryreport /xml`.
+# The report is parsed once per file version and shared by every consumer in a fetch cycle.
+
+@dataclass
+class ReportBattery:
+    """A single <Battery> element of the powercfg report."""
+    name: Optional[str] = None                      # The <Id> of the pack, e.g., "DELL 71R31C7".
+    manufacturer: Optional[str] = None
+    serial: Optional[str] = None
+    chemistry: Optional[str] = None                 # Raw chemistry string, e.g., "LION".
+    design_capacity_mwh: Optional[int] = None
+    full_charge_capacity_mwh: Optional[int] = None
+    cycle_count: Optional[int] = None
+
+@dataclass
+class CapacityHistoryEntry:
+    """One <HistoryEntry> row: Windows' record of the pack's capacity over a period."""
+    start: Optional[datetime.datetime] = None
+    end: Optional[datetime.datetime] = None
+    design_capacity_mwh: Optional[int] = None
+    full_charge_capacity_mwh: Optional[int] = None
+    cycle_count: Optional[int] = None
+
+@dataclass
+class UsageHistoryEntry:
+    """One <UsageEntry> row of the report's RecentUsage section."""
+    timestamp: Optional[datetime.datetime] = None
+    duration_seconds: float = 0.0
+    ac_online: Optional[bool] = None
+    entry_type: Optional[str] = None                # e.g., "Active", "Suspend", "ReportGenerated".
+    charge_capacity_mwh: Optional[int] = None       # The remaining charge at the start of the entry.
+    full_charge_capacity_mwh: Optional[int] = None
+    discharge_mwh: Optional[int] = None
+
+@dataclass
+class BatteryReport:
+    """The parsed powercfg battery report. The history lists stay empty unless it was parsed with history=True."""
+    path: str = ""
+    system_info: Dict[str, str] = field(default_factory=dict)            # Simple text fields of <SystemInformation>.
+    batteries: List[ReportBattery] = field(default_factory=list)
+    capacity_history: List[CapacityHistoryEntry] = field(default_factory=list)
+    usage_history: List[UsageHistoryEntry] = field(default_factory=list)
+
+    @property
+    def primary_battery(self) -> Optional[ReportBattery]:
+        """The first battery in the report, which is the one the rest of the app describes."""
+        return self.batteries[0] if self.batteries else None
+
 # This ctypes structure maps to the Windows SYSTEM_POWER_STATUS struct, allowing direct calls to the Kernel32 GetSystemPowerStatus API.
 # This is a highly reliable and fast method for getting basic, real-time battery status.
 if CTYPES_AVAILABLE and IS_WINDOWS:
@@ -892,8 +1111,9 @@ def get_health_status(health_pct: float) -> Tuple[str, str]:
     """
     # Iterate through the global HEALTH_STATUS_MAP.
     for min_val, max_val, label, color in HEALTH_STATUS_MAP:
-        # Check if the health percentage falls within the current range.
-        if min_val <= health_pct <= max_val:
+        # Check if the health percentage falls within the current range. The ranges are whole
+        # percents, so each extends to just below the next one (94.5% is still "Very Good").
+        if min_val <= health_pct < max_val + 1:
             # Return the corresponding label and color.
             return label, color
     # Return a default "Unknown" status if no range matches.
@@ -999,6 +1219,20 @@ def get_manufacturer_rated_cycles(manufacturer: str, model: str, chemistry: str)
     logging.info(f"No manufacturer match. Falling back to chemistry-based default for {chemistry}: {chem_cycles} cycles.")
     return chem_cycles
 
+def get_manufacturer_quality_tier(manufacturer: str, model: str) -> str:
+    """
+    Looks up the MANUFACTURER_DATABASE quality tier ("Premium", "Mid-range" or
+    "Budget") with the same matching rules as get_manufacturer_rated_cycles.
+    """
+    mfr_lower = (manufacturer or "").lower()
+    model_lower = (model or "").lower()
+    matched_mfr_key = next((key for key in MANUFACTURER_DATABASE if key in mfr_lower), "generic")
+    mfr_data = MANUFACTURER_DATABASE[matched_mfr_key]
+    for model_key, model_details in mfr_data["models"].items():
+        if model_key in model_lower:
+            return model_details["quality"]
+    return mfr_data["default"]["quality"]
+
 # This function attempts to get the Windows installation date.
 def get_windows_install_date() -> Optional[datetime.datetime]:
     """
@@ -1011,6 +1245,9 @@ def get_windows_install_date() -> Optional[datetime.datetime]:
     """
     # Method 1: Windows Registry (fast and reliable).
     try:
+        # winreg only exists on Windows.
+        if not WINREG_AVAILABLE:
+            raise OSError("winreg is not available on this platform")
         # Open the required registry key. HKEY_LOCAL_MACHINE stores system-wide settings.
         key = winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE, r"SOFTWARE\Microsoft\Windows NT\CurrentVersion")
         # Query the "InstallDate" value, which is a UNIX timestamp.
@@ -1052,283 +1289,4735 @@ def get_windows_install_date() -> Optional[datetime.datetime]:
     # Return None if all methods failed.
     return None
 
-# ============================================================================
-# PART 2
-# ============================================================================
-
-# ============================================================================
-# SECTION 6: CORE LOGIC - BATTERY INTELLIGENCE CLASS
-# Description: This is the central class for all backend logic. It encapsulates
-#              data fetching, caching, and health/RUL calculations. This class
-#              replaces the multiple logic classes from the original main.py
-#              (WindowsBatteryDataFetcher, BatteryHealthCalculator, RULPredictor)
-#              with a single, more robust, and maintainable implementation
-#              inspired by reference.py.
-# ============================================================================
-
-class BatteryIntelligence:
+class InstallDateResolver:
     """
-    This class handles all backend operations: fetching battery data from
-    multiple Windows APIs, caching the results for performance, parsing the data,
-    and performing health and remaining life calculations. It is designed to be
-    the single source of truth for battery status.
+    Resolves the OS install date once and remembers it, in memory and in
+    install_date.json next to the battery cache. The registry lookup is fast,
+    but its `systeminfo` fallback takes several seconds, so the UI thread only
+    ever reads an already-resolved value (peek) or asks for one in the
+    background (get_async). There is one resolver per file, shared process-wide.
     """
-    
-    # The __init__ method is the constructor for the class.
-    def __init__(self):
+    _instances: Dict[str, "InstallDateResolver"] = {}
+    _instances_lock = threading.Lock()
+
+    @classmethod
+    def for_path(cls, path: str) -> "InstallDateResolver":
+        """Returns the shared resolver for a persistence file, creating it on first use."""
+        key = os.path.abspath(path)
+        with cls._instances_lock:
+            if key not in cls._instances:
+                cls._instances[key] = cls(path)
+            return cls._instances[key]
+
+    def __init__(self, path: Optional[str], lookup: Optional[Callable[[], Optional[datetime.datetime]]] = None):
         """
-        Initializes the BatteryIntelligence class by setting up paths for data
-        persistence, loading cached data, and preparing for data collection.
+        Args:
+            path (str): The JSON file the resolved date is persisted to. None keeps it in memory only.
+            lookup (Callable): The slow lookup. Defaults to get_windows_install_date.
         """
-        # --- Path Configuration for Data Persistence ---
-        # Get the user's AppData/Roaming directory path. Storing data here is the correct
-        # practice for Windows applications, as it's a user-specific, non-roaming location.
-        self.appdata_path = os.path.join(os.getenv('APPDATA'), 'BatteryZ_Data')
-        # Create the directory if it doesn't exist to prevent errors when writing files.
-        os.makedirs(self.appdata_path, exist_ok=True)
-        
-        # Define the full paths for all persistent data files.
-        self.cache_file = os.path.join(self.appdata_path, 'battery_cache.json')
-        self.report_path = os.path.join(self.appdata_path, 'battery_report.xml')
-        
-        # --- Logging Setup ---
-        # Configure logging to write to a file within our AppData folder.
-        # This provides a persistent record of operations and errors for debugging.
-        log_file = os.path.join(self.appdata_path, 'battery_z.log')
-        # Use a RotatingFileHandler to automatically manage log file size, preventing it from
-        # growing indefinitely. It will keep 3 backup logs, each up to 5MB.
-        log_handler = RotatingFileHandler(log_file, maxBytes=5*1024*1024, backupCount=3)
-        # Set the logging level to INFO, and define a clear format for log messages.
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            handlers=[log_handler]
-        )
-        
-        # --- Cache Initialization ---
-        # Load the cache from disk. This is a dictionary holding semi-static battery
-        # information to speed up subsequent app launches.
-        self.cache = self.load_cache()
-        # Log the result of the cache loading operation.
-        logging.info("BatteryIntelligence initialized. Cache loaded with %d items.", len(self.cache))
+        self.path = path
+        self.lookup = lookup or get_windows_install_date
+        self._lock = threading.Lock()        # Serializes resolution, so the lookup runs at most once.
+        self._resolved = False
+        self._resolved_at = 0.0              # When the lookup ran; a failed one is retried after INSTALL_DATE_RETRY_SECONDS.
+        self._value: Optional[datetime.datetime] = None
+
+    def _is_current(self) -> bool:
+        """True if a result is known and is either a date or a failed lookup that is not yet due for a retry."""
+        return self._resolved and (self._value is not None
+                                   or time.time() - self._resolved_at < INSTALL_DATE_RETRY_SECONDS)
+
+    def _load(self) -> bool:
+        """Loads a previously persisted result. Returns True if one was found and is still current."""
+        if not self.path:
+            return False
+        try:
+            with open(self.path, 'r') as f:
+                stored = json.load(f)
+            value = stored.get("install_date")
+            self._value = datetime.datetime.fromisoformat(value) if value else None
+            self._resolved_at = float(stored.get("resolved_at", 0))
+            self._resolved = True
+            return self._is_current()
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logging.error("Failed to load persisted install date: %s", e)
+            return False
 
-    # --- Caching Methods ---
-    
-    def load_cache(self) -> Dict:
+    def _save(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path, 'w') as f:
+                json.dump({"install_date": self._value.isoformat() if self._value else None,
+                           "resolved_at": self._resolved_at}, f, indent=4)
+        except Exception as e:
+            logging.error("Failed to persist install date: %s", e)
+
+    def peek(self) -> Optional[datetime.datetime]:
+        """Returns the date if it has already been resolved. Never blocks and never runs a subprocess."""
+        return self._value
+
+    def is_resolved(self) -> bool:
         """
-        Loads the battery data cache from a JSON file. The cache is considered
-        valid for 24 hours to balance performance with data freshness.
+        True once a lookup (or a persisted result) has been loaded, even if the date
+        is unknown. A failed lookup stops counting once it is due for a retry.
+        """
+        return self._is_current()
 
-        Returns:
-            Dict: The loaded cache dictionary, or an empty dictionary if the
-                cache is invalid, missing, or corrupt.
+    def get(self) -> Optional[datetime.datetime]:
         """
-        # Check if the cache file actually exists on disk.
-        if os.path.exists(self.cache_file):
-            # Use a try-except block to handle potential file reading or JSON parsing errors.
+        Returns the install date, resolving it on the calling thread on first use,
+        or again once a failed lookup is due for a retry. Must not be called from
+        the UI thread; use peek() or get_async() there.
+        """
+        if self._is_current():
+            return self._value
+        with self._lock:
+            if not self._is_current() and not self._load():
+                start = time.perf_counter()
+                self._value = self.lookup()
+                self._resolved = True
+                self._resolved_at = time.time()
+                self._save()
+                logging.info("Install date resolved in %.2f s: %s", time.perf_counter() - start, self._value)
+        return self._value
+
+    def get_async(self, callback: Callable[[Optional[datetime.datetime]], None]):
+        """
+        Calls `callback` with the install date. If it still has to be resolved,
+        that happens on a background thread, and the callback runs there too.
+        """
+        if self._is_current():
+            callback(self._value)
+            return
+        def resolve():
             try:
-                # Open the cache file for reading.
-                with open(self.cache_file, 'r') as f:
-                    # Parse the JSON content into a Python dictionary.
-                    cache = json.load(f)
-                    # Define cache validity period in seconds (24 hours).
-                    cache_validity_seconds = 86400
-                    # Check if the cache is still fresh by comparing its timestamp to the current time.
-                    if time.time() - cache.get("last_updated", 0) < cache_validity_seconds:
-                        # If the cache is fresh, log it and return the data.
-                        logging.info("Valid cache found. Loading data from cache.")
-                        return cache
-                    else:
-                        # If the cache is stale, log it and it will be overwritten.
-                        logging.info("Cache is stale. A new cache will be created.")
-            # If any error occurs (e.g., corrupted JSON), log the error.
+                callback(self.get())
             except Exception as e:
-                logging.error("Failed to load or validate cache: %s", e)
-        # If the file doesn't exist or loading failed, return an empty dictionary.
-        return {}
+                logging.error("Asynchronous install date lookup failed: %s", e)
+        threading.Thread(target=resolve, name="BatteryZ-InstallDate", daemon=True).start()
 
-    def save_cache(self):
+def get_app_data_dir() -> str:
+    """
+    Returns the per-user directory where Battery-Z keeps its cache, reports and logs:
+    %APPDATA%\\BatteryZ_Data on Windows, $XDG_DATA_HOME/BatteryZ_Data (by default
+    ~/.local/share/BatteryZ_Data) elsewhere.
+    """
+    base = os.getenv('APPDATA') or os.getenv('XDG_DATA_HOME') or os.path.join(os.path.expanduser("~"), ".local", "share")
+    return os.path.join(base, 'BatteryZ_Data')
+
+
+# ============================================================================
+# SECTION 5.5: WMI CONNECTION MANAGEMENT
+# Description: WMI connections are expensive to build. Every connection requires
+#              COM to be initialized on the calling thread, and a new
+#              `wmi.WMI()` moniker costs tens to hundreds of milliseconds. The
+#              classes below keep COM initialized and cache one connection per
+#              namespace for the whole lifetime of a thread, so the 3-second
+#              real-time poll only pays for the query itself.
+# ============================================================================
+
+class Win32WMIBackend:
+    """
+    The production backend for WMIConnectionManager. It is a thin adapter over
+    `pythoncom` and the `wmi` package.
+    """
+    def co_initialize(self):
+        """Initializes COM for the calling thread."""
+        pythoncom.CoInitialize()
+
+    def co_uninitialize(self):
+        """Uninitializes COM for the calling thread."""
+        pythoncom.CoUninitialize()
+
+    def connect(self, namespace: str):
+        """Opens a new WMI connection to the given namespace."""
+        # The default constructor targets root\cimv2, which is how the rest of the app always called it.
+        if namespace == WMI_CIMV2_NAMESPACE:
+            return wmi.WMI()
+        return wmi.WMI(namespace=namespace)
+
+
+class FakeWMIBackend:
+    """
+    An in-memory stand-in for WMI. Instances of each WMI class are registered as
+    plain dictionaries and are returned as attribute objects, exactly like the
+    real `wmi` package returns them. This lets the WMI code paths be exercised
+    on machines without Windows (e.g. a Linux CI runner).
+
+    Example:
+        backend = FakeWMIBackend()
+        backend.set_instances(WMI_BATTERY_NAMESPACE, "BatteryStatus", [{"Voltage": 12400}])
+        manager = WMIConnectionManager(backend)
+    """
+    def __init__(self, classes: Optional[Dict[str, Dict[str, List[Dict[str, Any]]]]] = None):
+        # { namespace: { class_name: [ {property: value}, ... ] } }
+        self.classes = classes or {}
+        # Counters that make the caching behaviour observable.
+        self.connect_count = 0
+        self.co_initialize_count = 0
+        self.co_uninitialize_count = 0
+        self.query_count = 0
+        # Namespaces whose next query will raise, to simulate a dropped connection.
+        self._pending_failures: Dict[str, int] = defaultdict(int)
+
+    def set_instances(self, namespace: str, class_name: str, instances: List[Dict[str, Any]]):
+        """Registers (or replaces) the instances returned for a WMI class."""
+        self.classes.setdefault(namespace, {})[class_name] = list(instances)
+
+    def fail_next(self, namespace: str, times: int = 1):
+        """Makes the next `times` queries against a namespace raise an error."""
+        self._pending_failures[namespace] += times
+
+    def co_initialize(self):
+        self.co_initialize_count += 1
+
+    def co_uninitialize(self):
+        self.co_uninitialize_count += 1
+
+    def connect(self, namespace: str):
+        self.connect_count += 1
+        return _FakeWMIConnection(self, namespace)
+
+
+class _FakeWMIConnection:
+    """A connection object handed out by FakeWMIBackend."""
+    def __init__(self, backend: FakeWMIBackend, namespace: str):
+        self._backend = backend
+        self._namespace = namespace
+
+    def __getattr__(self, class_name: str):
+        # Attribute access returns a callable, mirroring `connection.Win32_Battery()`.
+        def _query(**filters):
+            backend = self._backend
+            backend.query_count += 1
+            if backend._pending_failures[self._namespace] > 0:
+                backend._pending_failures[self._namespace] -= 1
+                raise RuntimeError(f"Simulated WMI failure in namespace {self._namespace}")
+            instances = backend.classes.get(self._namespace, {}).get(class_name)
+            if instances is None:
+                raise AttributeError(f"WMI class {class_name} not found in {self._namespace}")
+            # Apply simple equality filters, as wmi does for keyword arguments.
+            matched = [inst for inst in instances if all(inst.get(k) == v for k, v in filters.items())]
+            return [SimpleNamespace(**inst) for inst in matched]
+        return _query
+
+
+class WMIConnectionManager:
+    """
+    Keeps COM initialized and caches one WMI connection per namespace for each
+    thread that uses it. Connections are apartment-bound COM objects, so the
+    cache is thread-local: every worker thread gets its own connections and
+    must call `release()` before it exits.
+
+    If a query fails, the cached connection is dropped and the query is retried
+    once on a fresh connection. This recovers from connections invalidated by
+    sleep/resume or a WMI service restart. A class that still fails on a fresh
+    connection is simply unsupported on this hardware (e.g. thermal zones), so
+    later failures for it are raised directly instead of reconnecting on every tick.
+    """
+    def __init__(self, backend=None):
         """
-        Saves the current state of the self.cache dictionary to the JSON file.
-        It also injects a 'last_updated' timestamp.
+        Args:
+            backend: The object that performs COM setup and opens connections.
+                Defaults to the real pythoncom/wmi backend when WMI is available.
+                Pass a FakeWMIBackend to run without Windows.
         """
-        # Use a try-except block to handle potential file writing errors.
-        try:
-            # Add/update the timestamp to mark when this cache was saved.
-            self.cache["last_updated"] = time.time()
-            # Open the cache file for writing.
-            with open(self.cache_file, 'w') as f:
-                # Dump the cache dictionary to the file with an indent for readability.
-                json.dump(self.cache, f, indent=4)
-            # Log the successful save operation.
-            logging.info("Cache saved successfully to %s", self.cache_file)
-        # If an error occurs (e.g., disk full, permissions error), log it.
-        except Exception as e:
-            logging.error("Failed to save cache: %s", e)
-            
-    # --- Primary Data Orchestration Method ---
-    
-    def get_all_data(self) -> BatteryData:
+        if backend is None and WMI_AVAILABLE:
+            backend = Win32WMIBackend()
+        self.backend = backend
+        self._local = threading.local()
+
+    @property
+    def available(self) -> bool:
+        """True if there is a backend that can service WMI queries."""
+        return self.backend is not None
+
+    def _thread_state(self) -> Dict[str, Any]:
+        """Returns the per-thread COM and connection state, creating it on first use."""
+        state = getattr(self._local, "state", None)
+        if state is None:
+            state = {"com_initialized": False, "connections": {}, "unsupported": set()}
+            self._local.state = state
+        return state
+
+    def connection(self, namespace: str = WMI_CIMV2_NAMESPACE):
         """
-        This is the main orchestration method. It calls all individual data
-        fetching functions, populates the BatteryData object, performs calculations,
-        and returns the final, consolidated result.
+        Returns the calling thread's cached connection to a namespace, initializing
+        COM and connecting on first use.
+        """
+        if not self.available:
+            raise RuntimeError("No WMI backend is available on this system.")
+        state = self._thread_state()
+        # Initialize COM once per thread instead of once per query.
+        if not state["com_initialized"]:
+            self.backend.co_initialize()
+            state["com_initialized"] = True
+        conn = state["connections"].get(namespace)
+        if conn is None:
+            conn = self.backend.connect(namespace)
+            state["connections"][namespace] = conn
+            logging.info("Opened persistent WMI connection to %s on thread %s.", namespace, threading.current_thread().name)
+        return conn
+
+    def query(self, class_name: str, namespace: str = WMI_CIMV2_NAMESPACE, **filters) -> List[Any]:
+        """
+        Runs a WMI class query on the cached connection, reconnecting once on failure.
+
+        Args:
+            class_name (str): The WMI class to query (e.g., "BatteryStatus").
+            namespace (str): The namespace the class lives in.
+            **filters: Optional property filters passed through to WMI.
 
         Returns:
-            BatteryData: A fully populated dataclass with all available battery info.
+            List[Any]: The matching WMI instances.
         """
-        # Create a new, empty BatteryData object for this fetch cycle.
-        data = BatteryData()
-        # Record the start time of the fetch operation.
-        data.fetch_timestamp = datetime.datetime.now()
-        
-        # --- Step 1: Check for Battery Presence ---
-        # Use psutil as a fast, primary check for whether a battery exists.
-        if PSUTIL_AVAILABLE:
+        state = self._thread_state()
+        key = (namespace, class_name)
+        try:
+            result = list(getattr(self.connection(namespace), class_name)(**filters))
+        except Exception as e:
+            # A class known to be unsupported fails fast, without tearing down a healthy connection.
+            if key in state["unsupported"]:
+                raise
+            logging.warning("WMI query %s in %s failed: %s. Reconnecting and retrying once.", class_name, namespace, e)
+            self.invalidate(namespace)
             try:
-                # If psutil.sensors_battery() returns None, no battery is detected.
-                if psutil.sensors_battery() is None:
-                    data.battery_present = False
-                    logging.warning("No battery detected via psutil. Assuming desktop PC.")
-                else:
-                    data.battery_present = True
-            except Exception as e:
-                logging.error("psutil check failed: %s. Assuming battery is present as a fallback.", e)
-                # If psutil fails, assume a battery is present and let other methods confirm.
-                data.battery_present = True
+                result = list(getattr(self.connection(namespace), class_name)(**filters))
+            except Exception:
+                state["unsupported"].add(key)
+                raise
+        state["unsupported"].discard(key)
+        return result
+
+    def invalidate(self, namespace: Optional[str] = None):
+        """Drops the calling thread's cached connection(s) so the next query reconnects."""
+        state = self._thread_state()
+        if namespace is None:
+            state["connections"].clear()
         else:
-            # If psutil isn't available, we must assume a battery might be present.
-            data.battery_present = True
-            
-        # If no battery is present, we can stop early.
-        if not data.battery_present:
-            # Populate basic system info even for desktops.
-            data.laptop_manufacturer, data.laptop_model = self._get_system_info()
-            return data
-            
-        # --- Step 2: Fetch and Consolidate Data from All Sources ---
-        # This is where the multi-layered fallback strategy happens.
-        
-        # Fetch basic system info first.
-        data.laptop_manufacturer, data.laptop_model = self._get_system_info()
-        
-        # Generate the powercfg report if needed. This is a slow operation, so we
-        # do it once and then parse data from it in multiple functions.
-        self._generate_battery_report()
-        
-        # Fetch static data (things that don't change often, like serial number, design capacity).
-        static_info = self._get_static_battery_info()
-        data.battery_name = static_info.get("name")
-        data.battery_manufacturer = static_info.get("manufacturer")
-        data.battery_serial = static_info.get("serial")
-        data.design_capacity_mwh = static_info.get("design_capacity")
-        data.full_charge_capacity_mwh = static_info.get("full_charge_capacity")
-        
-        # Fetch cycle count using its own multi-fallback logic.
-        data.cycle_count = self._get_cycle_count()
-        
-        # Fetch chemistry using its own multi-fallback logic.
-        raw_chem = self._get_chemistry()
-        # Normalize the fetched chemistry name for consistency.
-        data.battery_chemistry = normalize_chemistry_name(raw_chem)
-        
-        # Look up rated cycles based on the fetched data.
-        data.rated_cycle_life = get_manufacturer_rated_cycles(
-            data.laptop_manufacturer, 
-            data.laptop_model, 
-            data.battery_chemistry
-        )
-        
-        # --- Step 3: Fetch Real-time Dynamic Data ---
-        # This data changes frequently (charge level, voltage, etc.).
-        dynamic_info = self._get_dynamic_battery_status()
-        data.current_percentage = dynamic_info.get("percent")
-        data.ac_online = dynamic_info.get("ac_online")
-        data.is_charging = dynamic_info.get("is_charging")
-        data.time_to_empty_seconds = dynamic_info.get("time_remaining")
-        data.current_voltage_mv = dynamic_info.get("voltage_mv")
-        data.power_draw_watts = dynamic_info.get("power_watts")
-        data.temperature_celsius = self._get_temperature() # Temperature has its own fallback chain.
-        
-        # --- Step 4: Final Calculations and Data Cleanup ---
-        
-        # If a custom cycle count is set by the user, override the fetched value.
-        if CUSTOM_CYCLE_COUNT is not None:
-            data.cycle_count = CUSTOM_CYCLE_COUNT
-            
-        # Save the consolidated static data to cache for the next run.
-        self.cache.update({
-            "manufacturer": data.battery_manufacturer,
-            "serial_number": data.battery_serial,
-            "chemistry": data.battery_chemistry,
-            "design_capacity": data.design_capacity_mwh,
-            "full_charge_capacity": data.full_charge_capacity_mwh,
-            "cycle_count": data.cycle_count,
-            "total_cycles": data.rated_cycle_life,
-            "battery_name": data.battery_name
-        })
-        self.save_cache()
-        
-        # Log a summary of the key fetched values for debugging.
-        logging.info(
-            "Data fetch complete. Cycles: %s, Design: %s mWh, FCC: %s mWh, Chem: %s",
-            data.cycle_count, data.design_capacity_mwh, data.full_charge_capacity_mwh, data.battery_chemistry
-        )
-        
-        # Return the final, populated data object.
-        return data
-
-    # --- Calculation Methods (from reference.py) ---
+            state["connections"].pop(namespace, None)
 
-    def calculate_health(self, data: BatteryData) -> float:
+    def release(self):
         """
-        [ALGORITHM FIXED] Calculates battery health using a research-based,
-        multi-factor model. The bug that incorrectly capped the health value,
-        ignoring the cycle count's impact, has been removed.
+        Drops every cached connection for the calling thread and uninitializes COM.
+        Must be called on the same thread that issued the queries, before it exits.
+        """
+        state = getattr(self._local, "state", None)
+        if state is None:
+            return
+        # Connections must be released before COM is torn down.
+        state["connections"].clear()
+        if state["com_initialized"]:
+            try:
+                self.backend.co_uninitialize()
+            except Exception as e:
+                logging.warning("COM uninitialization failed: %s", e)
+        self._local.state = None
 
-        Args:
-            data (BatteryData): The populated battery data object.
 
-        Returns:
-            float: The calculated health percentage (0-100).
-        """
-        if not data.has_valid_capacity_data():
-            logging.warning("Cannot calculate health due to invalid capacity data.")
-            return 0.0
+# ============================================================================
+# SECTION 5.6: POWERCFG BATTERY REPORT PARSING
+# Description: A streaming parser for the powercfg XML report. The report grows
+#              to megabytes once usage history accumulates, but everything the
+#              data sources need (<SystemInformation> and <Batteries>) sits in
+#              its first few kilobytes. So the regular parse stops as soon as
+#              both have closed, and only the history import streams the whole
+#              file, discarding each element once it is converted. Parses are
+#              memoized on (path, mtime, size), so all consumers in a fetch
+#              cycle share one parse.
+# ============================================================================
 
-        # --- Step 1: Gather Inputs and Validate ---
-        design_cap = float(data.design_capacity_mwh)
-        full_cap = float(data.full_charge_capacity_mwh)
-        cycle_count = float(data.cycle_count if data.cycle_count is not None and data.cycle_count >= 0 else 0)
-        total_cycles = float(data.rated_cycle_life if data.rated_cycle_life > 0 else 1000)
-        
-        # --- Step 2: Calculate Primary Health Indicators (HIs) ---
-        # HI 1: Capacity Health (SOH_c) - The direct physical measurement.
-        soh_c = (full_cap / design_cap) * 100.0
-        
-        # HI 2: Cycle Health (SOH_cyc) - The wear based on usage.
-        cycle_ratio = min(cycle_count / total_cycles, 1.5) # Allow ratio to go beyond 1.0 for old batteries
-        soh_cyc = 100.0 * (1 - (0.2 * (cycle_ratio ** 1.5))) # Non-linear degradation model
-        
-        # --- Step 3: Fuse the Health Indicators using dynamic weighting ---
-        if cycle_ratio < 0.1: # Battery is new
-            capacity_weight = 0.4
-            cycle_weight = 0.6
-        elif cycle_ratio > 0.8: # Battery is old
-            capacity_weight = 0.8
-            cycle_weight = 0.2
-        else: # For mid-life batteries
-            capacity_weight = 0.7
-            cycle_weight = 0.3
-            
-        final_health = (soh_c * capacity_weight) + (soh_cyc * cycle_weight)
-        
-        # --- Step 4: Final Clamping and Validation ---
-        # BUG FIX: The line 'final_health = min(final_health, soh_c)' has been REMOVED.
+# Memoized parses, keyed by (path, mtime_ns, size). Only the latest few file versions are kept.
+_BATTERY_REPORT_CACHE: Dict[Tuple[str, int, int], "BatteryReport"] = {}
+_BATTERY_REPORT_CACHE_LOCK = threading.Lock()
+_BATTERY_REPORT_CACHE_SIZE = 4
+
+# The sections a header parse reads before it stops.
+_BATTERY_REPORT_HEADER_SECTIONS = frozenset(("SystemInformation", "Batteries"))
+
+# ISO-8601 durations as written by powercfg, e.g., "PT1H2M3.5S" or "P1DT2H".
+_ISO_DURATION_PATTERN = re.compile(r'^P(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:([\d.]+)S)?)?$')
+
+def _strip_xml_namespace(tag: str) -> str:
+    """Removes the '{namespace}' prefix that ElementTree adds to every tag."""
+    return tag.rsplit('}', 1)[-1]
+
+def _parse_report_timestamp(value: Optional[str]) -> Optional[datetime.datetime]:
+    """Parses a powercfg ISO-8601 timestamp into a naive datetime, or returns None."""
+    if not value:
+        return None
+    text = value.strip().rstrip('Z')
+    # fromisoformat() accepts at most 6 fractional digits; powercfg sometimes writes 7.
+    if '.' in text:
+        head, frac = text.split('.', 1)
+        text = f"{head}.{frac[:6]}"
+    try:
+        parsed = datetime.datetime.fromisoformat(text)
+    except ValueError:
+        return None
+    return parsed.replace(tzinfo=None) if parsed.tzinfo else parsed
+
+def _parse_report_duration(value: Optional[str]) -> float:
+    """Converts an ISO-8601 duration (e.g., 'PT1H2M3S') into seconds."""
+    match = _ISO_DURATION_PATTERN.match((value or "").strip())
+    if not match:
+        return 0.0
+    days, hours, minutes, seconds = match.groups()
+    return (safe_int(days) * 86400 + safe_int(hours) * 3600 +
+            safe_int(minutes) * 60 + safe_float(seconds))
+
+def _optional_int(value: Optional[str]) -> Optional[int]:
+    """Converts report text to int, keeping 'missing' distinct from zero."""
+    if not value:
+        return None
+    try:
+        # Fast path: powercfg writes plain integers.
+        return int(value)
+    except ValueError:
+        return safe_int(value, default=None)
+
+def iter_battery_report(path: str, history: bool = True):
+    """
+    Streams the records of a powercfg XML battery report one at a time.
+    Memory use stays bounded regardless of file size because every element is
+    cleared and detached from its parent as soon as it has been converted.
+
+    Args:
+        path (str): Path to the XML report.
+        history (bool): If False, history rows are skipped and reading stops as
+            soon as <SystemInformation> and <Batteries> have both closed.
+
+    Yields:
+        Tuple[str, Any]: ("system", Dict[str, str]), ("battery", ReportBattery),
+            ("capacity", CapacityHistoryEntry) or ("usage", UsageHistoryEntry).
+    """
+    # A stack of open elements, so finished entries can be detached from their parent.
+    stack = []
+    pending_sections = set(_BATTERY_REPORT_HEADER_SECTIONS)
+    # Opened here rather than by iterparse, so stopping early closes the file at once
+    # (Windows cannot replace a report that is still open).
+    with open(path, 'rb') as source:
+        for event, elem in ET.iterparse(source, events=("start", "end")):
+            if event == "start":
+                stack.append(elem)
+                continue
+            stack.pop()
+            tag = _strip_xml_namespace(elem.tag)
+
+            if tag in ("UsageEntry", "HistoryEntry") and not history:
+                pass    # Skipped rows are only discarded.
+            elif tag == "UsageEntry":
+                attrs = elem.attrib
+                ac_value = attrs.get("Ac")
+                yield "usage", UsageHistoryEntry(
+                    timestamp=_parse_report_timestamp(attrs.get("LocalTimestamp") or attrs.get("Timestamp")),
+                    duration_seconds=_parse_report_duration(attrs.get("Duration")),
+                    ac_online=(ac_value == "1") if ac_value is not None else None,
+                    entry_type=attrs.get("EntryType"),
+                    charge_capacity_mwh=_optional_int(attrs.get("ChargeCapacity")),
+                    full_charge_capacity_mwh=_optional_int(attrs.get("FullChargeCapacity")),
+                    discharge_mwh=_optional_int(attrs.get("Discharge")),
+                )
+            elif tag == "HistoryEntry":
+                attrs = elem.attrib
+                yield "capacity", CapacityHistoryEntry(
+                    start=_parse_report_timestamp(attrs.get("LocalStartDate") or attrs.get("StartDate")),
+                    end=_parse_report_timestamp(attrs.get("LocalEndDate") or attrs.get("EndDate")),
+                    design_capacity_mwh=_optional_int(attrs.get("DesignCapacity")),
+                    full_charge_capacity_mwh=_optional_int(attrs.get("FullChargeCapacity")),
+                    cycle_count=_optional_int(attrs.get("CycleCount")),
+                )
+            elif tag == "Battery":
+                fields = {_strip_xml_namespace(child.tag): (child.text or "").strip() for child in elem}
+                yield "battery", ReportBattery(
+                    name=fields.get("Id") or None,
+                    manufacturer=fields.get("Manufacturer") or None,
+                    serial=fields.get("SerialNumber") or None,
+                    chemistry=fields.get("Chemistry") or None,
+                    design_capacity_mwh=_optional_int(fields.get("DesignCapacity")),
+                    full_charge_capacity_mwh=_optional_int(fields.get("FullChargeCapacity")),
+                    cycle_count=_optional_int(fields.get("CycleCount")),
+                )
+            elif tag == "SystemInformation":
+                yield "system", {_strip_xml_namespace(child.tag): (child.text or "").strip()
+                                 for child in elem if len(child) == 0}
+            elif stack and _strip_xml_namespace(stack[-1].tag) in ("Battery", "SystemInformation"):
+                # Child fields (e.g., <CycleCount>) are read when their enclosing element closes.
+                continue
+
+            if tag in pending_sections:
+                pending_sections.discard(tag)
+                if not history and not pending_sections:
+                    return
+
+            # Free the element and detach it from its parent so the tree never grows.
+            elem.clear()
+            if stack:
+                try:
+                    stack[-1].remove(elem)
+                except ValueError:
+                    pass
+
+def parse_battery_report(path: str, history: bool = False) -> BatteryReport:
+    """
+    Parses a powercfg XML battery report in a single streaming pass. By default
+    only the system information and batteries are read, which is all the data
+    sources use, and the rest of the file is never touched.
+
+    Args:
+        path (str): Path to the XML report.
+        history (bool): Also read the capacity and usage history, to the end of the file.
+
+    Returns:
+        BatteryReport: The typed report.
+
+    Raises:
+        ET.ParseError, OSError: If the file is unreadable or not well-formed XML.
+    """
+    report = BatteryReport(path=path)
+    for kind, record in iter_battery_report(path, history=history):
+        if kind == "usage":
+            report.usage_history.append(record)
+        elif kind == "capacity":
+            report.capacity_history.append(record)
+        elif kind == "battery":
+            report.batteries.append(record)
+        elif kind == "system":
+            report.system_info = record
+    return report
+
+def is_battery_report_complete(path: str) -> bool:
+    """
+    Cheap check that a report was written to the end: the header parse stops
+    early, so a truncated file is caught by its missing closing root tag instead.
+    """
+    try:
+        with open(path, 'rb') as f:
+            f.seek(max(0, os.path.getsize(path) - 256))
+            return b"</BatteryReport>" in f.read()
+    except OSError:
+        return False
+
+def _battery_report_cache_key(path: str) -> Optional[Tuple[str, int, int]]:
+    """The memo key for the current version of a report file, or None if it is missing."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+def _store_battery_report(key: Tuple[str, int, int], report: BatteryReport):
+    """Adds a parse to the memo. The caller holds _BATTERY_REPORT_CACHE_LOCK."""
+    # Evict the oldest entries; dicts preserve insertion order.
+    while len(_BATTERY_REPORT_CACHE) >= _BATTERY_REPORT_CACHE_SIZE:
+        _BATTERY_REPORT_CACHE.pop(next(iter(_BATTERY_REPORT_CACHE)))
+    _BATTERY_REPORT_CACHE[key] = report
+
+def remember_battery_report(path: str, report: BatteryReport):
+    """
+    Memoizes an already parsed report under `path`, e.g. after a validated
+    temporary file has been moved there, so the next load is a hit.
+    """
+    key = _battery_report_cache_key(path)
+    if key is None:
+        return
+    report.path = path
+    with _BATTERY_REPORT_CACHE_LOCK:
+        _store_battery_report(key, report)
+
+def load_battery_report(path: str) -> Optional[BatteryReport]:
+    """
+    Returns the parsed battery report for `path` (without its history; see
+    parse_battery_report), parsing it only if this exact version of the file
+    (same mtime and size) has not been parsed before.
+
+    Returns:
+        Optional[BatteryReport]: The parsed report, or None if the file is
+            missing or cannot be parsed.
+    """
+    key = _battery_report_cache_key(path)
+    if key is None:
+        return None
+
+    # The lock is held across the parse so concurrent consumers wait for one parse instead of each running their own.
+    with _BATTERY_REPORT_CACHE_LOCK:
+        report = _BATTERY_REPORT_CACHE.get(key)
+        if report is not None:
+            return report
+        try:
+            start = time.perf_counter()
+            report = parse_battery_report(path)
+            logging.info(
+                "Parsed powercfg report header (%d bytes) in %.1f ms: %d batteries.",
+                key[2], (time.perf_counter() - start) * 1000, len(report.batteries)
+            )
+        except (ET.ParseError, OSError) as e:
+            logging.error("Failed to parse powercfg XML report: %s", e)
+            return None
+        _store_battery_report(key, report)
+        return report
+
+
+# ============================================================================
+# SECTION 5.7: CONCURRENT DATA COLLECTION
+# Description: A small engine that runs independent data sources on a bounded
+#              thread pool, each with its own deadline. Sources may depend on
+#              other sources (e.g., report parsing waits for report generation)
+#              and start as soon as their dependencies have finished, so the
+#              wall-clock time of a fetch approaches the slowest dependency
+#              chain instead of the sum of every source.
+# ============================================================================
+
+@dataclass
+class CollectionSource:
+    """A single data source for DataCollectionEngine."""
+    name: str                                       # Unique key of the result, e.g., "cycle_count".
+    func: Callable[[], Any]                         # The (blocking) function that produces the value.
+    default: Any = None                             # Used if the source fails or misses its deadline.
+    deadline: float = 15.0                          # Seconds the source may run, measured from its start.
+    depends_on: Tuple[str, ...] = ()                # Sources that must finish before this one starts.
+
+class _CollectionThreadPool:
+    """
+    The long-lived threads of a DataCollectionEngine. A thread keeps its provider
+    resources (e.g., its WMI connections) from one fetch to the next, and calls
+    thread_cleanup exactly once, on itself, when it exits. A thread stuck in a
+    source past its deadline is written off and replaced, so it cannot starve later
+    fetches; when that source finally returns, its thread retires instead of staying
+    on as a spare.
+    """
+    def __init__(self, max_workers: int, thread_cleanup: Optional[Callable[[], None]]):
+        self.max_workers = max_workers
+        self.thread_cleanup = thread_cleanup
+        self._tasks: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._threads = 0                       # Live threads.
+        self._waiting = 0                       # Threads waiting for a task.
+        self._queued = 0                        # Tasks not yet picked up by a thread.
+        self._stuck = 0                         # Threads written off as stuck that have not retired yet.
+        self._running: Dict[concurrent.futures.Future, bool] = {}    # Task being run -> written off.
+        self._shutdown = False
+
+    def submit(self, func: Callable, *args) -> concurrent.futures.Future:
+        future = concurrent.futures.Future()
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("The collection thread pool has been shut down.")
+            self._tasks.put((future, func, args))
+            self._queued += 1
+            self._start_thread_if_needed()
+        return future
+
+    def replace_stuck_thread(self, future: concurrent.futures.Future):
+        """Writes off the thread running `future` and starts another if work is waiting."""
+        with self._lock:
+            if self._shutdown or self._running.get(future) is not False:
+                return
+            self._running[future] = True
+            self._stuck += 1
+            self._start_thread_if_needed()
+
+    def _start_thread_if_needed(self):
+        """Starts a thread when queued work outnumbers waiting threads. The caller holds the lock."""
+        if self._queued > self._waiting and self._threads - self._stuck < self.max_workers:
+            self._threads += 1
+            threading.Thread(target=self._worker, name=f"BatteryZ-Collect-{self._threads}", daemon=True).start()
+
+    def _worker(self):
+        try:
+            while True:
+                with self._lock:
+                    self._waiting += 1
+                task = self._tasks.get()
+                with self._lock:
+                    self._waiting -= 1
+                    if task is None:
+                        return
+                    self._queued -= 1
+                    future, func, args = task
+                    self._running[future] = False
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(func(*args))
+                    except BaseException as e:
+                        future.set_exception(e)
+                with self._lock:
+                    if self._running.pop(future):
+                        self._stuck -= 1
+                        return
+        finally:
+            with self._lock:
+                self._threads -= 1
+            if self.thread_cleanup:
+                try:
+                    self.thread_cleanup()
+                except Exception as e:
+                    logging.warning("Collection thread cleanup failed: %s", e)
+
+    def shutdown(self):
+        """Stops every thread once it is idle. Each releases its own resources on the way out."""
+        with self._lock:
+            self._shutdown = True
+            for _ in range(self._threads):
+                self._tasks.put(None)
+
+class DataCollectionEngine:
+    """
+    Runs CollectionSources concurrently on a bounded pool of long-lived threads.
+    A failed or late source never blocks the others: it is replaced by its
+    default value and an error message is recorded.
+    """
+    def __init__(self, max_workers: int = COLLECTION_MAX_WORKERS, thread_cleanup: Optional[Callable[[], None]] = None):
+        """
+        Args:
+            max_workers (int): The size of the thread pool.
+            thread_cleanup (Callable): Called once on each pool thread before it exits,
+                e.g., to release that thread's WMI connections. Threads exit when the
+                engine is closed or garbage collected; at interpreter exit they may not.
+        """
+        self.max_workers = max_workers
+        self.thread_cleanup = thread_cleanup
+        self._pool = _CollectionThreadPool(max_workers, thread_cleanup)
+        # The threads only reference the pool, so a discarded engine can still shut them down.
+        self._finalizer = weakref.finalize(self, self._pool.shutdown)
+
+    def close(self):
+        """Shuts the pool threads down. Each releases its own resources once it is idle."""
+        self._finalizer()
+
+    @staticmethod
+    def _run_source(source: CollectionSource) -> Tuple[Any, float]:
+        """Executes one source on a pool thread and measures its latency."""
+        start = time.perf_counter()
+        return source.func(), time.perf_counter() - start
+
+    def run(self, sources: List[CollectionSource]) -> Tuple[Dict[str, Any], List[str], List[str]]:
+        """
+        Runs all sources and waits until each one has finished or missed its deadline.
+
+        Args:
+            sources (List[CollectionSource]): The sources to run.
+
+        Returns:
+            Tuple[Dict[str, Any], List[str], List[str]]: The value of every source,
+                keyed by name, a list of human-readable errors, and the names of the
+                sources that failed or were late and so only hold their default.
+        """
+        results: Dict[str, Any] = {}
+        errors: List[str] = []
+        failed: List[str] = []
+        latencies: Dict[str, float] = {}
+        waiting = {source.name: source for source in sources}
+        known = set(waiting)
+        running: Dict[concurrent.futures.Future, Tuple[CollectionSource, float]] = {}
+        fetch_start = time.perf_counter()
+
+        try:
+            while waiting or running:
+                # --- Start every source whose dependencies have all finished ---
+                # A dependency that is not part of this run is treated as already satisfied.
+                for name, source in list(waiting.items()):
+                    if all(dep in results or dep not in known for dep in source.depends_on):
+                        del waiting[name]
+                        running[self._pool.submit(self._run_source, source)] = (source, time.perf_counter())
+
+                if not running:
+                    # Only sources with circular dependencies are left.
+                    for name, source in waiting.items():
+                        results[name] = source.default
+                        failed.append(name)
+                        errors.append(f"{name}: unresolved dependencies {source.depends_on}")
+                    break
+
+                # --- Wait for the next completion or the nearest deadline ---
+                now = time.perf_counter()
+                next_deadline = min(started + source.deadline for source, started in running.values())
+                done, _ = concurrent.futures.wait(
+                    list(running), timeout=max(0.0, next_deadline - now),
+                    return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    source, _ = running.pop(future)
+                    try:
+                        results[source.name], latencies[source.name] = future.result()
+                    except Exception as e:
+                        results[source.name] = source.default
+                        failed.append(source.name)
+                        errors.append(f"{source.name}: {e}")
+                        logging.error("Data source '%s' failed: %s", source.name, e)
+
+                # --- Abandon sources that missed their deadline ---
+                now = time.perf_counter()
+                for future, (source, started) in list(running.items()):
+                    if now - started >= source.deadline:
+                        del running[future]
+                        self._abandon(future)
+                        results[source.name] = source.default
+                        failed.append(source.name)
+                        errors.append(f"{source.name}: timed out after {source.deadline:.1f}s")
+                        logging.error("Data source '%s' missed its %.1f s deadline. Using its default value.", source.name, source.deadline)
+        finally:
+            # Only reached with sources still running if the loop raised.
+            for future in running:
+                self._abandon(future)
+
+        if latencies:
+            slowest = max(latencies, key=latencies.get)
+            logging.info(
+                "Collected %d sources in %.0f ms (sum of source latencies %.0f ms; slowest '%s' %.0f ms).",
+                len(results), (time.perf_counter() - fetch_start) * 1000,
+                sum(latencies.values()) * 1000, slowest, latencies[slowest] * 1000
+            )
+        return results, errors, failed
+
+    def _abandon(self, future: concurrent.futures.Future):
+        """Gives up on a source. One that has already started keeps running, on a thread the pool replaces."""
+        if not future.cancel() and not future.done():
+            self._pool.replace_stuck_thread(future)
+
+
+# ============================================================================
+# SECTION 5.8: BACKGROUND POWERCFG REPORT GENERATION
+# Description: `powercfg /batteryreport` can take up to POWERCFG_TIMEOUT seconds.
+#              Whenever a previous report exists, it is served immediately and a
+#              fresh one is generated in the background (stale-while-revalidate).
+#              The new report is written to a temporary file and atomically
+#              swapped in, so readers never observe a partially written file.
+#              Listeners are notified when a new report lands, so fields that
+#              depend on it (design capacity, cycle count, ...) can be re-derived.
+# ============================================================================
+
+def _run_powercfg_report(output_path: str):
+    """Runs powercfg to write an XML battery report to `output_path`."""
+    # The /xml flag is more machine-readable than /html.
+    subprocess.run(
+        ["powercfg", "/batteryreport", "/xml", "/output", output_path],
+        check=True,                 # Raise an exception if the command fails.
+        capture_output=True,        # Suppress output from appearing in the console.
+        timeout=POWERCFG_TIMEOUT    # Prevent the job from hanging.
+    )
+
+class BackgroundReportGenerator:
+    """
+    Generates the powercfg battery report for one path, either synchronously
+    (when no report exists yet) or as a background job. There is exactly one
+    generator per report path, shared by every BatteryIntelligence instance,
+    so concurrent callers never run powercfg twice for the same file.
+    """
+    _instances: Dict[str, "BackgroundReportGenerator"] = {}
+    _instances_lock = threading.Lock()
+
+    @classmethod
+    def for_path(cls, report_path: str) -> "BackgroundReportGenerator":
+        """Returns the shared generator for a report path, creating it on first use."""
+        key = os.path.abspath(report_path)
+        with cls._instances_lock:
+            if key not in cls._instances:
+                cls._instances[key] = cls(report_path)
+            return cls._instances[key]
+
+    def __init__(self, report_path: str, runner: Optional[Callable[[str], None]] = None):
+        """
+        Args:
+            report_path (str): Where the finished report is published.
+            runner (Callable): Writes a report to the path it is given. Defaults to
+                running powercfg; replaceable for testing.
+        """
+        self.report_path = report_path
+        self.runner = runner or _run_powercfg_report
+        self.last_completed_at: Optional[float] = None     # time.time() of the last successful swap.
+        self._lock = threading.Lock()                       # Guards starting the background thread.
+        self._run_lock = threading.Lock()                   # Serializes generation runs.
+        self._thread: Optional[threading.Thread] = None
+        self._listeners: List[Callable[[str], None]] = []
+
+    def is_stale(self, max_age: float = REPORT_MAX_AGE_SECONDS) -> bool:
+        """True if the published report is missing or older than `max_age` seconds."""
+        try:
+            return time.time() - os.path.getmtime(self.report_path) >= max_age
+        except OSError:
+            return True
+
+    def is_running(self) -> bool:
+        """True while a background generation job is in progress."""
+        return self._thread is not None and self._thread.is_alive()
+
+    def add_listener(self, callback: Callable[[str], None]):
+        """Registers a callback invoked with the report path after each new report lands.
+        Callbacks run on the generator's background thread."""
+        if callback not in self._listeners:
+            self._listeners.append(callback)
+
+    def remove_listener(self, callback: Callable[[str], None]):
+        """Unregisters a callback added with add_listener()."""
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def refresh_async(self) -> bool:
+        """
+        Starts regenerating the report in the background, unless a job is already running.
+
+        Returns:
+            bool: True if a new job was started.
+        """
+        with self._lock:
+            if self.is_running():
+                return False
+            self._start_job()
+        logging.info("Started background regeneration of the powercfg report.")
+        return True
+
+    def generate_now(self) -> bool:
+        """
+        Generates the report and waits for it. Used only when no report exists yet.
+        Every concurrent caller, and a background job already in progress, share
+        one run of powercfg.
+
+        Returns:
+            bool: True if a report is available afterwards.
+        """
+        with self._lock:
+            if not self.is_running():
+                self._start_job()
+            thread = self._thread
+        thread.join(POWERCFG_TIMEOUT + 5)
+        return os.path.exists(self.report_path)
+
+    def _start_job(self):
+        """Starts a generation job on its own thread. The caller holds the lock."""
+        self._thread = threading.Thread(target=self._generate, name="BatteryZ-ReportRefresh", daemon=True)
+        self._thread.start()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Waits for a running background job. Returns True if none is running afterwards."""
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        return not self.is_running()
+
+    def _generate(self) -> bool:
+        """Writes a new report to a temporary file and atomically swaps it in."""
+        # powercfg keys the output format off the extension, so the temporary name must end in .xml.
+        base, _ = os.path.splitext(self.report_path)
+        tmp_path = f"{base}.{os.getpid()}-{threading.get_ident()}.tmp.xml"
+        with self._run_lock:
+            try:
+                logging.info("Generating new powercfg battery report...")
+                start = time.perf_counter()
+                self.runner(tmp_path)
+                # Never publish a truncated or malformed report.
+                report = parse_battery_report(tmp_path)
+                if not is_battery_report_complete(tmp_path):
+                    raise ValueError("the report is truncated")
+                # os.replace is atomic, so readers see either the old report or the new one.
+                os.replace(tmp_path, self.report_path)
+                # The rename keeps the file's mtime and size, so this parse is reused as-is.
+                remember_battery_report(self.report_path, report)
+                self.last_completed_at = time.time()
+                logging.info("Powercfg report generated in %.1f s at %s", time.perf_counter() - start, self.report_path)
+            except Exception as e:
+                # The previous report, if any, stays in place and keeps being served.
+                logging.error("Failed to generate powercfg battery report: %s", e)
+                try:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                except OSError as remove_error:
+                    logging.error("Could not remove temporary report file: %s", remove_error)
+                return False
+
+        # Notify listeners outside the lock so they can freely read the new report.
+        for callback in list(self._listeners):
+            try:
+                callback(self.report_path)
+            except Exception as e:
+                logging.error("Report refresh listener failed: %s", e)
+        return True
+
+# ============================================================================
+# SECTION 5.9: BATTERY DATA PROVIDERS
+# Description: A BatteryProvider is the platform layer that BatteryIntelligence
+#              and the real-time worker read raw battery data from. Providers
+#              only acquire data; consolidation, defaults, caching and all
+#              calculations stay in BatteryIntelligence. WindowsBatteryProvider
+#              (SECTION 6.5) wraps WMI, GetSystemPowerStatus, PowerShell and
+#              powercfg. LinuxSysfsBatteryProvider reads a handful of small
+#              files under /sys/class/power_supply, without any subprocess.
+# ============================================================================
+
+class BatteryProvider(ABC):
+    """
+    The interface every battery data provider implements. Each method returns
+    raw values in the units used throughout the application (mWh, mV, W, °C),
+    or None / an empty dict when the value is not available. The data sources
+    are abstract, so a provider that misses one fails when it is created
+    instead of in the middle of a poll.
+    """
+    # A short identifier for logging.
+    name = "base"
+
+    def is_battery_present(self) -> bool:
+        """
+        Fast check for whether the system has a battery. The default uses psutil,
+        and assumes a battery is present whenever it cannot tell.
+        """
+        if not PSUTIL_AVAILABLE:
+            return True
+        try:
+            # If psutil.sensors_battery() returns None, no battery is detected.
+            if psutil.sensors_battery() is None:
+                logging.warning("No battery detected via psutil. Assuming desktop PC.")
+                return False
+            return True
+        except Exception as e:
+            logging.error("psutil check failed: %s. Assuming battery is present as a fallback.", e)
+            return True
+
+    def refresh_report(self):
+        """Prepares any report the other sources read from. Most providers have none."""
+        return None
+
+    def get_battery_identity(self) -> Optional[Tuple[str, str]]:
+        """
+        A cheap check of which pack is installed in which machine, used to key the
+        static data cache. Returns (system model, battery serial), or None if the
+        provider cannot tell, in which case the cache is not used.
+        """
+        return None
+
+    @abstractmethod
+    def get_system_info(self) -> Tuple[str, str]:
+        """Returns the system (manufacturer, model)."""
+
+    @abstractmethod
+    def get_static_battery_info(self) -> Dict:
+        """Returns a dict with any of 'design_capacity', 'full_charge_capacity' (mWh), 'manufacturer', 'serial' and 'name'."""
+
+    @abstractmethod
+    def get_cycle_count(self) -> Optional[int]:
+        """Returns the cycle count reported by the hardware, or None."""
+
+    @abstractmethod
+    def get_chemistry(self) -> Optional[Union[str, int]]:
+        """Returns the raw chemistry value, to be passed to `normalize_chemistry_name`."""
+
+    @abstractmethod
+    def get_dynamic_status(self) -> Dict:
+        """
+        Returns a dict with any of 'percent', 'ac_online', 'is_charging', 'time_remaining' (s),
+        'voltage_mv', 'power_watts' and 'remaining_mwh'.
+        """
+
+    @abstractmethod
+    def get_temperature(self) -> Optional[float]:
+        """Returns the battery temperature in Celsius, or None."""
+
+    def release(self):
+        """Releases per-thread resources held for the calling thread. Called before worker threads exit."""
+        return None
+
+class LinuxSysfsBatteryProvider(BatteryProvider):
+    """
+    Reads battery data from the Linux power_supply class in sysfs. Every value
+    comes from a small text file, so a full poll is a few open()/read() calls
+    and completes well under a millisecond. Pointing `root` at a fake directory
+    tree makes the whole pipeline testable without a battery.
+    """
+    name = "linux-sysfs"
+
+    def __init__(self, root: str = LINUX_POWER_SUPPLY_ROOT, dmi_root: str = LINUX_DMI_ROOT):
+        """
+        Args:
+            root (str): The power_supply class directory.
+            dmi_root (str): The DMI identity directory, used for the system vendor and model.
+        """
+        self.root = root
+        self.dmi_root = dmi_root
+
+    # --- sysfs Helpers ---
+
+    def _battery_dir(self) -> Optional[str]:
+        """Returns the directory of the first battery (BAT0, BAT1, ...), or None."""
+        try:
+            names = sorted(n for n in os.listdir(self.root) if n.startswith("BAT"))
+        except OSError:
+            return None
+        return os.path.join(self.root, names[0]) if names else None
+
+    def _read(self, directory: Optional[str], name: str) -> Optional[str]:
+        """Reads one sysfs attribute. Missing or unreadable attributes return None."""
+        if directory is None:
+            return None
+        try:
+            with open(os.path.join(directory, name), 'r') as f:
+                value = f.read().strip()
+            return value or None
+        except OSError:
+            return None
+
+    def _read_int(self, directory: Optional[str], name: str) -> Optional[int]:
+        """Reads one integer sysfs attribute."""
+        value = self._read(directory, name)
+        try:
+            return int(value) if value is not None else None
+        except ValueError:
+            return None
+
+    def _read_energy_mwh(self, directory: Optional[str], kind: str) -> Optional[int]:
+        """
+        Reads an energy attribute ('full', 'full_design' or 'now') in mWh. Drivers
+        report either energy_* (µWh) or charge_* (µAh); the latter is converted with
+        the design minimum voltage (µV).
+        """
+        energy_uwh = self._read_int(directory, f"energy_{kind}")
+        if energy_uwh is not None:
+            return energy_uwh // 1000
+        charge_uah = self._read_int(directory, f"charge_{kind}")
+        voltage_uv = self._read_int(directory, "voltage_min_design") or self._read_int(directory, "voltage_now")
+        if charge_uah is not None and voltage_uv:
+            return charge_uah * voltage_uv // 10**9
+        return None
+
+    def _mains_online(self) -> Optional[bool]:
+        """Returns the 'online' state of the first mains adapter, or None if there is none."""
+        try:
+            names = sorted(os.listdir(self.root))
+        except OSError:
+            return None
+        for name in names:
+            directory = os.path.join(self.root, name)
+            if self._read(directory, "type") == "Mains":
+                online = self._read_int(directory, "online")
+                if online is not None:
+                    return online == 1
+        return None
+
+    # --- BatteryProvider Interface ---
+
+    def is_battery_present(self) -> bool:
+        battery_dir = self._battery_dir()
+        # Some drivers keep the BAT directory for an empty bay and report present=0.
+        return battery_dir is not None and self._read(battery_dir, "present") != "0"
+
+    def get_battery_identity(self) -> Optional[Tuple[str, str]]:
+        battery_dir = self._battery_dir()
+        # Not every driver exposes a serial; the model name is the next best identifier.
+        serial = self._read(battery_dir, "serial_number") or self._read(battery_dir, "model_name")
+        if not serial:
+            return None
+        return self._read(self.dmi_root, "product_name") or "System", serial
+
+    def get_system_info(self) -> Tuple[str, str]:
+        manufacturer = self._read(self.dmi_root, "sys_vendor") or "Unknown"
+        model = self._read(self.dmi_root, "product_name") or "System"
+        return manufacturer, model
+
+    def get_static_battery_info(self) -> Dict:
+        battery_dir = self._battery_dir()
+        info = {}
+        design = self._read_energy_mwh(battery_dir, "full_design")
+        if design:
+            info['design_capacity'] = design
+        full = self._read_energy_mwh(battery_dir, "full")
+        if full:
+            info['full_charge_capacity'] = full
+        for key, attribute in (('manufacturer', "manufacturer"), ('serial', "serial_number"), ('name', "model_name")):
+            value = self._read(battery_dir, attribute)
+            if value:
+                info[key] = value
+        return info
+
+    def get_cycle_count(self) -> Optional[int]:
+        count = self._read_int(self._battery_dir(), "cycle_count")
+        if count is not None:
+            logging.info("SUCCESS: Cycle count from sysfs is %d.", count)
+        return count
+
+    def get_chemistry(self) -> Optional[str]:
+        # e.g. "Li-ion" or "Li-poly".
+        return self._read(self._battery_dir(), "technology")
+
+    def get_dynamic_status(self) -> Dict:
+        battery_dir = self._battery_dir()
+        status = {}
+        percent = self._read_int(battery_dir, "capacity")
+        if percent is not None:
+            status['percent'] = percent
+
+        # The battery status is one of Charging, Discharging, Full, Not charging or Unknown.
+        state = self._read(battery_dir, "status")
+        ac_online = self._mains_online()
+        if ac_online is None and state in ("Charging", "Discharging", "Full"):
+            ac_online = state != "Discharging"
+        if ac_online is not None:
+            status['ac_online'] = ac_online
+        if state is not None:
+            status['is_charging'] = state == "Charging"
+
+        voltage_uv = self._read_int(battery_dir, "voltage_now")
+        if voltage_uv:
+            status['voltage_mv'] = voltage_uv // 1000
+        power_uw = self._read_int(battery_dir, "power_now")
+        if power_uw is None:
+            # Drivers without power_now expose the current instead (µA).
+            current_ua = self._read_int(battery_dir, "current_now")
+            if current_ua is not None and voltage_uv:
+                power_uw = abs(current_ua) * voltage_uv // 10**6
+        if power_uw:
+            status['power_watts'] = abs(power_uw) / 10**6
+
+        # Time remaining, only meaningful while discharging.
+        energy_now = self._read_energy_mwh(battery_dir, "now")
+        if energy_now is not None:
+            status['remaining_mwh'] = energy_now
+        if state == "Discharging" and energy_now is not None and status.get('power_watts'):
+            status['time_remaining'] = int(energy_now / 1000.0 / status['power_watts'] * 3600)
+        return status
+
+    def get_temperature(self) -> Optional[float]:
+        # Few batteries expose this; the unit is tenths of a degree Celsius.
+        temp = self._read_int(self._battery_dir(), "temp")
+        return round(temp / 10.0, 1) if temp is not None else None
+
+# --- Record and Replay ---
+# The methods a recording captures, in interface order.
+PROVIDER_SOURCES = (
+    "is_battery_present", "refresh_report", "get_battery_identity", "get_system_info", "get_static_battery_info",
+    "get_cycle_count", "get_chemistry", "get_dynamic_status", "get_temperature",
+)
+RECORDING_FORMAT = "battery-z-recording"
+
+class RecordingBatteryProvider(BatteryProvider):
+    """
+    Wraps another provider and appends every response, with its timestamp and
+    latency, to a gzip-compressed JSON-lines file. Failures are recorded too,
+    so a replay reproduces them. Safe to share between threads.
+    """
+    name = "recording"
+
+    def __init__(self, inner: BatteryProvider, path: str):
+        """
+        Args:
+            inner (BatteryProvider): The provider that actually reads the data.
+            path (str): The recording file to create (conventionally *.jsonl.gz).
+        """
+        self.inner = inner
+        self.path = path
+        self.name = f"recording({inner.name})"
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self._file = gzip.open(path, 'wt', encoding='utf-8')
+        # The first line describes the recording; every following line is one response.
+        self._write({"format": RECORDING_FORMAT, "version": 1, "provider": inner.name,
+                     "platform": platform.system(), "started_at": time.time()})
+
+    def _write(self, entry: Dict):
+        line = json.dumps(entry, separators=(',', ':'), default=str)
+        with self._lock:
+            if self._file is not None:
+                self._file.write(line + "\n")
+
+    def _record(self, source: str):
+        """Calls `source` on the inner provider and records the response."""
+        start = time.perf_counter()
+        try:
+            value = getattr(self.inner, source)()
+        except Exception as e:
+            end = time.perf_counter()
+            self._write({"t": round(end - self._start, 6), "source": source,
+                         "latency": round(end - start, 6), "error": str(e)})
+            raise
+        end = time.perf_counter()
+        self._write({"t": round(end - self._start, 6), "source": source,
+                     "latency": round(end - start, 6), "value": value})
+        return value
+
+    def close(self):
+        """Finishes the recording. Later responses are no longer written."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+                logging.info("Provider recording saved to %s", self.path)
+
+    def is_battery_present(self) -> bool:
+        return self._record("is_battery_present")
+
+    def refresh_report(self):
+        return self._record("refresh_report")
+
+    def get_battery_identity(self) -> Optional[Tuple[str, str]]:
+        return self._record("get_battery_identity")
+
+    def get_system_info(self) -> Tuple[str, str]:
+        return self._record("get_system_info")
+
+    def get_static_battery_info(self) -> Dict:
+        return self._record("get_static_battery_info")
+
+    def get_cycle_count(self) -> Optional[int]:
+        return self._record("get_cycle_count")
+
+    def get_chemistry(self) -> Optional[Union[str, int]]:
+        return self._record("get_chemistry")
+
+    def get_dynamic_status(self) -> Dict:
+        return self._record("get_dynamic_status")
+
+    def get_temperature(self) -> Optional[float]:
+        return self._record("get_temperature")
+
+    def release(self):
+        self.inner.release()
+
+class ReplayBatteryProvider(BatteryProvider):
+    """
+    Feeds a recording back in place of the hardware. Each source replays its
+    own responses in recorded order, taking `latency / speed` seconds per call,
+    so a replay at speed 1.0 reproduces the recorded source timings and 0 runs
+    as fast as possible. Recorded failures are raised again as RuntimeError.
+    """
+    name = "replay"
+
+    def __init__(self, path: str, speed: float = 1.0, loop: bool = True):
+        """
+        Args:
+            path (str): A file written by RecordingBatteryProvider.
+            speed (float): 1.0 for real time, N for N× faster, 0 for as fast as possible.
+            loop (bool): Start a source over when its responses run out (for long
+                polling runs). If False, an exhausted source raises RuntimeError.
+        """
+        self.path = path
+        self.speed = speed
+        self.loop = loop
+        self._lock = threading.Lock()
+        self._entries: Dict[str, List[Dict]] = defaultdict(list)
+        self._positions: Dict[str, int] = defaultdict(int)
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            self.header = json.loads(f.readline())
+            if self.header.get("format") != RECORDING_FORMAT:
+                raise ValueError(f"{path} is not a Battery-Z provider recording")
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._entries[entry["source"]].append(entry)
+        self.name = f"replay({self.header.get('provider', 'unknown')})"
+        logging.info("Loaded provider recording %s with %d responses.",
+                     path, sum(len(entries) for entries in self._entries.values()))
+
+    def _next(self, source: str) -> Dict:
+        """Returns the next recorded response for `source`."""
+        with self._lock:
+            entries = self._entries.get(source)
+            if not entries:
+                raise RuntimeError(f"The recording has no responses for {source}")
+            position = self._positions[source]
+            if position >= len(entries):
+                if not self.loop:
+                    raise RuntimeError(f"The recording has run out of responses for {source}")
+                position = 0
+            self._positions[source] = position + 1
+        return entries[position]
+
+    def _replay(self, source: str):
+        entry = self._next(source)
+        if self.speed > 0:
+            time.sleep(entry["latency"] / self.speed)
+        if "error" in entry:
+            raise RuntimeError(entry["error"])
+        value = entry["value"]
+        # JSON has no tuples; the system info and battery identity are the only tuple-valued sources.
+        return tuple(value) if isinstance(value, list) else value
+
+    def rewind(self):
+        """Starts every source over from its first response."""
+        with self._lock:
+            self._positions.clear()
+
+    def is_battery_present(self) -> bool:
+        return self._replay("is_battery_present")
+
+    def refresh_report(self):
+        return self._replay("refresh_report")
+
+    def get_battery_identity(self) -> Optional[Tuple[str, str]]:
+        return self._replay("get_battery_identity")
+
+    def get_system_info(self) -> Tuple[str, str]:
+        return self._replay("get_system_info")
+
+    def get_static_battery_info(self) -> Dict:
+        return self._replay("get_static_battery_info")
+
+    def get_cycle_count(self) -> Optional[int]:
+        return self._replay("get_cycle_count")
+
+    def get_chemistry(self) -> Optional[Union[str, int]]:
+        return self._replay("get_chemistry")
+
+    def get_dynamic_status(self) -> Dict:
+        return self._replay("get_dynamic_status")
+
+    def get_temperature(self) -> Optional[float]:
+        return self._replay("get_temperature")
+
+# Providers shared by every BatteryIntelligence instance in record or replay mode,
+# so the whole process writes one recording or reads one replay in order.
+_SHARED_PROVIDERS: Dict[str, BatteryProvider] = {}
+_SHARED_PROVIDERS_LOCK = threading.Lock()
+
+def create_default_provider(report_path: str, wmi_backend=None) -> BatteryProvider:
+    """
+    Picks the battery provider for the current platform, honouring record and
+    replay mode (RECORD_PATH / REPLAY_PATH).
+
+    Args:
+        report_path (str): Where the Windows provider keeps its powercfg report.
+        wmi_backend: Optional WMI backend. Passing one selects the Windows provider
+            on any platform, which is how the WMI code paths are exercised in tests.
+    """
+    with _SHARED_PROVIDERS_LOCK:
+        if REPLAY_PATH:
+            if "replay" not in _SHARED_PROVIDERS:
+                _SHARED_PROVIDERS["replay"] = ReplayBatteryProvider(REPLAY_PATH, REPLAY_SPEED)
+            return _SHARED_PROVIDERS["replay"]
+        if RECORD_PATH and "record" in _SHARED_PROVIDERS:
+            return _SHARED_PROVIDERS["record"]
+
+        if IS_WINDOWS or wmi_backend is not None:
+            provider = WindowsBatteryProvider(report_path, wmi_backend)
+        else:
+            provider = LinuxSysfsBatteryProvider()
+
+        if RECORD_PATH:
+            recorder = RecordingBatteryProvider(provider, RECORD_PATH)
+            # Close the file on exit, so the gzip stream is complete.
+            atexit.register(recorder.close)
+            _SHARED_PROVIDERS["record"] = recorder
+            return recorder
+        return provider
+
+# ============================================================================
+# SECTION 5.10: PER-BATTERY STATIC DATA CACHE
+# Description: Manufacturer, serial, design capacity and chemistry never change
+#              for a given pack, but used to be re-queried on every launch and
+#              refresh. They are now cached per battery, keyed by system model
+#              and battery serial, with a TTL per field (STATIC_FIELD_TTLS). A
+#              source whose fields are all fresh is skipped entirely; a battery
+#              swap changes the key, so everything is queried again.
+# ============================================================================
+
+class StaticBatteryCache:
+    """
+    Field-level cache for the static collection sources. Entries live in the
+    dictionary passed in (the "static_cache" section of battery_cache.json):
+    {key: {field: {"value": ..., "at": epoch seconds}}}.
+    """
+    # The fields each cacheable source produces.
+    SOURCE_FIELDS = {
+        "system_info": ("system_manufacturer", "system_model"),
+        "static_info": ("name", "manufacturer", "serial", "design_capacity", "full_charge_capacity"),
+        "cycle_count": ("cycle_count",),
+        "chemistry": ("chemistry",),
+    }
+
+    # Placeholders a source returns when it knows nothing.
+    PLACEHOLDERS = {"system_manufacturer": "Unknown", "system_model": "System"}
+
+    def __init__(self, store: Dict, ttls: Dict[str, float] = STATIC_FIELD_TTLS):
+        """
+        Args:
+            store (Dict): The dictionary the entries are kept in. Modified in place.
+            ttls (Dict[str, float]): Time-to-live in seconds for each field.
+        """
+        self.store = store
+        self.ttls = ttls
+
+    @staticmethod
+    def make_key(identity: Tuple[str, str]) -> str:
+        """Builds the cache key from a provider's (system model, battery serial) identity."""
+        return f"{identity[0]}|{identity[1]}"
+
+    def _to_fields(self, source: str, value: Any) -> Dict[str, Any]:
+        """Splits a source's result into its cached fields."""
+        if source == "system_info":
+            return dict(zip(self.SOURCE_FIELDS[source], value))
+        if source == "static_info":
+            return {name: (value or {}).get(name) for name in self.SOURCE_FIELDS[source]}
+        return {self.SOURCE_FIELDS[source][0]: value}
+
+    def _from_fields(self, source: str, fields: Dict[str, Any]) -> Any:
+        """Rebuilds a source's result from its cached fields."""
+        if source == "system_info":
+            return tuple(fields[name] for name in self.SOURCE_FIELDS[source])
+        if source == "static_info":
+            # Sources omit missing values rather than returning None.
+            return {name: value for name, value in fields.items() if value is not None}
+        return fields[self.SOURCE_FIELDS[source][0]]
+
+    def lookup(self, key: str, source: str, now: Optional[float] = None) -> Tuple[bool, Any]:
+        """
+        Returns (True, result) if every field of `source` is cached and fresh, so
+        the source can be skipped. Otherwise returns (False, None).
+        """
+        now = time.time() if now is None else now
+        entry = self.store.get(key, {})
+        fields = {}
+        for name in self.SOURCE_FIELDS[source]:
+            cached = entry.get(name)
+            if cached is None or now - cached.get("at", 0) >= self.ttls.get(name, 0):
+                return False, None
+            fields[name] = cached.get("value")
+        return True, self._from_fields(source, fields)
+
+    def update(self, key: str, source: str, value: Any, now: Optional[float] = None):
+        """
+        Stores a fresh result of `source` for the battery identified by `key`.
+        Missing values and placeholders are never stored, so a source that returned
+        nothing, or only part of its fields, misses the cache and is asked again.
+        """
+        now = time.time() if now is None else now
+        entry = self.store.setdefault(key, {})
+        for name, field_value in self._to_fields(source, value).items():
+            if field_value is None or field_value == "" or self.PLACEHOLDERS.get(name) == field_value:
+                continue
+            entry[name] = {"value": field_value, "at": now}
+        if not entry:
+            del self.store[key]
+            return
+        # Forget the batteries that were seen least recently.
+        if len(self.store) > STATIC_CACHE_MAX_ENTRIES:
+            def last_seen(k):
+                return max((f.get("at", 0) for f in self.store[k].values()), default=0)
+            for old_key in sorted(self.store, key=last_seen)[:len(self.store) - STATIC_CACHE_MAX_ENTRIES]:
+                del self.store[old_key]
+
+# ============================================================================
+# SECTION 5.11: RUL PROJECTION ENGINE
+# Description: The cycle-health model used by calculate_health and the RUL
+#              projections, SOH = 100 * (1 - 0.2 * r^1.5) with r = cycles / rated
+#              cycles, is monotonic in r and can be inverted analytically. Instead
+#              of stepping forward one day at a time (up to 7,300 iterations), the
+#              day the projection crosses a threshold is solved for in closed form,
+#              for one battery or, with NumPy, for whole arrays of batteries or
+#              usage scenarios at once. The result is identical to the day loop.
+# ============================================================================
+
+CYCLE_HEALTH_FADE = 0.2                 # Fraction of capacity lost at r = 1 in the cycle-health model.
+CYCLE_HEALTH_EXPONENT = 1.5             # Curvature of the cycle-health model.
+LOW_USAGE_CYCLES_PER_DAY = 0.01         # At or below this usage rate no RUL is projected ("Low Usage").
+
+def project_cycle_health(cycles: float, rated_cycles: float) -> float:
+    """The cycle-health model: projected SOH (%) after `cycles` of `rated_cycles`."""
+    return 100.0 * (1 - (CYCLE_HEALTH_FADE * ((cycles / rated_cycles) ** CYCLE_HEALTH_EXPONENT)))
+
+def weighted_health(design: float, full_charge: float, cycles: Optional[float],
+                    rated_cycles: Optional[float]) -> Tuple[float, float, float]:
+    """
+    The health rule shared by calculate_health and the fleet scoring: capacity
+    health and cycle health, weighted by how far the battery is into its rated
+    life. A missing (None or NaN) or negative cycle count counts as 0, and a
+    missing rating as 1,000 cycles. The capacities must already have been validated.
+
+    Returns:
+        Tuple[float, float, float]: The health (%, clamped to 0-100), capacity health (%) and cycle health (%).
+    """
+    cycles = float(cycles) if cycles is not None and cycles >= 0 else 0.0
+    rated_cycles = float(rated_cycles) if rated_cycles is not None and rated_cycles > 0 else 1000.0
+    # HI 1: Capacity Health (SOH_c) - The direct physical measurement.
+    soh_c = (full_charge / design) * 100.0
+    # HI 2: Cycle Health (SOH_cyc) - The wear based on usage.
+    cycle_ratio = min(cycles / rated_cycles, 1.5) # Allow ratio to go beyond 1.0 for old batteries
+    soh_cyc = 100.0 * (1 - (CYCLE_HEALTH_FADE * (cycle_ratio ** CYCLE_HEALTH_EXPONENT))) # Non-linear degradation model
+    # Fuse them: cycle wear dominates for a new battery, measured capacity for an old one.
+    if cycle_ratio < 0.1: # Battery is new
+        capacity_weight = 0.4
+    elif cycle_ratio > 0.8: # Battery is old
+        capacity_weight = 0.8
+    else: # For mid-life batteries
+        capacity_weight = 0.7
+    health = (soh_c * capacity_weight) + (soh_cyc * (1 - capacity_weight))
+    return max(0.0, min(health, 100.0)), soh_c, soh_cyc
+
+def _threshold_cycle_ratio(threshold_soh: float) -> float:
+    """The cycle ratio r* at which the cycle-health model reaches `threshold_soh`."""
+    if threshold_soh >= 100.0:
+        return 0.0
+    return ((1.0 - threshold_soh / 100.0) / CYCLE_HEALTH_FADE) ** (1.0 / CYCLE_HEALTH_EXPONENT)
+
+def days_until_health_below(cycle_count: float, cycles_per_day: float, rated_cycles: float,
+                            threshold_soh: float, max_days: int) -> int:
+    """
+    Returns the first day d in [1, max_days) on which the projected cycle health,
+    at cycle_count + d * cycles_per_day cycles, is below `threshold_soh`. This is
+    exactly what the former `for day in range(1, max_days)` loops computed.
+
+    Returns:
+        int: The day of the crossing, or -1 if it happens after the horizon.
+    """
+    def below(day):
+        return project_cycle_health(cycle_count + (day * cycles_per_day), rated_cycles) < threshold_soh
+
+    if cycles_per_day <= 0:
+        # The projection never moves, so it either starts below the threshold or never gets there.
+        return 1 if max_days > 1 and below(1) else -1
+
+    # Closed form: the crossing is the first day whose cycle count exceeds c* = rated * r*.
+    threshold_cycles = rated_cycles * _threshold_cycle_ratio(threshold_soh)
+    day = math.floor((threshold_cycles - cycle_count) / cycles_per_day) + 1
+    day = int(min(max(day, 1), max_days))
+    # Rounding in the division can put the estimate one day off; step to the exact crossing
+    # using the very same expression the loop evaluated.
+    while day > 1 and below(day - 1):
+        day -= 1
+    while day < max_days and not below(day):
+        day += 1
+    return day if day < max_days else -1
+
+def days_until_health_below_np(cycle_count, cycles_per_day, rated_cycles, threshold_soh: float, max_days: int):
+    """
+    Vectorized days_until_health_below over NumPy arrays (or scalars, broadcast
+    together). Requires NumPy.
+
+    Returns:
+        np.ndarray: The crossing day for each element, -1 where it is past the horizon.
+    """
+    cycle_count, cycles_per_day, rated_cycles = np.broadcast_arrays(
+        np.asarray(cycle_count, dtype=np.float64),
+        np.asarray(cycles_per_day, dtype=np.float64),
+        np.asarray(rated_cycles, dtype=np.float64),
+    )
+
+    def below(day):
+        return 100.0 * (1 - (CYCLE_HEALTH_FADE * (((cycle_count + (day * cycles_per_day)) / rated_cycles)
+                                                  ** CYCLE_HEALTH_EXPONENT))) < threshold_soh
+
+    moving = cycles_per_day > 0
+    threshold_cycles = rated_cycles * _threshold_cycle_ratio(threshold_soh)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        estimate = np.floor((threshold_cycles - cycle_count) / np.where(moving, cycles_per_day, 1.0)) + 1
+    # Non-moving projections are handled separately at the end.
+    day = np.where(moving, np.clip(estimate, 1, max_days), max_days)
+    # The same one-step corrections as the scalar version, applied until no element changes.
+    while True:
+        step_down = moving & (day > 1) & below(day - 1)
+        if not step_down.any():
+            break
+        day = day - step_down
+    while True:
+        step_up = moving & (day < max_days) & ~below(day)
+        if not step_up.any():
+            break
+        day = day + step_up
+    day = day.astype(np.int64)
+    day[day >= max_days] = -1
+    # Non-moving projections: day 1 if already below the threshold, never otherwise.
+    if not moving.all():
+        stuck = np.where(below(1) & (max_days > 1), 1, -1)
+        day = np.where(moving, day, stuck)
+    return day
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    """Linearly interpolated percentile of an already sorted list (NumPy's default method)."""
+    position = (len(sorted_values) - 1) * q / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+def monte_carlo_rul(cycle_count: float, cycles_per_day: float, rated_cycles: float,
+                    quality_tier: str = "Mid-range", threshold_soh: float = 80.0, horizon_days: int = 5475,
+                    trajectories: Optional[int] = None, seed: int = MONTE_CARLO_SEED) -> Dict[str, Any]:
+    """
+    Probabilistic RUL. Each trajectory samples a future usage rate (log-normal around
+    the historical rate), a real cycle life (normal around the rated value, with a
+    spread set by the quality tier) and a capacity-fade coefficient (normal noise
+    around the model's 0.2), then solves the cycle-health model for the day it
+    crosses `threshold_soh`. All trajectories are evaluated in one vectorized pass
+    when NumPy is available, or in a plain loop otherwise.
+
+    Returns:
+        Dict[str, Any]: 'p10_days', 'p50_days' and 'p90_days' (P10 is the early,
+            pessimistic end), 'capped_fraction' (the share of trajectories beyond
+            the horizon), 'trajectories' and 'horizon_days'.
+    """
+    spread = QUALITY_TIER_CYCLE_SPREAD.get(quality_tier, QUALITY_TIER_CYCLE_SPREAD["Mid-range"])
+    # The threshold term of the inverted model: c* = R * ((1 - T/100) / fade)^(1/1.5).
+    loss = max(1.0 - threshold_soh / 100.0, 0.0)
+    # Mean-preserving log-normal: E[rate] equals the historical rate.
+    usage_mu = -0.5 * MONTE_CARLO_USAGE_SIGMA ** 2
+
+    if cycles_per_day <= LOW_USAGE_CYCLES_PER_DAY:
+        # Too little usage to project, as in estimate_remaining_life: every trajectory is beyond the horizon.
+        n = trajectories or (MONTE_CARLO_TRAJECTORIES if NUMPY_AVAILABLE else MONTE_CARLO_FALLBACK_TRAJECTORIES)
+        p10 = p50 = p90 = horizon_days
+        capped = 1.0
+    elif NUMPY_AVAILABLE:
+        n = trajectories or MONTE_CARLO_TRAJECTORIES
+        rng = np.random.default_rng(seed)
+        rate = cycles_per_day * rng.lognormal(usage_mu, MONTE_CARLO_USAGE_SIGMA, n)
+        life = rated_cycles * np.maximum(rng.normal(1.0, spread, n), 0.3)
+        fade = CYCLE_HEALTH_FADE * np.maximum(rng.normal(1.0, MONTE_CARLO_FADE_SIGMA, n), 0.3)
+        threshold_cycles = life * (loss / fade) ** (1.0 / CYCLE_HEALTH_EXPONENT)
+        days = np.clip(np.floor((threshold_cycles - cycle_count) / rate) + 1, 1, horizon_days)
+        p10, p50, p90 = np.percentile(days, [10, 50, 90])
+        capped = float(np.count_nonzero(days >= horizon_days)) / n
+    else:
+        n = trajectories or MONTE_CARLO_FALLBACK_TRAJECTORIES
+        rng = random.Random(seed)
+        samples = []
+        for _ in range(n):
+            rate = cycles_per_day * rng.lognormvariate(usage_mu, MONTE_CARLO_USAGE_SIGMA)
+            life = rated_cycles * max(rng.gauss(1.0, spread), 0.3)
+            fade = CYCLE_HEALTH_FADE * max(rng.gauss(1.0, MONTE_CARLO_FADE_SIGMA), 0.3)
+            threshold_cycles = life * (loss / fade) ** (1.0 / CYCLE_HEALTH_EXPONENT)
+            samples.append(min(max(math.floor((threshold_cycles - cycle_count) / rate) + 1, 1), horizon_days))
+        samples.sort()
+        p10, p50, p90 = (_percentile(samples, q) for q in (10, 50, 90))
+        capped = (n - bisect.bisect_left(samples, horizon_days)) / n
+
+    return {
+        "p10_days": int(round(p10)), "p50_days": int(round(p50)), "p90_days": int(round(p90)),
+        "capped_fraction": capped, "trajectories": n, "horizon_days": horizon_days,
+    }
+
+# ============================================================================
+# SECTION 5.12: PERSISTENT SAMPLE HISTORY
+# Description: An append-only, on-disk time-series store. Records are fixed-width
+#              binary structs written in batches to numbered segment files. A full
+#              segment is sealed with a footer (count, time range, CRC32); an
+#              unsealed segment left by a crash is trimmed to its last complete
+#              record on open. Reads memory-map the segments and binary-search the
+#              timestamps, so a range query never loads a whole file.
+# ============================================================================
+
+class SegmentTimeSeriesStore:
+    """
+    A directory of segment files holding records with a fixed struct format whose
+    first field is a float64 epoch timestamp. Timestamps must not go backwards.
+
+    Segment layout: header (magic, version, record size, format), the records,
+    then, once sealed, a footer (magic, count, first and last timestamp, CRC32).
+    """
+    HEADER = struct.Struct("<4sHH16s")
+    HEADER_MAGIC = b"BZTS"
+    FOOTER = struct.Struct("<4sQddI")
+    FOOTER_MAGIC = b"BZTF"
+    VERSION = 1
+    SUFFIX = ".seg"
+
+    class _Timestamps:
+        """A read-only sequence of a mapped segment's timestamps, for bisect."""
+        def __init__(self, buffer, record_size: int, count: int):
+            self.buffer = buffer
+            self.record_size = record_size
+            self.count = count
+
+        def __len__(self) -> int:
+            return self.count
+
+        def __getitem__(self, i: int) -> float:
+            return struct.unpack_from("<d", self.buffer, SegmentTimeSeriesStore.HEADER.size + i * self.record_size)[0]
+
+    def __init__(self, directory: str, record_format: str, fields: List[str],
+                 segment_records: int = HISTORY_SEGMENT_RECORDS,
+                 flush_records: int = HISTORY_FLUSH_RECORDS,
+                 flush_seconds: float = HISTORY_FLUSH_SECONDS, read_only: bool = False):
+        """
+        Args:
+            directory (str): The directory the segment files live in. Created if needed.
+            record_format (str): The struct format of one record. Must start with "<d".
+            fields (List[str]): A name for each field of the record.
+            segment_records (int): Records per segment before it is sealed.
+            flush_records (int): Pending records that trigger a write.
+            flush_seconds (float): Maximum age of a pending record before it is written.
+            read_only (bool): Index the segments as they are, without recovering or reopening
+                them, and refuse appends. For reading a store another process may be writing.
+        """
+        if not record_format.startswith("<d"):
+            raise ValueError("Record formats must be little-endian and start with a float64 timestamp.")
+        self.directory = directory
+        self.record = struct.Struct(record_format)
+        self.fields = list(fields)
+        self.segment_records = segment_records
+        self.flush_records = flush_records
+        self.flush_seconds = flush_seconds
+        self.read_only = read_only
+        self._header = self.HEADER.pack(self.HEADER_MAGIC, self.VERSION, self.record.size, record_format.encode("ascii"))
+        self._lock = threading.RLock()
+        # One entry per segment, oldest first: [sequence, path, first_ts, last_ts, count].
+        self._segments: List[list] = []
+        self._last_ts: List[float] = []          # Each segment's last timestamp, for bisect.
+        self._pending = bytearray()              # Packed records waiting for the next batched write.
+        self._pending_count = 0
+        self._pending_since = 0.0
+        self._last_timestamp = -math.inf
+        self._active = None                      # File handle of the unsealed (newest) segment.
+        self._active_crc = 0
+        self._next_sequence = 1                  # Never reuses a file name, even one that was skipped.
+        if read_only and not os.path.isdir(directory):
+            return
+        os.makedirs(directory, exist_ok=True)
+        self._open_segments()
+
+    # --- Opening and recovery ---
+
+    def _open_segments(self):
+        """Indexes the existing segments, trims torn writes and reopens the newest one for appends."""
+        names = sorted(n for n in os.listdir(self.directory) if n.endswith(self.SUFFIX))
+        for index, name in enumerate(names):
+            path = os.path.join(self.directory, name)
+            try:
+                sequence = int(name[:-len(self.SUFFIX)])
+                self._next_sequence = max(self._next_sequence, sequence + 1)
+                entry = self._index_segment(sequence, path, is_newest=(index == len(names) - 1))
+            except (OSError, ValueError, struct.error) as e:
+                logging.warning("Skipping unreadable history segment %s: %s", path, e)
+                continue
+            if entry is not None:
+                self._segments.append(entry)
+                self._last_ts.append(entry[3])
+        if self._segments:
+            self._last_timestamp = self._segments[-1][3]
+
+    def _index_segment(self, sequence: int, path: str, is_newest: bool) -> Optional[list]:
+        """Reads one segment's header and footer, recovering it if it was never sealed."""
+        size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            header = f.read(self.HEADER.size)
+            if len(header) < self.HEADER.size:
+                raise ValueError("truncated header")
+            if header != self._header:
+                raise ValueError("segment was written with a different record format")
+            # A sealed segment ends with a footer whose count matches the file size.
+            if size >= self.HEADER.size + self.FOOTER.size:
+                f.seek(size - self.FOOTER.size)
+                magic, count, first_ts, last_ts, _crc = self.FOOTER.unpack(f.read(self.FOOTER.size))
+                if magic == self.FOOTER_MAGIC and size == self.HEADER.size + count * self.record.size + self.FOOTER.size:
+                    return [sequence, path, first_ts, last_ts, count] if count else None
+
+        # Unsealed: drop any partially written record.
+        count = (size - self.HEADER.size) // self.record.size
+        valid_size = self.HEADER.size + count * self.record.size
+        if self.read_only:
+            # Another process may be appending to it; read the whole records there are now.
+            if count == 0:
+                return None
+            with open(path, 'rb') as f:
+                f.seek(self.HEADER.size)
+                data = f.read(count * self.record.size)
+            return [sequence, path, struct.unpack_from("<d", data, 0)[0],
+                    struct.unpack_from("<d", data, (count - 1) * self.record.size)[0], count]
+        if valid_size != size:
+            logging.warning("Trimming a torn write from history segment %s (%d bytes).", path, size - valid_size)
+            with open(path, 'r+b') as f:
+                f.truncate(valid_size)
+        if count == 0:
+            os.remove(path)
+            return None
+
+        with open(path, 'rb') as f:
+            f.seek(self.HEADER.size)
+            data = f.read(count * self.record.size)
+        first_ts = struct.unpack_from("<d", data, 0)[0]
+        last_ts = struct.unpack_from("<d", data, (count - 1) * self.record.size)[0]
+        crc = zlib.crc32(data)
+        if is_newest and count < self.segment_records:
+            self._reopen_active(path, crc)
+        else:
+            # A full (or no longer newest) segment that missed its footer is sealed now.
+            with open(path, 'ab') as f:
+                f.write(self.FOOTER.pack(self.FOOTER_MAGIC, count, first_ts, last_ts, crc))
+        return [sequence, path, first_ts, last_ts, count]
+
+    def _reopen_active(self, path: str, crc: int):
+        self._active = open(path, 'ab')
+        self._active_crc = crc
+
+    # --- Writing ---
+
+    def append(self, values: tuple) -> bool:
+        """
+        Queues one record. It is written with the next batch.
+
+        Returns:
+            bool: False if the record was rejected for going back in time.
+        """
+        if self.read_only:
+            raise RuntimeError(f"The history store {self.directory} was opened read-only.")
+        timestamp = values[0]
+        with self._lock:
+            if timestamp < self._last_timestamp:
+                return False
+            self._last_timestamp = timestamp
+            if self._pending_count == 0:
+                self._pending_since = time.monotonic()
+            self._pending += self.record.pack(*values)
+            self._pending_count += 1
+            if (self._pending_count >= self.flush_records
+                    or time.monotonic() - self._pending_since >= self.flush_seconds):
+                self.flush()
+            return True
+
+    def flush(self):
+        """Writes every pending record, sealing and starting segments as they fill up."""
+        with self._lock:
+            data = self._pending
+            offset = 0
+            size = self.record.size
+            while offset < len(data):
+                if self._active is None:
+                    self._start_segment()
+                entry = self._segments[-1]
+                room = self.segment_records - entry[4]
+                chunk = bytes(data[offset:offset + room * size])
+                self._active.write(chunk)
+                self._active_crc = zlib.crc32(chunk, self._active_crc)
+                n = len(chunk) // size
+                if entry[4] == 0:
+                    entry[2] = struct.unpack_from("<d", chunk, 0)[0]
+                entry[3] = struct.unpack_from("<d", chunk, (n - 1) * size)[0]
+                entry[4] += n
+                self._last_ts[-1] = entry[3]
+                offset += len(chunk)
+                if entry[4] >= self.segment_records:
+                    self._seal_active()
+                else:
+                    self._active.flush()
+            self._pending = bytearray()
+            self._pending_count = 0
+
+    def _start_segment(self):
+        sequence = self._next_sequence
+        self._next_sequence += 1
+        path = os.path.join(self.directory, "%08d%s" % (sequence, self.SUFFIX))
+        self._active = open(path, 'wb')
+        self._active.write(self._header)
+        self._active_crc = 0
+        self._segments.append([sequence, path, math.inf, -math.inf, 0])
+        self._last_ts.append(-math.inf)
+
+    def _seal_active(self):
+        """Appends the footer to the active segment and makes it durable."""
+        _, _, first_ts, last_ts, count = self._segments[-1]
+        self._active.write(self.FOOTER.pack(self.FOOTER_MAGIC, count, first_ts, last_ts, self._active_crc))
+        self._active.flush()
+        os.fsync(self._active.fileno())
+        self._active.close()
+        self._active = None
+
+    def close(self):
+        """Writes pending records and closes the active segment (it stays unsealed)."""
+        with self._lock:
+            self.flush()
+            if self._active is not None:
+                self._active.close()
+                self._active = None
+
+    # --- Reading ---
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(entry[4] for entry in self._segments) + self._pending_count
+
+    def time_range(self) -> Optional[Tuple[float, float]]:
+        """The first and last timestamps in the store, or None if it is empty."""
+        with self._lock:
+            first = next((e[2] for e in self._segments if e[4]), None)
+            if first is None and self._pending_count:
+                first = struct.unpack_from("<d", self._pending, 0)[0]
+            return None if first is None else (first, self._last_timestamp)
+
+    def query(self, start: float, end: float) -> List[tuple]:
+        """
+        Returns every record with start <= timestamp <= end, oldest first. Each
+        overlapping segment is memory-mapped and binary-searched.
+        """
+        results: List[tuple] = []
+        size = self.record.size
+        with self._lock:
+            first = bisect.bisect_left(self._last_ts, start)
+            for sequence, path, first_ts, last_ts, count in self._segments[first:]:
+                if first_ts > end:
+                    break
+                if count == 0:
+                    continue
+                with open(path, 'rb') as f:
+                    with mmap.mmap(f.fileno(), self.HEADER.size + count * size, access=mmap.ACCESS_READ) as mm:
+                        timestamps = self._Timestamps(mm, size, count)
+                        lo = bisect.bisect_left(timestamps, start)
+                        hi = bisect.bisect_right(timestamps, end, lo)
+                        if lo < hi:
+                            base = self.HEADER.size
+                            results.extend(self.record.iter_unpack(mm[base + lo * size:base + hi * size]))
+            # Records still waiting for the next batched write.
+            if self._pending_count:
+                results.extend(r for r in self.record.iter_unpack(bytes(self._pending)) if start <= r[0] <= end)
+        return results
+
+    def iter_query(self, start: float, end: float, chunk_records: int = 4096):
+        """
+        Yields the records query() would return, oldest first, without building
+        the list: each overlapping segment is mapped and unpacked `chunk_records`
+        at a time. Records appended during the iteration are not included.
+        """
+        size = self.record.size
+        with self._lock:
+            first = bisect.bisect_left(self._last_ts, start)
+            segments = [tuple(entry) for entry in self._segments[first:]]
+            pending = bytes(self._pending)
+        for sequence, path, first_ts, last_ts, count in segments:
+            if first_ts > end:
+                return
+            if count == 0:
+                continue
+            with open(path, 'rb') as f:
+                with mmap.mmap(f.fileno(), self.HEADER.size + count * size, access=mmap.ACCESS_READ) as mm:
+                    timestamps = self._Timestamps(mm, size, count)
+                    lo = bisect.bisect_left(timestamps, start)
+                    hi = bisect.bisect_right(timestamps, end, lo)
+                    base = self.HEADER.size
+                    for chunk_start in range(lo, hi, chunk_records):
+                        chunk_end = min(chunk_start + chunk_records, hi)
+                        yield from self.record.iter_unpack(mm[base + chunk_start * size:base + chunk_end * size])
+        for r in self.record.iter_unpack(pending):
+            if start <= r[0] <= end:
+                yield r
+
+    def tail(self, count: int) -> List[tuple]:
+        """Returns the newest `count` records, oldest first, reading only the end of the newest segments."""
+        if count <= 0:
+            return []
+        size = self.record.size
+        with self._lock:
+            results = list(self.record.iter_unpack(bytes(self._pending)))[-count:]
+            for sequence, path, first_ts, last_ts, stored in reversed(self._segments):
+                needed = count - len(results)
+                if needed <= 0:
+                    break
+                if stored == 0:
+                    continue
+                take = min(needed, stored)
+                with open(path, 'rb') as f:
+                    f.seek(self.HEADER.size + (stored - take) * size)
+                    results[:0] = self.record.iter_unpack(f.read(take * size))
+        return results
+
+
+class RollupAggregator:
+    """
+    Summarizes samples into fixed-width time buckets: for each metric, the
+    count, min, max, mean and last of its (non-NaN) readings. Each sample
+    updates the open bucket in O(1); a finished bucket is appended to its store.
+
+    Rollup record: bucket start, sample count, then (count, min, max, mean, last) per metric.
+    """
+    RECORD_FORMAT = "<dI" + "Iffff" * len(HISTORY_ROLLUP_METRICS)
+    FIELDS = ["timestamp", "samples"] + [f"{metric}_{stat}" for metric in HISTORY_ROLLUP_METRICS
+                                         for stat in ("count", "min", "max", "mean", "last")]
+
+    def __init__(self, resolution: int, store: SegmentTimeSeriesStore):
+        """
+        Args:
+            resolution (int): The bucket width in seconds.
+            store (SegmentTimeSeriesStore): Where finished buckets are appended.
+        """
+        self.resolution = resolution
+        self.store = store
+        self._bucket: Optional[float] = None     # Start of the open bucket.
+        self._samples = 0
+        # Flat per-metric running state: count, min, max, sum, last.
+        self._stats = [0, math.inf, -math.inf, 0.0, math.nan] * len(HISTORY_ROLLUP_METRICS)
+
+    def add(self, timestamp: float, values: Tuple[float, ...]):
+        """Folds one sample (one value per metric, NaN if missing) into the open bucket."""
+        bucket = timestamp - timestamp % self.resolution
+        if bucket != self._bucket:
+            if self._bucket is not None:
+                self.store.append(self._record())
+            self._bucket = bucket
+            self._samples = 0
+            self._stats = [0, math.inf, -math.inf, 0.0, math.nan] * len(HISTORY_ROLLUP_METRICS)
+        self._samples += 1
+        stats = self._stats
+        for i, value in enumerate(values):
+            if value != value:      # NaN: the reading was missing.
+                continue
+            j = i * 5
+            stats[j] += 1
+            if value < stats[j + 1]:
+                stats[j + 1] = value
+            if value > stats[j + 2]:
+                stats[j + 2] = value
+            stats[j + 3] += value
+            stats[j + 4] = value
+
+    def _record(self) -> tuple:
+        """The open bucket as a rollup record."""
+        record = [self._bucket, self._samples]
+        stats = self._stats
+        for j in range(0, len(stats), 5):
+            count = stats[j]
+            if count:
+                record += [count, stats[j + 1], stats[j + 2], stats[j + 3] / count, stats[j + 4]]
+            else:
+                record += [0, math.nan, math.nan, math.nan, math.nan]
+        return tuple(record)
+
+    def open_record(self) -> Optional[tuple]:
+        """The partially filled current bucket, or None if nothing was added yet."""
+        return None if self._bucket is None else self._record()
+
+    def resume_after(self) -> float:
+        """The timestamp from which samples must be replayed to rebuild the open bucket."""
+        time_range = self.store.time_range()
+        return -math.inf if time_range is None else time_range[1] + self.resolution
+
+class SessionSegmenter:
+    """
+    A streaming state machine that splits the sample stream into discharge,
+    charge and idle (on AC, not charging) sessions. A session ends when the
+    power state changes or the samples stop for SESSION_MAX_GAP_SECONDS.
+    Finished sessions are appended to one store per kind, keyed by their start
+    time, so the newest N of a kind are read from the end of a single store.
+    Where the open session starts is kept in a small state file, so reopening
+    the history replays only that session, not everything since the last one closed.
+    """
+    FIELDS = ["timestamp", "end", "start_percent", "end_percent", "energy_wh",
+              "average_power_watts", "peak_power_watts", "average_temperature", "peak_temperature", "samples"]
+
+    def __init__(self, stores: Dict[str, SegmentTimeSeriesStore], state_path: Optional[str] = None):
+        """
+        Args:
+            stores (Dict[str, SegmentTimeSeriesStore]): A store (or table) for each of SESSION_KINDS.
+            state_path (str): The file that records where the open session starts. None keeps it in memory only.
+        """
+        self.stores = stores
+        self.state_path = state_path
+        self.save_state = True              # Cleared while the history replays samples it has already seen.
+        self.kind: Optional[str] = None     # Kind of the open session; None before the first sample.
+        # Timestamp of the sample just before the open session, or -inf if it starts the history.
+        self.opened_after: Optional[float] = self._load_state()
+        self._reset(None)
+
+    def _load_state(self) -> Optional[float]:
+        if not self.state_path or not os.path.exists(self.state_path):
+            return None
+        try:
+            with open(self.state_path, 'r') as f:
+                return float(json.load(f)["opened_after"])
+        except Exception as e:
+            logging.warning("Ignoring unreadable session state %s: %s", self.state_path, e)
+            return None
+
+    def save(self):
+        """Records where the open session starts."""
+        if not self.state_path or self.opened_after is None:
+            return
+        try:
+            with open(self.state_path, 'w') as f:
+                json.dump({"opened_after": self.opened_after}, f)
+        except Exception as e:
+            logging.error("Failed to persist the open session: %s", e)
+
+    @staticmethod
+    def kind_for_flags(flags: int) -> str:
+        if flags & SAMPLE_FLAG_CHARGING:
+            return "charge"
+        return "idle" if flags & SAMPLE_FLAG_AC_ONLINE else "discharge"
+
+    def _reset(self, timestamp: Optional[float]):
+        """Starts accumulating a new session at a timestamp."""
+        self.start = timestamp
+        self.end = timestamp
+        self.start_percent = math.nan
+        self.end_percent = math.nan
+        self.energy_joules = 0.0
+        self.power_seconds = 0.0            # Time covered by two consecutive power readings.
+        self.peak_power = math.nan
+        self.temperature_sum = 0.0
+        self.temperature_count = 0
+        self.peak_temperature = math.nan
+        self.count = 0
+        self._last_power = math.nan
+
+    def resume_after(self) -> float:
+        """
+        The timestamp after which samples still have to be replayed: the sample
+        before the open session, or the end of the newest stored session if
+        that is later (or no state was saved).
+        """
+        ends = [rows[0][1] for rows in (store.tail(1) for store in self.stores.values()) if rows]
+        if self.opened_after is not None:
+            ends.append(self.opened_after)
+        return max(ends) if ends else -math.inf
+
+    def add(self, timestamp: float, percent: float, power_watts: float, temperature: float, flags: int):
+        """Folds one sample into the open session, first closing it if the sample starts a new one."""
+        kind = self.kind_for_flags(flags)
+        if self.kind is not None and (kind != self.kind or timestamp - self.end > SESSION_MAX_GAP_SECONDS):
+            self._close()
+        if self.kind is None:
+            self.opened_after = -math.inf if self.end is None else self.end
+            self.kind = kind
+            self._reset(timestamp)
+            if self.save_state:
+                self.save()
+
+        # Energy, by the trapezoidal rule between consecutive readings.
+        if not math.isnan(power_watts):
+            if not math.isnan(self._last_power) and timestamp > self.end:
+                elapsed = timestamp - self.end
+                self.energy_joules += (self._last_power + power_watts) / 2.0 * elapsed
+                self.power_seconds += elapsed
+            if not power_watts <= self.peak_power:
+                self.peak_power = power_watts
+        self._last_power = power_watts
+        if not math.isnan(percent):
+            if math.isnan(self.start_percent):
+                self.start_percent = percent
+            self.end_percent = percent
+        if not math.isnan(temperature):
+            self.temperature_sum += temperature
+            self.temperature_count += 1
+            if not temperature <= self.peak_temperature:
+                self.peak_temperature = temperature
+        self.end = timestamp
+        self.count += 1
+
+    def _record(self) -> tuple:
+        average_power = self.energy_joules / self.power_seconds if self.power_seconds else math.nan
+        average_temperature = self.temperature_sum / self.temperature_count if self.temperature_count else math.nan
+        return (self.start, self.end, self.start_percent, self.end_percent, self.energy_joules / 3600.0,
+                average_power, self.peak_power, average_temperature, self.peak_temperature, self.count)
+
+    def _close(self):
+        """Stores the open session, unless it is too short to mean anything."""
+        if self.end - self.start >= SESSION_MIN_SECONDS:
+            self.stores[self.kind].append(self._record())
+        self.kind = None
+
+    def open_session(self) -> Optional[Dict[str, Any]]:
+        """The session in progress, or None before the first sample."""
+        return None if self.kind is None else self.as_dict(self.kind, self._record())
+
+    @classmethod
+    def as_dict(cls, kind: str, record: tuple) -> Dict[str, Any]:
+        session = dict(zip(cls.FIELDS, record))
+        session["kind"] = kind
+        session["duration_seconds"] = session["end"] - session["timestamp"]
+        return session
+
+
+class BatteryHistory:
+    """
+    The persisted history of real-time samples, under BatteryZ_Data/history,
+    with minute, hour and day rollups of it. Only finished rollup buckets are
+    stored; the open ones are rebuilt from the raw samples when the history is
+    opened, which also backfills rollups for samples recorded before they existed.
+    The capacity and usage history from Windows' powercfg report is imported
+    into two more stores, which covers the weeks before Battery-Z was installed.
+    The samples are also split into charge, discharge and idle sessions.
+    There is one instance per directory, shared process-wide.
+    """
+    # Sample layout (HISTORY_SAMPLE_FORMAT). Timestamps are epoch seconds; missing readings are NaN.
+    SAMPLE_FIELDS = ["timestamp", "percent", "voltage_mv", "power_watts", "temperature", "flags"]
+    CAPACITY_FIELDS = ["timestamp", "end", "design_capacity_mwh", "full_charge_capacity_mwh", "cycle_count"]
+    USAGE_FIELDS = ["timestamp", "duration_seconds", "ac_online", "entry_type",
+                    "charge_capacity_mwh", "full_charge_capacity_mwh", "discharge_mwh"]
+
+    _instances: Dict[str, "BatteryHistory"] = {}
+    _instances_lock = threading.Lock()
+
+    @staticmethod
+    def make_flags(is_charging: Optional[bool], ac_online: Optional[bool]) -> int:
+        """Packs the charging and AC states into a sample's flag byte."""
+        return (SAMPLE_FLAG_CHARGING if is_charging else 0) | (SAMPLE_FLAG_AC_ONLINE if ac_online else 0)
+
+    @classmethod
+    def for_path(cls, directory: str) -> "BatteryHistory":
+        """Returns the shared history for a directory, creating it on first use."""
+        key = os.path.abspath(directory)
+        with cls._instances_lock:
+            if key not in cls._instances:
+                history = cls(directory)
+                # Write out the last partial batch on exit.
+                atexit.register(history.close)
+                cls._instances[key] = history
+            return cls._instances[key]
+
+    def __init__(self, directory: str, backend: Optional[str] = None):
+        """
+        Args:
+            directory (str): The history directory. With segment files, each store gets a sub-directory.
+            backend (str): One of HISTORY_BACKENDS. Defaults to the HISTORY_BACKEND setting.
+        """
+        self.directory = directory
+        self.backend = backend or HISTORY_BACKEND
+        if self.backend not in HISTORY_BACKENDS:
+            raise ValueError(f"Unknown history backend '{self.backend}'.")
+        # With SQLite, every store is a table in one database.
+        self.database = (SQLiteHistoryDatabase(os.path.join(directory, HISTORY_SQLITE_FILE))
+                         if self.backend == "sqlite" else None)
+        self.samples = self._open_store("samples", HISTORY_SAMPLE_FORMAT, self.SAMPLE_FIELDS)
+        self.rollups = {
+            resolution: RollupAggregator(resolution, self._open_store(
+                f"rollup_{resolution}", RollupAggregator.RECORD_FORMAT, RollupAggregator.FIELDS))
+            for resolution in HISTORY_ROLLUP_RESOLUTIONS
+        }
+        self.report_capacity = self._open_store("report_capacity", HISTORY_CAPACITY_FORMAT, self.CAPACITY_FIELDS)
+        self.report_usage = self._open_store("report_usage", HISTORY_USAGE_FORMAT, self.USAGE_FIELDS)
+        self.sessions = SessionSegmenter({
+            kind: self._open_store(f"sessions_{kind}", SESSION_FORMAT, SessionSegmenter.FIELDS) for kind in SESSION_KINDS
+        }, os.path.join(directory, SESSION_STATE_FILE))
+        self._metric_columns = [self.SAMPLE_FIELDS.index(metric) for metric in HISTORY_ROLLUP_METRICS]
+        self._lock = threading.Lock()
+        self._import_lock = threading.Lock()
+        self._rebuild_open_buckets()
+
+    @staticmethod
+    def open_samples_read_only(directory: str, backend: Optional[str] = None):
+        """
+        Opens just the sample store of a history, read-only, for a second process
+        (e.g., --export-history) while the app may be recording into it. Nothing is
+        recovered, rebuilt or flushed on exit, so the writer's files are left alone.
+
+        Returns:
+            The store (with time_range(), query() and iter_query()), or None if nothing was recorded.
+        """
+        backend = backend or HISTORY_BACKEND
+        if backend not in HISTORY_BACKENDS:
+            raise ValueError(f"Unknown history backend '{backend}'.")
+        if backend == "sqlite":
+            path = os.path.join(directory, HISTORY_SQLITE_FILE)
+            if not os.path.exists(path):
+                return None
+            return SQLiteHistoryDatabase(path, read_only=True).table(
+                "samples", HISTORY_SAMPLE_FORMAT, BatteryHistory.SAMPLE_FIELDS)
+        path = os.path.join(directory, "samples")
+        if not os.path.isdir(path):
+            return None
+        return SegmentTimeSeriesStore(path, HISTORY_SAMPLE_FORMAT, BatteryHistory.SAMPLE_FIELDS, read_only=True)
+
+    def _open_store(self, name: str, record_format: str, fields: List[str]):
+        """Opens one named store on the configured backend."""
+        if self.database is not None:
+            return self.database.table(name, record_format, fields)
+        return SegmentTimeSeriesStore(os.path.join(self.directory, name), record_format, fields)
+
+    def time_range(self) -> Optional[Tuple[float, float]]:
+        """The first and last recorded sample timestamps, or None if nothing was recorded."""
+        return self.samples.time_range()
+
+    def _rebuild_open_buckets(self):
+        """
+        Replays the samples each rollup, and the open session, has not stored yet,
+        in one streaming pass. Normally that is only the open bucket of each
+        resolution and the open session. When a rollup has no buckets at all
+        (history recorded before rollups existed), the pass backfills it.
+        """
+        time_range = self.samples.time_range()
+        if time_range is None:
+            return
+        last = time_range[1]
+        rollups = [(aggregator, aggregator.resume_after()) for aggregator in self.rollups.values()]
+        rollups = [(aggregator, start) for aggregator, start in rollups if start <= last]
+        session_start = self.sessions.resume_after()
+        starts = [start for _, start in rollups] + ([session_start] if session_start < last else [])
+        if not starts:
+            return
+        columns = self._metric_columns
+        replayed = 0
+        # The replay reopens the session the state file points at; save it once, at the end.
+        self.sessions.save_state = False
+        for sample in self.samples.iter_query(min(starts), last):
+            timestamp = sample[0]
+            metrics = tuple(sample[c] for c in columns)
+            for aggregator, start in rollups:
+                if timestamp >= start:
+                    aggregator.add(timestamp, metrics)
+            if timestamp > session_start:
+                self.sessions.add(timestamp, sample[1], sample[3], sample[4], sample[5])
+            replayed += 1
+        self.sessions.save_state = True
+        self.sessions.save()
+        logging.info("History opened. Replayed %d samples into the open rollup buckets and session.", replayed)
+
+    def record(self, timestamp: float, percent: Optional[float], voltage_mv: Optional[float],
+               power_watts: Optional[float], temperature: Optional[float], flags: int = 0) -> bool:
+        """Persists one real-time sample and folds it into the rollups. Missing readings are stored as NaN."""
+        nan = math.nan
+        percent = nan if percent is None else percent
+        voltage_mv = nan if voltage_mv is None else voltage_mv
+        power_watts = nan if power_watts is None else power_watts
+        temperature = nan if temperature is None else temperature
+        with self._lock:
+            if not self.samples.append((timestamp, percent, voltage_mv, power_watts, temperature, flags)):
+                return False
+            metrics = (percent, power_watts, voltage_mv, temperature)
+            for aggregator in self.rollups.values():
+                aggregator.add(timestamp, metrics)
+            self.sessions.add(timestamp, percent, power_watts, temperature, flags)
+        return True
+
+    def query(self, start: float, end: float) -> List[tuple]:
+        """The raw samples between two epoch timestamps, oldest first."""
+        return self.samples.query(start, end)
+
+    def import_battery_report(self, path: str) -> Dict[str, int]:
+        """
+        Streams a powercfg XML report and appends its CapacityHistory and
+        RecentUsage rows to the report stores. Rows at or before the newest
+        row stored before this import are skipped, so re-importing a regenerated
+        report only appends what is new. Rows of the same report that share a
+        timestamp are all kept.
+
+        Args:
+            path (str): Path to the XML report.
+
+        Returns:
+            Dict[str, int]: The number of new "capacity" and "usage" rows.
+        """
+        nan = math.nan
+        def number(value):
+            return nan if value is None else value
+
+        added = {"capacity": 0, "usage": 0}
+        # Serialized, so two report refreshes never interleave their rows.
+        with self._import_lock:
+            # Taken once: only rows already stored are duplicates, not earlier rows of this report.
+            capacity_range = self.report_capacity.time_range()
+            usage_range = self.report_usage.time_range()
+            capacity_watermark = capacity_range[1] if capacity_range else -math.inf
+            usage_watermark = usage_range[1] if usage_range else -math.inf
+
+            for kind, record in iter_battery_report(path):
+                if kind == "capacity" and record.start is not None:
+                    timestamp = record.start.timestamp()
+                    if timestamp <= capacity_watermark:
+                        continue
+                    if self.report_capacity.append((
+                        timestamp,
+                        record.end.timestamp() if record.end else nan,
+                        number(record.design_capacity_mwh),
+                        number(record.full_charge_capacity_mwh),
+                        number(record.cycle_count),
+                    )):
+                        added["capacity"] += 1
+                elif kind == "usage" and record.timestamp is not None:
+                    timestamp = record.timestamp.timestamp()
+                    if timestamp <= usage_watermark:
+                        continue
+                    entry_type = (HISTORY_USAGE_ENTRY_TYPES.index(record.entry_type) + 1
+                                  if record.entry_type in HISTORY_USAGE_ENTRY_TYPES else 0)
+                    if self.report_usage.append((
+                        timestamp,
+                        record.duration_seconds,
+                        255 if record.ac_online is None else int(record.ac_online),
+                        entry_type,
+                        number(record.charge_capacity_mwh),
+                        number(record.full_charge_capacity_mwh),
+                        number(record.discharge_mwh),
+                    )):
+                        added["usage"] += 1
+            self.report_capacity.flush()
+            self.report_usage.flush()
+        logging.info("Imported %d capacity and %d usage rows from %s.", added["capacity"], added["usage"], path)
+        return added
+
+    def query_report(self, field_name: str, start: float, end: float) -> List[tuple]:
+        """
+        One field of the imported capacity history as (timestamp, value, value, value)
+        rows, matching query_for_width, for the given range.
+        """
+        column = self.CAPACITY_FIELDS.index(field_name)
+        return [(r[0], r[column], r[column], r[column]) for r in self.report_capacity.query(start, end)]
+
+    def report_percent_before(self, start: float, end: float) -> List[tuple]:
+        """
+        The charge level derived from the imported usage history, as
+        (timestamp, percent, percent, percent) rows for [start, end). Used to
+        fill the part of a chart that predates the recorded samples.
+        """
+        rows = []
+        usage = self.USAGE_FIELDS
+        charge, full = usage.index("charge_capacity_mwh"), usage.index("full_charge_capacity_mwh")
+        for r in self.report_usage.query(start, end):
+            if r[0] < end and r[full] > 0 and r[charge] == r[charge]:
+                percent = min(100.0, r[charge] / r[full] * 100)
+                rows.append((r[0], percent, percent, percent))
+        return rows
+
+    def query_rollup(self, resolution: int, start: float, end: float) -> List[tuple]:
+        """The rollup records whose buckets overlap [start, end], including the open bucket."""
+        aggregator = self.rollups[resolution]
+        with self._lock:
+            records = aggregator.store.query(start - start % resolution, end)
+            current = aggregator.open_record()
+        if current is not None and current[0] <= end and current[0] + resolution > start:
+            records.append(current)
+        return records
+
+    def query_for_width(self, field_name: str, start: float, end: float, width: int) -> Tuple[int, List[tuple]]:
+        """
+        Picks the coarsest resolution that still gives at least `width` points
+        over [start, end] (raw samples if no rollup does) and returns one metric.
+
+        Args:
+            field_name (str): One of HISTORY_ROLLUP_METRICS.
+            start (float), end (float): The epoch time range.
+            width (int): The number of horizontal pixels to fill.
+
+        Returns:
+            Tuple[int, List[tuple]]: The resolution in seconds (0 for raw samples)
+            and (timestamp, mean, min, max) rows, oldest first.
+        """
+        metric = HISTORY_ROLLUP_METRICS.index(field_name)
+        for resolution in sorted(self.rollups, reverse=True):
+            if (end - start) / resolution >= width:
+                base = 2 + metric * 5
+                return resolution, self._with_report_percent(field_name, start, [
+                    (r[0], r[base + 3], r[base + 1], r[base + 2]) for r in self.query_rollup(resolution, start, end)])
+        column = self.SAMPLE_FIELDS.index(field_name)
+        return 0, self._with_report_percent(field_name, start, [
+            (r[0], r[column], r[column], r[column]) for r in self.samples.query(start, end)])
+
+    def recent_sessions(self, kind: str, count: int = 30, include_open: bool = False) -> List[Dict[str, Any]]:
+        """
+        The newest finished sessions of one kind, oldest first.
+
+        Args:
+            kind (str): One of SESSION_KINDS.
+            count (int): The number of sessions.
+            include_open (bool): Also return the session in progress, if it is of this kind.
+        """
+        with self._lock:
+            sessions = [SessionSegmenter.as_dict(kind, r) for r in self.sessions.stores[kind].tail(count)]
+            current = self.sessions.open_session() if include_open else None
+        if current is not None and current["kind"] == kind:
+            sessions = (sessions + [current])[-count:]
+        return sessions
+
+    def query_sessions(self, kind: str, start: float, end: float) -> List[Dict[str, Any]]:
+        """The finished sessions of one kind that started between two epoch timestamps, oldest first."""
+        return [SessionSegmenter.as_dict(kind, r) for r in self.sessions.stores[kind].query(start, end)]
+
+    def _with_report_percent(self, field_name: str, start: float, rows: List[tuple]) -> List[tuple]:
+        """Prefixes a charge-level series with the imported report history that predates it."""
+        if field_name != "percent":
+            return rows
+        time_range = self.samples.time_range()
+        first_sample = time_range[0] if time_range else math.inf
+        before = min(rows[0][0] if rows else math.inf, first_sample)
+        return self.report_percent_before(start, before) + rows if before > start else rows
+
+    def flush(self):
+        with self._lock:
+            self.samples.flush()
+            for aggregator in self.rollups.values():
+                aggregator.store.flush()
+            for store in self.sessions.stores.values():
+                store.flush()
+
+    def close(self):
+        with self._lock:
+            self.samples.close()
+            for aggregator in self.rollups.values():
+                aggregator.store.close()
+            self.report_capacity.close()
+            self.report_usage.close()
+            for store in self.sessions.stores.values():
+                store.close()
+            if self.database is not None:
+                self.database.close()
+
+
+def get_battery_history() -> Optional["BatteryHistory"]:
+    """The shared history under BatteryZ_Data, or None in replay mode (replayed samples are not persisted)."""
+    if REPLAY_PATH:
+        return None
+    return BatteryHistory.for_path(os.path.join(get_app_data_dir(), HISTORY_DIR_NAME))
+
+def lttb_decimate(x, y, threshold: int):
+    """
+    Largest-Triangle-Three-Buckets downsampling. Keeps the first and last point
+    and, from each of `threshold - 2` equal buckets in between, the point that
+    forms the largest triangle with the point kept from the previous bucket and
+    the average of the next one. The visual shape of the series is preserved
+    far better than by striding or averaging.
+
+    Args:
+        x, y: Equal-length sequences (or NumPy arrays); x must be ascending.
+        threshold (int): The number of points to keep.
+
+    Returns:
+        The decimated (x, y), as NumPy arrays when NumPy is available, else lists.
+        The input is returned unchanged if it already has `threshold` points or fewer.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return x, y
+    every = (n - 2) / (threshold - 2)
+    # Bucket i covers [edges[i], edges[i + 1]); the last edge is the final point.
+    edges = [int(i * every) + 1 for i in range(threshold - 1)]
+    edges[-1] = n - 1
+
+    if NUMPY_AVAILABLE:
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        # Every bucket's average at once, from prefix sums.
+        bounds = np.asarray(edges + [n])
+        cx, cy = np.concatenate(([0.0], np.cumsum(x))), np.concatenate(([0.0], np.cumsum(y)))
+        counts = bounds[1:] - bounds[:-1]
+        avg_x = (cx[bounds[1:]] - cx[bounds[:-1]]) / counts
+        avg_y = (cy[bounds[1:]] - cy[bounds[:-1]]) / counts
+        keep = np.empty(threshold, dtype=np.int64)
+        keep[0], keep[-1] = 0, n - 1
+        a = 0
+        for i in range(threshold - 2):
+            lo, hi = edges[i], edges[i + 1]
+            ax, ay = x[a], y[a]
+            # Twice the triangle area for every candidate in the bucket, in one vector operation.
+            area = np.abs((ax - avg_x[i + 1]) * (y[lo:hi] - ay) - (ax - x[lo:hi]) * (avg_y[i + 1] - ay))
+            a = lo + int(area.argmax())
+            keep[i + 1] = a
+        return x[keep], y[keep]
+
+    # Pure-Python fallback.
+    out_x, out_y = [x[0]], [y[0]]
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        nlo, nhi = hi, (edges[i + 2] if i + 2 < len(edges) else n)
+        next_x = sum(x[nlo:nhi]) / (nhi - nlo)
+        next_y = sum(y[nlo:nhi]) / (nhi - nlo)
+        ax, ay = x[a], y[a]
+        best, best_area = lo, -1.0
+        for j in range(lo, hi):
+            area = abs((ax - next_x) * (y[j] - ay) - (ax - x[j]) * (next_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        a = best
+        out_x.append(x[a])
+        out_y.append(y[a])
+    out_x.append(x[n - 1])
+    out_y.append(y[n - 1])
+    return out_x, out_y
+
+# ============================================================================
+# SECTION 5.13: COMPRESSED TELEMETRY ARCHIVES
+# Description: The .bza format for shipping sample history off a machine. Samples
+#              are written in independent, CRC-checked chunks of columns:
+#              timestamps (whole milliseconds) as delta-of-deltas, the float
+#              columns with Gorilla-style XOR encoding of their float32 bits, and
+#              the flags byte run-length encoded. Polling at a steady interval
+#              makes most deltas-of-deltas and XORs tiny, so a sample shrinks from
+#              a 25-byte record (or ~150 bytes of JSON) to a few bytes.
+#
+#              File: magic "BZAR", version, metadata length, metadata JSON, chunks.
+#              Chunk: magic "BZAC", sample count, payload length, CRC32, payload.
+#              Payload: one length-prefixed section per column.
+# ============================================================================
+
+class _BitWriter:
+    """Packs variable-width unsigned integers into bytes, most significant bit first."""
+    def __init__(self):
+        self.out = bytearray()
+        self._acc = 0
+        self._count = 0
+
+    def write(self, value: int, width: int):
+        self._acc = (self._acc << width) | value
+        self._count += width
+        while self._count >= 64:
+            self._count -= 64
+            self.out += (self._acc >> self._count).to_bytes(8, 'big')
+            self._acc &= (1 << self._count) - 1
+
+    def getvalue(self) -> bytes:
+        """The written bits, zero-padded to a whole byte."""
+        tail = self._count
+        if tail:
+            pad = -tail % 8
+            return bytes(self.out) + (self._acc << pad).to_bytes((tail + pad) // 8, 'big')
+        return bytes(self.out)
+
+
+class _BitReader:
+    """Reads what _BitWriter wrote."""
+    def __init__(self, data: bytes):
+        self.data = data
+        self.pos = 0
+
+    def read(self, width: int) -> int:
+        start, end = self.pos, self.pos + width
+        chunk = int.from_bytes(self.data[start >> 3:(end + 7) >> 3], 'big')
+        self.pos = end
+        return (chunk >> (-end % 8)) & ((1 << width) - 1)
+
+
+def _zigzag(value: int) -> int:
+    return value << 1 if value >= 0 else (-value << 1) - 1
+
+def _unzigzag(value: int) -> int:
+    return value >> 1 if not value & 1 else -((value + 1) >> 1)
+
+# Delta-of-delta buckets: (prefix bits, prefix width, payload width), for zigzagged values below 2 ** payload width.
+_DOD_BUCKETS = ((0b10, 2, 7), (0b110, 3, 9), (0b1110, 4, 12), (0b11110, 5, 32), (0b11111, 5, 64))
+
+def _encode_timestamps(timestamps_ms: List[int]) -> bytes:
+    bits = _BitWriter()
+    bits.write(timestamps_ms[0], 64)
+    previous, previous_delta = timestamps_ms[0], 0
+    for t in timestamps_ms[1:]:
+        delta = t - previous
+        dod = delta - previous_delta
+        if dod == 0:
+            bits.write(0, 1)
+        else:
+            zz = _zigzag(dod)
+            for prefix, prefix_width, width in _DOD_BUCKETS:
+                if zz < 1 << width:
+                    bits.write(prefix, prefix_width)
+                    bits.write(zz, width)
+                    break
+        previous, previous_delta = t, delta
+    return bits.getvalue()
+
+def _decode_timestamps(data: bytes, count: int) -> List[int]:
+    bits = _BitReader(data)
+    t = bits.read(64)
+    out = [t]
+    delta = 0
+    for _ in range(count - 1):
+        if bits.read(1) == 0:
+            dod = 0
+        elif bits.read(1) == 0:
+            dod = _unzigzag(bits.read(7))
+        elif bits.read(1) == 0:
+            dod = _unzigzag(bits.read(9))
+        elif bits.read(1) == 0:
+            dod = _unzigzag(bits.read(12))
+        else:
+            dod = _unzigzag(bits.read(64 if bits.read(1) else 32))
+        delta += dod
+        t += delta
+        out.append(t)
+    return out
+
+def _encode_floats(values: List[float]) -> bytes:
+    """Gorilla XOR encoding of the values' float32 bit patterns."""
+    words = array.array('I', array.array('f', values).tobytes())
+    bits = _BitWriter()
+    previous = words[0]
+    bits.write(previous, 32)
+    lead_prev, trail_prev = 33, 0      # No window yet: forces an explicit one.
+    for word in words[1:]:
+        xor = word ^ previous
+        previous = word
+        if xor == 0:
+            bits.write(0, 1)
+            continue
+        lead = 32 - xor.bit_length()
+        trail = (xor & -xor).bit_length() - 1
+        if lead >= lead_prev and trail >= trail_prev:
+            # The changed bits fit in the previous window: reuse it.
+            bits.write(0b10, 2)
+            bits.write(xor >> trail_prev, 32 - lead_prev - trail_prev)
+        else:
+            meaningful = 32 - lead - trail
+            bits.write(0b11, 2)
+            bits.write(lead, 5)
+            bits.write(meaningful - 1, 5)
+            bits.write(xor >> trail, meaningful)
+            lead_prev, trail_prev = lead, trail
+    return bits.getvalue()
+
+def _decode_floats(data: bytes, count: int) -> List[float]:
+    bits = _BitReader(data)
+    previous = bits.read(32)
+    words = array.array('I', [previous])
+    lead, trail = 0, 0
+    for _ in range(count - 1):
+        if bits.read(1):
+            if bits.read(1):
+                lead = bits.read(5)
+                trail = 32 - lead - (bits.read(5) + 1)
+            previous ^= bits.read(32 - lead - trail) << trail
+        words.append(previous)
+    return array.array('f', words.tobytes()).tolist()
+
+def _write_varint(out: bytearray, value: int):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def _read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+def _encode_runs(values: List[int]) -> bytes:
+    """Run-length encoding of a byte column: (value, varint run length) pairs."""
+    out = bytearray()
+    run_value, run_length = values[0], 0
+    for value in values:
+        if value == run_value:
+            run_length += 1
+        else:
+            out.append(run_value)
+            _write_varint(out, run_length)
+            run_value, run_length = value, 1
+    out.append(run_value)
+    _write_varint(out, run_length)
+    return bytes(out)
+
+def _decode_runs(data: bytes) -> List[int]:
+    out: List[int] = []
+    pos = 0
+    while pos < len(data):
+        value = data[pos]
+        run_length, pos = _read_varint(data, pos + 1)
+        out.extend([value] * run_length)
+    return out
+
+
+class TelemetryArchiveWriter:
+    """
+    Streams samples into a .bza archive. Samples are buffered until a chunk of
+    ARCHIVE_CHUNK_SAMPLES is full, so memory use is bounded by one chunk.
+    Timestamps are stored to the millisecond and values as float32.
+    """
+    MAGIC = b"BZAR"
+    CHUNK_MAGIC = b"BZAC"
+    VERSION = 1
+    HEADER = struct.Struct("<4sHI")
+    CHUNK_HEADER = struct.Struct("<4sIII")
+    # Sample layout, as recorded by BatteryHistory.
+    FIELDS = list(BatteryHistory.SAMPLE_FIELDS)
+
+    def __init__(self, path: str, metadata: Optional[Dict[str, Any]] = None,
+                 chunk_samples: int = ARCHIVE_CHUNK_SAMPLES):
+        """
+        Args:
+            path (str): The archive file to create.
+            metadata (Dict): Free-form JSON metadata stored in the header (e.g., machine and battery identity).
+            chunk_samples (int): Samples per chunk.
+        """
+        self.chunk_samples = chunk_samples
+        self.count = 0
+        self._pending: List[tuple] = []
+        self._file = open(path, 'wb')
+        meta = json.dumps({"fields": self.FIELDS, **(metadata or {})}).encode('utf-8')
+        self._file.write(self.HEADER.pack(self.MAGIC, self.VERSION, len(meta)))
+        self._file.write(meta)
+
+    def write(self, sample: tuple):
+        """Adds one (timestamp, percent, voltage_mv, power_watts, temperature, flags) sample."""
+        self._pending.append(sample)
+        if len(self._pending) >= self.chunk_samples:
+            self._write_chunk()
+
+    def write_many(self, samples):
+        for sample in samples:
+            self.write(sample)
+
+    def _write_chunk(self):
+        columns = list(zip(*self._pending))
+        sections = [_encode_timestamps([int(round(t * 1000)) for t in columns[0]])]
+        sections += [_encode_floats(column) for column in columns[1:5]]
+        sections.append(_encode_runs(columns[5]))
+        payload = b"".join(struct.pack("<I", len(section)) + section for section in sections)
+        self._file.write(self.CHUNK_HEADER.pack(self.CHUNK_MAGIC, len(self._pending), len(payload), zlib.crc32(payload)))
+        self._file.write(payload)
+        self.count += len(self._pending)
+        self._pending = []
+
+    def close(self):
+        """Writes the last, partial chunk and closes the file."""
+        if self._file is None:
+            return
+        if self._pending:
+            self._write_chunk()
+        self._file.close()
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class TelemetryArchiveReader:
+    """Streams the samples back out of a .bza archive, one chunk in memory at a time."""
+    def __init__(self, path: str):
+        """
+        Args:
+            path (str): The archive to read.
+
+        Raises:
+            ValueError: If the file is not a .bza archive or is from a newer version.
+        """
+        self._file = open(path, 'rb')
+        header = self._file.read(TelemetryArchiveWriter.HEADER.size)
+        if len(header) < TelemetryArchiveWriter.HEADER.size:
+            raise ValueError("Not a Battery-Z archive (truncated header).")
+        magic, version, meta_length = TelemetryArchiveWriter.HEADER.unpack(header)
+        if magic != TelemetryArchiveWriter.MAGIC or version > TelemetryArchiveWriter.VERSION:
+            raise ValueError("Not a Battery-Z archive, or one written by a newer version.")
+        self.metadata: Dict[str, Any] = json.loads(self._file.read(meta_length).decode('utf-8'))
+
+    def iter_chunks(self):
+        """Yields each chunk's samples as a list of tuples. Raises ValueError on a corrupt chunk."""
+        header_size = TelemetryArchiveWriter.CHUNK_HEADER.size
+        while True:
+            header = self._file.read(header_size)
+            if not header:
+                return
+            if len(header) < header_size:
+                raise ValueError("Truncated chunk header.")
+            magic, count, length, crc = TelemetryArchiveWriter.CHUNK_HEADER.unpack(header)
+            payload = self._file.read(length)
+            if magic != TelemetryArchiveWriter.CHUNK_MAGIC or len(payload) < length or zlib.crc32(payload) != crc:
+                raise ValueError("Corrupt chunk in archive.")
+            sections = []
+            pos = 0
+            while pos < length:
+                (size,) = struct.unpack_from("<I", payload, pos)
+                sections.append(payload[pos + 4:pos + 4 + size])
+                pos += 4 + size
+            timestamps = [t / 1000.0 for t in _decode_timestamps(sections[0], count)]
+            floats = [_decode_floats(section, count) for section in sections[1:5]]
+            flags = _decode_runs(sections[5])
+            yield list(zip(timestamps, *floats, flags))
+
+    def __iter__(self):
+        for chunk in self.iter_chunks():
+            yield from chunk
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def export_history_archive(history, path: str, start: float = -math.inf,
+                           end: float = math.inf, metadata: Optional[Dict[str, Any]] = None) -> int:
+    """
+    Writes the recorded samples between two epoch timestamps to a .bza archive,
+    reading the history one day at a time. `history` is a BatteryHistory or a
+    sample store from BatteryHistory.open_samples_read_only().
+
+    Returns:
+        int: The number of samples written.
+    """
+    time_range = history.time_range()
+    with TelemetryArchiveWriter(path, metadata) as writer:
+        if time_range is not None:
+            window_start = max(start, time_range[0])
+            window_end = min(end, time_range[1])
+            while window_start <= window_end:
+                # Half-open daily windows, so a sample on a boundary is written once.
+                stop = min(window_start + 86400, window_end)
+                for sample in history.query(window_start, stop):
+                    if sample[0] < window_start + 86400:
+                        writer.write(sample)
+                window_start += 86400
+    # Counted after close(), which writes the last chunk.
+    return writer.count
+
+# ============================================================================
+# SECTION 5.14: SQLITE HISTORY BACKEND
+# Description: An alternative to the segment files: every history store is a
+#              table in one SQLite database (history.sqlite3), so a machine's
+#              history can be explored with plain SQL. The database runs in WAL
+#              mode with synchronous=NORMAL, and all writes go through one writer
+#              thread that commits batches with a single prepared INSERT. The
+#              polling thread only appends to an in-memory list, so it never waits
+#              on a commit or an fsync. Missing readings are stored as NULL.
+# ============================================================================
+
+class SQLiteTimeSeriesTable:
+    """
+    A time-indexed table with the same interface as SegmentTimeSeriesStore, so
+    BatteryHistory and its rollups work unchanged on either backend. Rows that
+    are still queued for the writer thread are included in queries.
+    """
+    # struct format code -> SQLite column type.
+    COLUMN_TYPES = {'d': "REAL", 'f': "REAL", 'B': "INTEGER", 'H': "INTEGER", 'I': "INTEGER", 'Q': "INTEGER"}
+
+    def __init__(self, database: "SQLiteHistoryDatabase", name: str, record_format: str, fields: List[str]):
+        """
+        Args:
+            database (SQLiteHistoryDatabase): The owning database.
+            name (str): The table name.
+            record_format (str): The struct format the other backend uses; it sets the column types.
+            fields (List[str]): The column names. The first is the timestamp.
+        """
+        self.database = database
+        self.name = name
+        self.fields = list(fields)
+        codes = [c for c in record_format if c.isalpha()]
+        self._real_columns = [i for i, c in enumerate(codes) if self.COLUMN_TYPES[c] == "REAL"]
+        columns = ", ".join(f"{f} {self.COLUMN_TYPES[c]}" + (" NOT NULL" if i == 0 else "")
+                            for i, (f, c) in enumerate(zip(self.fields, codes)))
+        self.insert_sql = f"INSERT INTO {name} ({', '.join(self.fields)}) VALUES ({', '.join('?' * len(self.fields))})"
+        self._select_sql = f"SELECT {', '.join(self.fields)} FROM {name} WHERE timestamp BETWEEN ? AND ? ORDER BY timestamp"
+        self._tail_sql = f"SELECT {', '.join(self.fields)} FROM {name} ORDER BY timestamp DESC LIMIT ?"
+        with database.connect() as conn:
+            if not database.read_only:
+                conn.execute(f"CREATE TABLE IF NOT EXISTS {name} ({columns})")
+                conn.execute(f"CREATE INDEX IF NOT EXISTS {name}_timestamp ON {name} (timestamp)")
+            first, last = conn.execute(f"SELECT MIN(timestamp), MAX(timestamp) FROM {name}").fetchone()
+        self._first_timestamp = first
+        self._last_timestamp = -math.inf if last is None else last
+        self._pending: List[tuple] = []      # Rows waiting for the writer thread.
+        self._inflight: List[tuple] = []     # Rows the writer thread is committing right now.
+        self._committed = 0                  # Queued rows committed since the table was opened.
+        self._committing = 0                 # The same, plus the rows of a commit still in progress.
+
+    def append(self, values: tuple) -> bool:
+        """Queues one row. Returns False if it goes back in time."""
+        if self.database.read_only:
+            raise RuntimeError(f"The history database {self.database.path} was opened read-only.")
+        with self.database.lock:
+            if values[0] < self._last_timestamp:
+                return False
+            self._last_timestamp = values[0]
+            if self._first_timestamp is None:
+                self._first_timestamp = values[0]
+            self._pending.append(values)
+        self.database.notify_append()
+        return True
+
+    def flush(self):
+        """Commits every queued row (of every table) and waits for it."""
+        self.database.flush()
+
+    def close(self):
+        """Nothing to do: the database closes its tables."""
+
+    def __len__(self) -> int:
+        with self.database.connect() as conn:
+            (count,) = conn.execute(f"SELECT COUNT(*) FROM {self.name}").fetchone()
+        with self.database.lock:
+            return count + len(self._pending) + len(self._inflight)
+
+    def time_range(self) -> Optional[Tuple[float, float]]:
+        with self.database.lock:
+            if self._first_timestamp is None:
+                return None
+            return self._first_timestamp, self._last_timestamp
+
+    def query(self, start: float, end: float) -> List[tuple]:
+        """Every row with start <= timestamp <= end, oldest first. NULLs are returned as NaN."""
+        # Snapshot the queued rows first: a commit that lands during the SELECT is then seen twice
+        # rather than not at all, and _unseen_queued() drops the copies.
+        queue, committed = self._queued_snapshot()
+        with self.database.connect() as conn:
+            rows = self._nulls_to_nan(conn.execute(self._select_sql, (max(start, -1e308), min(end, 1e308))).fetchall())
+        return rows + self._unseen_queued(rows, queue, committed, lambda r: start <= r[0] <= end)
+
+    def iter_query(self, start: float, end: float):
+        """Yields the rows query() would return, oldest first, straight from the cursor."""
+        queue, committed = self._queued_snapshot()
+        last = deque(maxlen=len(queue))          # Only the end of the SELECT can hold queued rows.
+        with self.database.connect() as conn:
+            cursor = conn.execute(self._select_sql, (max(start, -1e308), min(end, 1e308)))
+            for row in cursor:
+                if None in row:
+                    row = self._nulls_to_nan([row])[0]
+                last.append(row)
+                yield row
+        yield from self._unseen_queued(list(last), queue, committed, lambda r: start <= r[0] <= end)
+
+    def tail(self, count: int) -> List[tuple]:
+        """The newest `count` rows, oldest first."""
+        if count <= 0:
+            return []
+        queue, committed = self._queued_snapshot()
+        with self.database.connect() as conn:
+            rows = conn.execute(self._tail_sql, (count,)).fetchall()
+        rows.reverse()
+        rows = self._nulls_to_nan(rows)
+        return (rows + self._unseen_queued(rows, queue, committed, lambda r: True))[-count:]
+
+    def _nulls_to_nan(self, rows: List[tuple]) -> List[tuple]:
+        if not self._real_columns:
+            return rows
+        nan = math.nan
+        real = self._real_columns
+        return [r if None not in r else tuple(nan if v is None and i in real else v for i, v in enumerate(r))
+                for r in rows]
+
+    def _queued_snapshot(self) -> Tuple[List[tuple], int]:
+        """The queued rows, oldest first, and how many rows had been committed when they were taken."""
+        with self.database.lock:
+            return self._inflight + self._pending, self._committed
+
+    def _unseen_queued(self, rows: List[tuple], queue: List[tuple], committed: int,
+                       keep: Callable[[tuple], bool]) -> List[tuple]:
+        """
+        The rows of a _queued_snapshot() that a later SELECT, ending with `rows`,
+        did not already return. Only rows whose commit started after the snapshot
+        can have been seen; they are the front of the queue and, being the newest,
+        the end of the SELECT. Rows are matched whole, not by timestamp, so queued rows
+        that share a timestamp with a stored one are kept.
+        """
+        with self.database.lock:
+            landed = self._committing - committed
+        maybe_seen = [r for r in queue[:landed] if keep(r)]
+        seen = next(k for k in range(min(len(maybe_seen), len(rows)), -1, -1)
+                    if all(self._same_row(a, b) for a, b in zip(rows[len(rows) - k:], maybe_seen[:k])))
+        return maybe_seen[seen:] + [r for r in queue[landed:] if keep(r)]
+
+    @staticmethod
+    def _same_row(a: tuple, b: tuple) -> bool:
+        return all(x == y or (x != x and y != y) for x, y in zip(a, b))
+
+
+class SQLiteHistoryDatabase:
+    """
+    The SQLite database behind the history and its single writer thread. A batch
+    is committed when HISTORY_FLUSH_RECORDS rows are queued or the oldest has
+    waited HISTORY_FLUSH_SECONDS. Readers use their own per-thread connections,
+    which WAL lets run alongside the writer.
+    """
+    def __init__(self, path: str, flush_records: int = HISTORY_FLUSH_RECORDS,
+                 flush_seconds: float = HISTORY_FLUSH_SECONDS, read_only: bool = False):
+        """
+        Args:
+            path (str): The database file. Its directory is created if needed.
+            flush_records (int): Queued rows that trigger a commit.
+            flush_seconds (float): Maximum time a row waits before it is committed.
+            read_only (bool): Open the file read-only, with no writer thread and no schema changes.
+        """
+        self.path = path
+        self.read_only = read_only
+        self.flush_records = flush_records
+        self.flush_seconds = flush_seconds
+        self.tables: Dict[str, SQLiteTimeSeriesTable] = {}
+        self.lock = threading.Lock()             # Guards the queued rows of every table.
+        self._wake = threading.Condition(self.lock)
+        self._flush_requests = 0                 # Incremented by flush(); the writer answers through _answered.
+        self._answered = 0                       # Last flush request the writer has tried to commit.
+        self._flushed = 0                        # Last flush request whose rows were all committed.
+        self._write_error: Optional[sqlite3.Error] = None
+        self._queued = 0
+        self._running = True
+        self._local = threading.local()          # Per-thread read connections.
+        self._writer: Optional[threading.Thread] = None
+        if read_only:
+            self.connect()                       # Fails now if there is no database.
+            return
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self.connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+        self._writer = threading.Thread(target=self._write_loop, name="HistorySQLiteWriter", daemon=True)
+        self._writer.start()
+
+    def connect(self) -> sqlite3.Connection:
+        """This thread's connection to the database (created on first use)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if self.read_only:
+                conn = sqlite3.connect(Path(os.path.abspath(self.path)).as_uri() + "?mode=ro", uri=True, timeout=30)
+            else:
+                conn = sqlite3.connect(self.path, timeout=30)
+                conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def table(self, name: str, record_format: str, fields: List[str]) -> SQLiteTimeSeriesTable:
+        """Opens (creating if needed) a table in the database."""
+        table = SQLiteTimeSeriesTable(self, name, record_format, fields)
+        self.tables[name] = table
+        return table
+
+    def notify_append(self):
+        """Called after a row is queued; wakes the writer once a batch is full."""
+        with self._wake:
+            self._queued += 1
+            if self._queued >= self.flush_records:
+                self._wake.notify()
+
+    def flush(self):
+        """
+        Asks the writer to commit everything queued so far and waits until it has.
+
+        Raises:
+            sqlite3.Error: The commit failed. The rows stay queued and are retried.
+        """
+        with self._wake:
+            if self._writer is None or not self._writer.is_alive():
+                return
+            self._flush_requests += 1
+            target = self._flush_requests
+            self._wake.notify()
+            while self._answered < target and self._writer.is_alive():
+                self._wake.wait(1.0)
+            if self._flushed < target and self._write_error is not None:
+                raise sqlite3.OperationalError(f"Failed to write history to {self.path}: {self._write_error}")
+
+    def _write_loop(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        while True:
+            with self._wake:
+                # Wait for a full batch, a flush request, shutdown or the time limit.
+                if self._running and self._queued < self.flush_records and self._answered == self._flush_requests:
+                    self._wake.wait(self.flush_seconds)
+                batches = []
+                for table in self.tables.values():
+                    if table._pending:
+                        table._committing += len(table._pending)
+                        table._inflight, table._pending = table._pending, []
+                        batches.append(table)
+                self._queued = 0
+                requested = self._flush_requests
+                running = self._running
+            error = None
+            if batches:
+                try:
+                    with conn:
+                        for table in batches:
+                            conn.executemany(table.insert_sql, table._inflight)
+                except sqlite3.Error as e:
+                    error = e
+                    logging.error("Failed to write history batch to SQLite: %s", e)
+                with self._wake:
+                    for table in batches:
+                        if error is None:
+                            table._committed += len(table._inflight)
+                        else:
+                            # Back at the front of the queue, ahead of rows that arrived meanwhile.
+                            table._committing -= len(table._inflight)
+                            table._pending = table._inflight + table._pending
+                        table._inflight = []
+            with self._wake:
+                self._answered = requested
+                self._write_error = error
+                if error is None:
+                    self._flushed = requested
+                self._wake.notify_all()
+            if not running:
+                break
+        conn.close()
+
+    def close(self):
+        """Commits everything queued and stops the writer thread."""
+        with self._wake:
+            self._running = False
+            self._wake.notify()
+        if self._writer is not None:
+            self._writer.join(timeout=10)
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+# ============================================================================
+# SECTION 5.15: REAL-TIME SIGNAL SMOOTHING
+# Description: The raw discharge rate and the OS time-remaining estimate jump from
+#              poll to poll. A scalar Kalman filter per signal smooths them in
+#              constant time and memory per sample, and its variance gives an
+#              uncertainty band. The measurement noise is learned from the
+#              innovations, so one tuning works on quiet and noisy hardware alike.
+#              Two consecutive readings far outside the expected spread on the
+#              same side are a real change in load: the gain is re-opened so the
+#              estimate follows it at once. A lone outlier is only a spike.
+#              Time to empty is our own: the remaining energy over a windowed
+#              average of the measured draw, so it is available from the first
+#              poll after unplugging instead of after Windows' "Calculating...".
+# ============================================================================
+
+class ScalarKalmanFilter:
+    """A one-dimensional, random-walk Kalman filter with adaptive measurement noise."""
+    def __init__(self, process_variance: float, measurement_variance: float,
+                 adaptation: float = KALMAN_NOISE_ADAPTATION, step_sigmas: float = KALMAN_STEP_SIGMAS):
+        """
+        Args:
+            process_variance (float): Q, the variance the true value gains per update.
+            measurement_variance (float): The initial R, the variance of a reading.
+            adaptation (float): EWMA weight used to re-estimate R from each innovation.
+            step_sigmas (float): Innovations beyond this many σ are treated as steps, not noise.
+        """
+        self.process_variance = process_variance
+        self.initial_measurement_variance = measurement_variance
+        self.adaptation = adaptation
+        self.step_sigmas = step_sigmas
+        self.reset()
+
+    def reset(self):
+        """Forgets the state; the next reading is taken as-is."""
+        self.estimate: Optional[float] = None
+        self.variance = 0.0
+        self.measurement_variance = self.initial_measurement_variance
+        self._outlier_side = 0      # +1 / -1 if the previous reading was an outlier above / below.
+
+    @property
+    def std(self) -> float:
+        """The standard deviation of the current estimate."""
+        return math.sqrt(self.variance)
+
+    def update(self, reading: float) -> Tuple[float, float]:
+        """
+        Folds in one reading.
+
+        Returns:
+            Tuple[float, float]: The new estimate and its standard deviation.
+        """
+        if self.estimate is None:
+            self.estimate = float(reading)
+            self.variance = self.measurement_variance
+            return self.estimate, self.std
+        # Predict: the true value may have drifted since the last poll.
+        prior = self.variance + self.process_variance
+        innovation = reading - self.estimate
+        spread = prior + self.measurement_variance
+        if innovation * innovation > self.step_sigmas ** 2 * spread:
+            side = 1 if innovation > 0 else -1
+            if side == self._outlier_side:
+                # A second outlier on the same side: a step change (e.g., a game started). Trust the new reading.
+                prior += innovation * innovation
+                self._outlier_side = 0
+            else:
+                # A lone spike so far: filter it normally, but do not learn noise from it.
+                self._outlier_side = side
+        else:
+            self._outlier_side = 0
+            # Learn the reading noise from the innovations: E[innovation²] = prior + R.
+            observed = max(innovation * innovation - prior, self.initial_measurement_variance * 0.01)
+            self.measurement_variance += self.adaptation * (observed - self.measurement_variance)
+        # Update.
+        gain = prior / (prior + self.measurement_variance)
+        self.estimate += gain * innovation
+        self.variance = (1.0 - gain) * prior
+        return self.estimate, self.std
+
+
+class WindowedTimeToEmpty:
+    """
+    The average power draw over the last `window_seconds`, kept as running sums
+    so each reading is added and evicted once (O(1) per sample), and the time
+    to empty it gives for a remaining energy.
+    """
+    def __init__(self, window_seconds: float = TTE_WINDOW_SECONDS):
+        self.window_seconds = window_seconds
+        self._readings: deque = deque()      # (timestamp, watts), oldest first.
+        self._sum = 0.0
+        self._sum_squares = 0.0
+
+    def reset(self):
+        self._readings.clear()
+        self._sum = 0.0
+        self._sum_squares = 0.0
+
+    def add(self, timestamp: float, power_watts: float):
+        """Adds a reading and evicts those that have left the window."""
+        self._readings.append((timestamp, power_watts))
+        self._sum += power_watts
+        self._sum_squares += power_watts * power_watts
+        cutoff = timestamp - self.window_seconds
+        while self._readings[0][0] < cutoff:
+            _, old = self._readings.popleft()
+            self._sum -= old
+            self._sum_squares -= old * old
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self._sum / len(self._readings) if self._readings else None
+
+    @property
+    def standard_error(self) -> float:
+        """The uncertainty of the mean, from the sample variance of the window."""
+        count = len(self._readings)
+        if count < 2:
+            return 0.0
+        variance = (self._sum_squares - self._sum * self._sum / count) / (count - 1)
+        return math.sqrt(max(variance, 0.0) / count)
+
+    def estimate(self, remaining_mwh: float) -> Optional[Tuple[int, Optional[Tuple[int, int]]]]:
+        """
+        Returns:
+            Optional[Tuple]: Seconds to empty, and a (low, high) range from the uncertainty
+                of the average draw (None before it has one), or None without a usable draw.
+        """
+        mean = self.mean
+        if mean is None or mean <= SMOOTHING_MIN_POWER_WATTS:
+            return None
+        energy_wh = remaining_mwh / 1000.0
+        band = SMOOTHING_BAND_SIGMAS * self.standard_error
+        seconds = int(energy_wh / mean * 3600)
+        if band == 0.0:
+            return seconds, None
+        slowest = max(mean - band, SMOOTHING_MIN_POWER_WATTS)
+        return seconds, (int(energy_wh / (mean + band) * 3600), int(energy_wh / slowest * 3600))
+
+
+class RealtimeSmoother:
+    """
+    Smooths the power draw and time to empty of each real-time poll. The filters
+    restart whenever the power state (charging / on AC / on battery) changes, as
+    each state has its own level.
+    """
+    def __init__(self):
+        self.power = ScalarKalmanFilter(KALMAN_POWER_PROCESS_VARIANCE, KALMAN_POWER_MEASUREMENT_VARIANCE)
+        self.time_remaining = ScalarKalmanFilter(KALMAN_TTE_PROCESS_VARIANCE, KALMAN_TTE_MEASUREMENT_VARIANCE)
+        self.time_to_empty = WindowedTimeToEmpty()
+        # Set by the UI once known; gives the remaining energy when the provider does not report it.
+        self.full_charge_capacity_mwh: Optional[int] = None
+        self._state: Optional[str] = None
+
+    def update(self, realtime_data: Dict, timestamp: Optional[float] = None) -> Dict:
+        """
+        Args:
+            realtime_data (Dict): One poll, as returned by BatteryProvider.get_dynamic_status.
+            timestamp (float): When it was taken. Defaults to now.
+
+        Returns:
+            Dict: Any of 'power_watts_smoothed', 'power_watts_band', 'time_remaining_smoothed'
+                and 'time_remaining_range' ((low, high) seconds).
+        """
+        state = ("charging" if realtime_data.get('is_charging') else
+                 "ac" if realtime_data.get('ac_online') else "battery")
+        if state != self._state:
+            self.power.reset()
+            self.time_remaining.reset()
+            self.time_to_empty.reset()
+            self._state = state
+        result = {}
+
+        power = realtime_data.get('power_watts')
+        if power is not None:
+            estimate, std = self.power.update(power)
+            result['power_watts_smoothed'] = estimate
+            result['power_watts_band'] = SMOOTHING_BAND_SIGMAS * std
+        if state != "battery":
+            return result
+
+        # Our own estimate: remaining energy over the recent average draw.
+        if power is not None:
+            self.time_to_empty.add(time.time() if timestamp is None else timestamp, power)
+        remaining_mwh = realtime_data.get('remaining_mwh')
+        percent = realtime_data.get('percent')
+        if not remaining_mwh and self.full_charge_capacity_mwh and percent is not None:
+            remaining_mwh = self.full_charge_capacity_mwh * percent / 100.0
+        estimate = self.time_to_empty.estimate(remaining_mwh) if remaining_mwh else None
+        if estimate is not None:
+            result['time_remaining_smoothed'], result['time_remaining_range'] = estimate
+            return result
+
+        # Otherwise smooth the OS estimate itself, ignoring its "unknown" markers.
+        reported = realtime_data.get('time_remaining')
+        if reported is not None and 0 < reported < 0xFFFFFFFF:
+            estimate, std = self.time_remaining.update(reported)
+            band = SMOOTHING_BAND_SIGMAS * std
+            result['time_remaining_smoothed'] = int(estimate)
+            result['time_remaining_range'] = (int(max(estimate - band, 0)), int(estimate + band))
+        return result
+
+# ============================================================================
+# SECTION 5.16: STREAMING ANOMALY DETECTION
+# Description: Fixed thresholds (HIGH_TEMP_THRESHOLD) only catch the extremes.
+#              These EWMA control charts learn each machine's own baseline for the
+#              power draw and the temperature rise rate, in O(1) memory per
+#              metric, and flag readings that rise well above it. Baselines are
+#              persisted, so they survive restarts.
+# ============================================================================
+
+class EWMAControlChart:
+    """
+    An upper EWMA control chart. The baseline is an exponentially weighted mean
+    and variance. Out-of-limit readings do not move it (a spike must not widen
+    its own limits) unless they persist long enough to be the new normal.
+    """
+    def __init__(self, min_sigma: float, alpha: float = ANOMALY_BASELINE_ALPHA,
+                 limit_sigmas: float = ANOMALY_LIMIT_SIGMAS, warmup: int = ANOMALY_WARMUP_SAMPLES,
+                 confirm: int = ANOMALY_CONFIRM_SAMPLES, adapt: int = ANOMALY_ADAPT_SAMPLES):
+        """
+        Args:
+            min_sigma (float): A floor for σ, in the metric's unit.
+            alpha (float): EWMA weight of each reading in the baseline.
+            limit_sigmas (float): The control limit, in σ above the baseline.
+            warmup (int): Readings needed before anomalies are reported.
+            confirm (int): Consecutive out-of-limit readings needed to report one.
+            adapt (int): Length of an excursion after which the baseline follows it.
+        """
+        self.min_sigma = min_sigma
+        self.alpha = alpha
+        self.limit_sigmas = limit_sigmas
+        self.warmup = warmup
+        self.confirm = confirm
+        self.adapt = adapt
+        self.mean: Optional[float] = None
+        self.variance = 0.0
+        self.count = 0
+        self._excursion = 0         # Consecutive out-of-limit readings.
+
+    @property
+    def sigma(self) -> float:
+        return max(math.sqrt(self.variance), self.min_sigma)
+
+    def update(self, value: float) -> Optional[float]:
+        """
+        Folds in one reading.
+
+        Returns:
+            Optional[float]: The z-score, on the reading that confirms a new anomaly; otherwise None.
+        """
+        if self.mean is None:
+            self.mean = value
+            self.count = 1
+            return None
+        z = (value - self.mean) / self.sigma
+        reported = None
+        if z > self.limit_sigmas:
+            self._excursion += 1
+            if self._excursion == self.confirm and self.count >= self.warmup:
+                reported = z
+            if self._excursion < self.adapt:
+                return reported
+        else:
+            self._excursion = 0
+        # Exponentially weighted mean and variance (incremental form).
+        diff = value - self.mean
+        increment = self.alpha * diff
+        self.mean += increment
+        self.variance = (1.0 - self.alpha) * (self.variance + diff * increment)
+        self.count += 1
+        return reported
+
+    def state(self) -> List[float]:
+        return [self.mean, self.variance, self.count]
+
+    def restore(self, state: List[float]):
+        self.mean, self.variance, self.count = state[0], float(state[1]), int(state[2])
+
+
+class AnomalyDetector:
+    """
+    Watches the real-time stream for power draw spikes (with a separate baseline
+    on battery and while charging) and unusually fast temperature rises.
+    """
+    def __init__(self, baseline_path: Optional[str] = None):
+        """
+        Args:
+            baseline_path (str): JSON file the baselines are loaded from and saved to. None disables persistence.
+        """
+        self.baseline_path = baseline_path
+        self.charts: Dict[str, EWMAControlChart] = {
+            "power_draw/battery": EWMAControlChart(ANOMALY_MIN_SIGMA["power_draw"]),
+            "power_draw/charging": EWMAControlChart(ANOMALY_MIN_SIGMA["power_draw"]),
+            "temperature_rise": EWMAControlChart(ANOMALY_MIN_SIGMA["temperature_rise"]),
+        }
+        self._last_temperature: Optional[Tuple[float, float]] = None   # (timestamp, °C)
+        self._rise_rate: Optional[float] = None                        # Smoothed °C per minute.
+        self._updates = 0
+        self._load()
+
+    def _load(self):
+        if not self.baseline_path:
+            return
+        try:
+            with open(self.baseline_path, 'r') as f:
+                stored = json.load(f)
+            for name, state in stored.items():
+                if name in self.charts and state[0] is not None:
+                    self.charts[name].restore(state)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, TypeError, IndexError) as e:
+            logging.warning("Ignoring unreadable anomaly baselines in %s: %s", self.baseline_path, e)
+
+    def save(self):
+        """Persists the baselines."""
+        if not self.baseline_path:
+            return
+        try:
+            with open(self.baseline_path, 'w') as f:
+                json.dump({name: chart.state() for name, chart in self.charts.items()}, f)
+        except OSError as e:
+            logging.error("Could not save anomaly baselines: %s", e)
+
+    def update(self, timestamp: float, realtime_data: Dict) -> List[Dict[str, Any]]:
+        """
+        Folds in one poll.
+
+        Returns:
+            List[Dict]: The anomalies this poll confirmed, each with 'metric', 'value',
+                'baseline', 'sigma', 'z' and a human-readable 'message'.
+        """
+        anomalies = []
+
+        # --- Power draw, against the baseline of the current power state ---
+        power = realtime_data.get('power_watts')
+        state = "charging" if realtime_data.get('is_charging') else (None if realtime_data.get('ac_online') else "battery")
+        if power is not None and state is not None:
+            chart = self.charts[f"power_draw/{state}"]
+            baseline, sigma = chart.mean, chart.sigma
+            z = chart.update(power)
+            if z is not None:
+                verb = "Charge rate" if state == "charging" else "Power draw"
+                anomalies.append({
+                    "metric": "power_draw", "value": power, "baseline": baseline, "sigma": sigma, "z": z,
+                    "message": f"{verb} jumped to {power:.1f} W (usual: {baseline:.1f} ± {sigma:.1f} W).",
+                })
+
+        # --- Temperature rise rate, in °C per minute ---
+        temperature = realtime_data.get('temperature_celsius')
+        if temperature is not None:
+            if self._last_temperature is not None:
+                elapsed = timestamp - self._last_temperature[0]
+                if 0 < elapsed <= 300:
+                    rate = (temperature - self._last_temperature[1]) / (elapsed / 60.0)
+                    self._rise_rate = rate if self._rise_rate is None else (
+                        self._rise_rate + ANOMALY_RATE_SMOOTHING * (rate - self._rise_rate))
+                    chart = self.charts["temperature_rise"]
+                    baseline, sigma = chart.mean, chart.sigma
+                    z = chart.update(self._rise_rate)
+                    if z is not None:
+                        anomalies.append({
+                            "metric": "temperature_rise", "value": self._rise_rate, "baseline": baseline,
+                            "sigma": sigma, "z": z,
+                            "message": (f"Battery temperature is rising unusually fast: {self._rise_rate:+.1f} °C/min "
+                                        f"(now {temperature:.1f}°C)."),
+                        })
+                else:
+                    # After a gap (e.g., sleep) the difference is not a rate.
+                    self._rise_rate = None
+            self._last_temperature = (timestamp, temperature)
+
+        self._updates += 1
+        if self._updates % ANOMALY_SAVE_INTERVAL == 0:
+            self.save()
+        return anomalies
+
+# ============================================================================
+# SECTION 5.17: CHARGE TIME PREDICTION
+# Description: Lithium-ion packs charge at constant current (CC) until a knee,
+#              then at constant voltage (CV), where the remaining charge decays
+#              exponentially. The model has three parameters: the CC rate, the
+#              knee and the CV time constant. They are fitted from each finished
+#              charge session in the history and persisted. While charging, the
+#              live charge power refines the current phase, so every poll is a
+#              constant-time update.
+# ============================================================================
+
+def fit_charge_session(points: List[Tuple[float, float]]) -> Dict[str, float]:
+    """
+    Fits the CC/CV parameters of one charge session.
+
+    Args:
+        points (List[Tuple[float, float]]): (timestamp, percent) samples, oldest first.
+
+    Returns:
+        Dict[str, float]: Whichever of 'cc_rate' (% per second), 'knee_percent' and
+            'tau_seconds' the session covers.
+    """
+    fitted: Dict[str, float] = {}
+    if len(points) < 3:
+        return fitted
+
+    # Average rates over fixed buckets; single polls are too coarse with integer percents.
+    buckets = []                # (start percent, mean percent, rate)
+    start = points[0]
+    for point in points[1:]:
+        if point[0] - start[0] >= CHARGE_FIT_BUCKET_SECONDS:
+            buckets.append((start[1], (start[1] + point[1]) / 2.0, (point[1] - start[1]) / (point[0] - start[0])))
+            start = point
+    cc_rates = sorted(rate for _, mean, rate in buckets if mean < CHARGE_CC_MAX_PERCENT and rate > 0)
+    if len(cc_rates) >= 2:
+        cc_rate = cc_rates[len(cc_rates) // 2]
+        fitted['cc_rate'] = cc_rate
+        # The knee: the first bucket, past the CC ones, charging markedly slower.
+        for first_percent, mean, rate in buckets:
+            if mean >= CHARGE_CC_MAX_PERCENT and rate < CHARGE_KNEE_RATE_FRACTION * cc_rate:
+                fitted['knee_percent'] = first_percent
+                break
+
+    # The CV tail: ln(100 - percent) falls linearly with time, with slope -1/tau. Past the
+    # slow-down bucket the charge is surely in CV, so the fit starts there.
+    knee = fitted.get('knee_percent', CHARGE_DEFAULT_KNEE_PERCENT)
+    # Reported percents are truncated integers, so the true level averages half a percent more.
+    tail = [(t, math.log(99.5 - p)) for t, p in points if knee <= p <= 98]
+    if len(tail) >= 3 and tail[-1][0] - tail[0][0] >= 2 * CHARGE_FIT_BUCKET_SECONDS and len({y for _, y in tail}) >= 3:
+        n = len(tail)
+        mean_t = sum(t for t, _ in tail) / n
+        mean_y = sum(y for _, y in tail) / n
+        sxx = sum((t - mean_t) ** 2 for t, _ in tail)
+        slope = sum((t - mean_t) * (y - mean_y) for t, y in tail) / sxx
+        if slope < 0:
+            fitted['tau_seconds'] = -1.0 / slope
+            # The current is continuous at the knee: cc_rate = (100 - knee) / tau there. This
+            # places the knee more precisely than the bucket where the slow-down became visible.
+            if 'cc_rate' in fitted:
+                fitted['knee_percent'] = min(max(100.0 - fitted['cc_rate'] * fitted['tau_seconds'],
+                                                 CHARGE_CC_MAX_PERCENT), CHARGE_FULL_PERCENT)
+    return fitted
+
+
+class ChargeTimePredictor:
+    """
+    Predicts the time to 80% and to full while charging, from the learned
+    CC/CV model and the live charge power.
+    """
+    def __init__(self, model_path: Optional[str] = None):
+        """
+        Args:
+            model_path (str): JSON file the learned parameters are loaded from and saved to. None disables persistence.
+        """
+        self.model_path = model_path
+        self.model: Dict[str, float] = {"sessions": 0, "fitted_until": 0.0}
+        # Set by the UI once known; converts the charge power into % per second.
+        self.full_charge_capacity_mwh: Optional[int] = None
+        # Set when a charge session ends (and at start-up), so the worker fits the sessions not yet learned from.
+        self.needs_learning = True
+        self._live_rate: Optional[float] = None
+        if model_path:
+            try:
+                with open(model_path, 'r') as f:
+                    self.model.update(json.load(f))
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError) as e:
+                logging.warning("Ignoring unreadable charge model %s: %s", model_path, e)
+
+    def learn(self, history: "BatteryHistory"):
+        """Fits every finished charge session newer than the last one learned from."""
+        self.needs_learning = False
+        sessions = [s for s in history.recent_sessions("charge", CHARGE_FIT_SESSIONS)
+                    if s["timestamp"] > self.model["fitted_until"]]
+        for session in sessions:
+            points = [(r[0], r[1]) for r in history.query(session["timestamp"], session["end"])
+                      if not math.isnan(r[1])]
+            for name, value in fit_charge_session(points).items():
+                current = self.model.get(name)
+                self.model[name] = value if current is None else current + CHARGE_MODEL_LEARNING_RATE * (value - current)
+            self.model["sessions"] += 1
+            self.model["fitted_until"] = session["timestamp"]
+        if sessions:
+            logging.info("Charge model updated from %d session(s): %s", len(sessions), self.model)
+            self.save()
+
+    def save(self):
+        if not self.model_path:
+            return
+        try:
+            with open(self.model_path, 'w') as f:
+                json.dump(self.model, f)
+        except OSError as e:
+            logging.error("Could not save the charge model: %s", e)
+
+    def time_to(self, percent: float, target: float, cc_rate: Optional[float], tau: Optional[float]) -> Optional[int]:
+        """Seconds from one charge level to another along the CC/CV curve."""
+        knee = self.model.get("knee_percent", CHARGE_DEFAULT_KNEE_PERCENT)
+        target = min(target, CHARGE_FULL_PERCENT)
+        if percent >= target:
+            return 0
+        seconds = 0.0
+        if percent < knee:
+            if not cc_rate:
+                return None
+            seconds += (min(target, knee) - percent) / cc_rate
+            percent = knee
+        if target > percent:
+            seconds += (tau or CHARGE_DEFAULT_TAU_SECONDS) * math.log((100.0 - percent) / (100.0 - target))
+        return int(seconds)
+
+    def update(self, realtime_data: Dict) -> Dict:
+        """
+        Args:
+            realtime_data (Dict): One poll, as returned by BatteryProvider.get_dynamic_status.
+
+        Returns:
+            Dict: 'time_to_full' and, below 80%, 'time_to_80' (seconds), while charging.
+        """
+        percent = realtime_data.get('percent')
+        if not realtime_data.get('is_charging') or percent is None:
+            if self._live_rate is not None:
+                # A charge just ended: learn from it once its session is stored.
+                self.needs_learning = True
+            self._live_rate = None
+            return {}
+
+        # The live rate in % per second, from the charge power and the full-charge capacity.
+        power = realtime_data.get('power_watts')
+        if power and self.full_charge_capacity_mwh:
+            rate = power * 1000.0 / 3600.0 / self.full_charge_capacity_mwh * 100.0
+            self._live_rate = rate if self._live_rate is None else (
+                self._live_rate + CHARGE_RATE_SMOOTHING * (rate - self._live_rate))
+        elif self._live_rate is None:
+            self._live_rate = 0.0       # Marks the charge as in progress.
+
+        knee = self.model.get("knee_percent", CHARGE_DEFAULT_KNEE_PERCENT)
+        live = self._live_rate or None
+        # The live rate is the CC rate before the knee; after it, it gives the CV time constant.
+        cc_rate = live if live and percent < knee else self.model.get("cc_rate")
+        tau = self.model.get("tau_seconds")
+        if tau is None and live and percent >= knee:
+            tau = (100.0 - percent) / live
+        result = {}
+        time_to_full = self.time_to(percent, 100.0, cc_rate, tau)
+        if time_to_full is not None:
+            result['time_to_full'] = time_to_full
+        if percent < 80:
+            time_to_80 = self.time_to(percent, 80.0, cc_rate, tau)
+            if time_to_80 is not None:
+                result['time_to_80'] = time_to_80
+        return result
+
+# ============================================================================
+# SECTION 5.18: MEASURED WEAR RATE
+# Description: The usage rate used to be the cycle count divided by the time
+#              since the OS was installed, which is wrong after a reinstall or a
+#              battery swap. Instead, the cycle count and full-charge capacity are
+#              logged once a day per battery serial, and two regressions over the
+#              last WEAR_WINDOW_DAYS give cycles per day and mWh lost per cycle.
+#              The regressions keep running sums, so a new day adds one point and
+#              evicts the expired ones instead of refitting the window.
+# ============================================================================
+
+class RollingRegression:
+    """A least-squares line over points that can be added and removed in O(1)."""
+    def __init__(self):
+        self.count = 0
+        self.sum_x = self.sum_y = self.sum_xx = self.sum_xy = 0.0
+
+    def add(self, x: float, y: float, sign: int = 1):
+        self.count += sign
+        self.sum_x += sign * x
+        self.sum_y += sign * y
+        self.sum_xx += sign * x * x
+        self.sum_xy += sign * x * y
+
+    def remove(self, x: float, y: float):
+        self.add(x, y, -1)
+
+    @property
+    def slope(self) -> Optional[float]:
+        if self.count < 2:
+            return None
+        sxx = self.sum_xx - self.sum_x * self.sum_x / self.count
+        if sxx <= 1e-9:
+            return None
+        return (self.sum_xy - self.sum_x * self.sum_y / self.count) / sxx
+
+
+class WearRateTracker:
+    """
+    The persisted daily wear log, with a usage regression (cycles against days)
+    and a fade regression (full-charge capacity against cycles) per battery.
+    There is one instance per file, shared process-wide.
+    """
+    _instances: Dict[str, "WearRateTracker"] = {}
+    _instances_lock = threading.Lock()
+
+    @classmethod
+    def for_path(cls, path: str) -> "WearRateTracker":
+        """Returns the shared tracker for a log file, creating it on first use."""
+        key = os.path.abspath(path)
+        with cls._instances_lock:
+            if key not in cls._instances:
+                cls._instances[key] = cls(path)
+            return cls._instances[key]
+
+    def __init__(self, path: Optional[str]):
+        """
+        Args:
+            path (str): The JSON log. None keeps the log in memory only (replay mode).
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        # Per battery: [[day ordinal, cycle count or None, full-charge capacity or None], ...], oldest first.
+        self.entries: Dict[str, List[list]] = {}
+        # Per battery: [index of the oldest entry in the window, usage regression, fade regression].
+        self._windows: Dict[str, list] = {}
+        if path:
+            try:
+                with open(path, 'r') as f:
+                    stored = json.load(f)
+                for battery, days in stored.get("batteries", {}).items():
+                    for day, cycles, capacity in days:
+                        self._append(battery, datetime.date.fromisoformat(day).toordinal(), cycles, capacity)
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError, TypeError) as e:
+                logging.warning("Ignoring unreadable wear log %s: %s", path, e)
+
+    @staticmethod
+    def battery_key(data: BatteryData) -> str:
+        """Identifies a battery by serial, so a swapped pack starts a log of its own."""
+        return data.battery_serial or data.battery_name or "unknown"
+
+    def _window_add(self, window: list, origin: int, entry: list, sign: int):
+        day, cycles, capacity = entry
+        if cycles is not None:
+            window[1].add(day - origin, cycles, sign)
+            if capacity is not None:
+                window[2].add(cycles, capacity, sign)
+
+    def _append(self, battery: str, day: int, cycles: Optional[float], capacity: Optional[float]):
+        """Adds (or, for the same day, replaces) an entry and slides the window."""
+        entries = self.entries.setdefault(battery, [])
+        window = self._windows.setdefault(battery, [0, RollingRegression(), RollingRegression()])
+        entry = [day, cycles, capacity]
+        if entries and entries[-1][0] == day:
+            self._window_add(window, entries[0][0], entries[-1], -1)
+            entries[-1] = entry
+        else:
+            entries.append(entry)
+        self._window_add(window, entries[0][0], entry, 1)
+        while entries[window[0]][0] <= day - WEAR_WINDOW_DAYS:
+            self._window_add(window, entries[0][0], entries[window[0]], -1)
+            window[0] += 1
+
+    def record(self, data: BatteryData, cycle_count: Optional[int] = None,
+               today: Optional[datetime.date] = None) -> bool:
+        """
+        Logs today's cycle count and full-charge capacity of a battery. A later
+        reading on the same day replaces the earlier one.
+
+        Args:
+            data (BatteryData): The battery.
+            cycle_count (int): The observed cycle count; None if only the capacity is known.
+            today (datetime.date): Defaults to today.
+
+        Returns:
+            bool: True if the log changed.
+        """
+        capacity = data.full_charge_capacity_mwh or None
+        if cycle_count is None and capacity is None:
+            return False
+        day = (today or datetime.date.today()).toordinal()
+        battery = self.battery_key(data)
+        with self._lock:
+            entries = self.entries.get(battery)
+            if entries and entries[-1] == [day, cycle_count, capacity]:
+                return False
+            self._append(battery, day, cycle_count, capacity)
+            self._save()
+        return True
+
+    def _save(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path, 'w') as f:
+                json.dump({"batteries": {
+                    battery: [[datetime.date.fromordinal(day).isoformat(), cycles, capacity]
+                              for day, cycles, capacity in entries]
+                    for battery, entries in self.entries.items()
+                }}, f)
+        except OSError as e:
+            logging.error("Could not save the wear log: %s", e)
+
+    def _window_entries(self, battery: str) -> List[list]:
+        entries = self.entries.get(battery, [])
+        return entries[self._windows[battery][0]:] if entries else []
+
+    def cycles_per_day(self, data: BatteryData) -> Optional[float]:
+        """The measured usage rate, or None until the log spans WEAR_MIN_DAYS."""
+        battery = self.battery_key(data)
+        with self._lock:
+            days = [e[0] for e in self._window_entries(battery) if e[1] is not None]
+            if len(days) < 3 or days[-1] - days[0] < WEAR_MIN_DAYS:
+                return None
+            slope = self._windows[battery][1].slope
+        return None if slope is None else max(slope, 0.0)
+
+    def capacity_loss_per_cycle(self, data: BatteryData) -> Optional[float]:
+        """The measured full-charge capacity lost per cycle (mWh), or None until the log spans WEAR_MIN_CYCLES."""
+        battery = self.battery_key(data)
+        with self._lock:
+            cycles = [e[1] for e in self._window_entries(battery) if e[1] is not None and e[2] is not None]
+            if len(cycles) < 3 or max(cycles) - min(cycles) < WEAR_MIN_CYCLES:
+                return None
+            slope = self._windows[battery][2].slope
+        return None if slope is None else -slope
+
+# ============================================================================
+# SECTION 5.19: CAPACITY FADE MODELS
+# Description: calculate_health's cycle-health curve is the same for every pack.
+#              These models fit this pack's own fade, capacity (as % of design)
+#              against cycle count, as a line and as a square-root curve. Both are
+#              updated by recursive least squares, O(1) per observation with no
+#              refit, and the one with the smaller one-step prediction error is
+#              used. The imported powercfg capacity history seeds them with a
+#              single vectorized least-squares fit. The fit only feeds the pack
+#              forecast of estimate_remaining_life; the health score stays generic.
+# ============================================================================
+
+class RecursiveLeastSquares:
+    """Recursive least squares for a small linear model, with exponential forgetting."""
+    def __init__(self, size: int, forgetting: float = FADE_FORGETTING,
+                 initial_covariance: float = FADE_INITIAL_COVARIANCE):
+        self.forgetting = forgetting
+        self.theta = [0.0] * size
+        self.covariance = [[initial_covariance if i == j else 0.0 for j in range(size)] for i in range(size)]
+        self.count = 0
+
+    def predict(self, x: List[float]) -> float:
+        return sum(t * v for t, v in zip(self.theta, x))
+
+    def update(self, x: List[float], y: float) -> float:
+        """Folds in one observation. Returns the prediction error from before it."""
+        size = len(self.theta)
+        error = y - self.predict(x)
+        px = [sum(self.covariance[i][j] * x[j] for j in range(size)) for i in range(size)]
+        gain_denominator = self.forgetting + sum(x[i] * px[i] for i in range(size))
+        gain = [v / gain_denominator for v in px]
+        self.theta = [t + g * error for t, g in zip(self.theta, gain)]
+        self.covariance = [[(self.covariance[i][j] - gain[i] * px[j]) / self.forgetting for j in range(size)]
+                           for i in range(size)]
+        self.count += 1
+        return error
+
+    @classmethod
+    def fit(cls, rows: List[List[float]], targets: List[float], **kwargs) -> Tuple["RecursiveLeastSquares", float]:
+        """
+        A batch least-squares fit, as the state RLS would have reached, vectorized
+        with NumPy when available.
+
+        Returns:
+            Tuple: The fitted filter and the mean squared residual.
+        """
+        size = len(rows[0])
+        rls = cls(size, **kwargs)
+        if NUMPY_AVAILABLE:
+            design = np.asarray(rows, dtype=np.float64)
+            y = np.asarray(targets, dtype=np.float64)
+            theta = np.linalg.lstsq(design, y, rcond=None)[0]
+            residual = float(np.mean((y - design @ theta) ** 2))
+            rls.theta = theta.tolist()
+            rls.covariance = np.linalg.pinv(design.T @ design).tolist()
+        else:
+            # The normal equations, solved by Gauss-Jordan elimination (the systems are 2x2).
+            gram = [[sum(r[i] * r[j] for r in rows) for j in range(size)] for i in range(size)]
+            moment = [sum(r[i] * t for r, t in zip(rows, targets)) for i in range(size)]
+            augmented = [gram[i] + [moment[i]] + [1.0 if i == j else 0.0 for j in range(size)] for i in range(size)]
+            for col in range(size):
+                pivot = max(range(col, size), key=lambda r: abs(augmented[r][col]))
+                augmented[col], augmented[pivot] = augmented[pivot], augmented[col]
+                scale = augmented[col][col]
+                if abs(scale) < 1e-12:
+                    raise ValueError("The observations do not determine the model.")
+                augmented[col] = [v / scale for v in augmented[col]]
+                for r in range(size):
+                    if r != col:
+                        factor = augmented[r][col]
+                        augmented[r] = [a - factor * b for a, b in zip(augmented[r], augmented[col])]
+            rls.theta = [augmented[i][size] for i in range(size)]
+            rls.covariance = [augmented[i][size + 1:] for i in range(size)]
+            residual = sum((t - rls.predict(r)) ** 2 for r, t in zip(rows, targets)) / len(rows)
+        rls.count = len(rows)
+        return rls, residual
+
+    def state(self) -> Dict[str, Any]:
+        return {"theta": self.theta, "covariance": self.covariance, "count": self.count}
+
+    def restore(self, state: Dict[str, Any]):
+        self.theta = [float(v) for v in state["theta"]]
+        self.covariance = [[float(v) for v in row] for row in state["covariance"]]
+        self.count = int(state["count"])
+
+
+class CapacityFadeTracker:
+    """
+    The linear (SOH = a + b*c) and square-root (SOH = a + b*sqrt(c)) fade models
+    of each battery, fed with (cycle count, full-charge capacity) observations.
+    There is one instance per file, shared process-wide.
+    """
+    FEATURES = {
+        "linear": lambda cycles: [1.0, cycles],
+        "sqrt": lambda cycles: [1.0, math.sqrt(cycles)],
+    }
+
+    _instances: Dict[str, "CapacityFadeTracker"] = {}
+    _instances_lock = threading.Lock()
+
+    @classmethod
+    def for_path(cls, path: str) -> "CapacityFadeTracker":
+        """Returns the shared tracker for a state file, creating it on first use."""
+        key = os.path.abspath(path)
+        with cls._instances_lock:
+            if key not in cls._instances:
+                cls._instances[key] = cls(path)
+            return cls._instances[key]
+
+    def __init__(self, path: Optional[str]):
+        """
+        Args:
+            path (str): The JSON state file. None keeps the models in memory only (replay mode).
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        # Per battery: {"models": {name: RecursiveLeastSquares}, "errors": {name: EWMA squared error},
+        # "first_cycles", "last_cycles", "seeded_until" (newest imported report row, or None)}.
+        self.packs: Dict[str, Dict[str, Any]] = {}
+        if path:
+            try:
+                with open(path, 'r') as f:
+                    stored = json.load(f)
+                for battery, pack in stored.get("batteries", {}).items():
+                    models = {}
+                    for name, state in pack["models"].items():
+                        models[name] = RecursiveLeastSquares(2)
+                        models[name].restore(state)
+                    self.packs[battery] = dict(pack, models=models)
+                    # Older files stored "never" as -Infinity, which is not valid JSON.
+                    for key in ("last_cycles", "seeded_until"):
+                        if pack.get(key) is not None and not math.isfinite(pack[key]):
+                            self.packs[battery][key] = None
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError, TypeError, KeyError) as e:
+                logging.warning("Ignoring unreadable fade models %s: %s", path, e)
+
+    def _save(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path, 'w') as f:
+                json.dump({"batteries": {
+                    battery: dict(pack, models={name: m.state() for name, m in pack["models"].items()})
+                    for battery, pack in self.packs.items()
+                }}, f)
+        except OSError as e:
+            logging.error("Could not save the fade models: %s", e)
+
+    def observe(self, battery: str, cycles: float, soh: float) -> bool:
+        """
+        Folds in one observation (SOH = full-charge / design capacity, in %). Only a
+        higher cycle count than the last one observed is new information.
+
+        Returns:
+            bool: True if the models were updated.
+        """
+        with self._lock:
+            updated = self._observe(battery, cycles, soh)
+            if updated:
+                self._save()
+        return updated
+
+    def _observe(self, battery: str, cycles: float, soh: float) -> bool:
+        """observe(), without saving. The caller holds the lock."""
+        pack = self._pack(battery)
+        if pack["last_cycles"] is not None and cycles <= pack["last_cycles"]:
+            return False
+        if pack["first_cycles"] is None:
+            pack["first_cycles"] = cycles
+        for name, features in self.FEATURES.items():
+            model = pack["models"][name]
+            error = model.update(features(cycles), soh)
+            # Compare the models on genuine one-step predictions only.
+            if model.count > 2:
+                previous = pack["errors"][name]
+                squared = error * error
+                pack["errors"][name] = squared if previous is None else (
+                    previous + FADE_ERROR_SMOOTHING * (squared - previous))
+        pack["last_cycles"] = cycles
+        return True
+
+    def _pack(self, battery: str) -> Dict[str, Any]:
+        """A battery's models, created empty on first use. The caller holds the lock."""
+        pack = self.packs.get(battery)
+        if pack is None:
+            pack = self.packs[battery] = {
+                "models": {name: RecursiveLeastSquares(2) for name in self.FEATURES},
+                "errors": {name: None for name in self.FEATURES},
+                "first_cycles": None, "last_cycles": None, "seeded_until": None,
+            }
+        return pack
+
+    def has_models(self, battery: str) -> bool:
+        with self._lock:
+            return battery in self.packs
+
+    def seed(self, battery: str, cycles: List[float], soh: List[float], until: float) -> bool:
+        """
+        Starts a battery's models with a batch fit of its capacity history (the
+        imported powercfg one), from which they then continue recursively. Does
+        nothing once the battery has models. A history too short to fit is
+        observed row by row instead.
+
+        Args:
+            battery (str): The battery key.
+            cycles (List[float]): Cycle counts, oldest first.
+            soh (List[float]): Full-charge capacity as % of design, per cycle count.
+            until (float): Timestamp of the newest row; later rows are added with extend().
+
+        Returns:
+            bool: True if the models were batch-fitted.
+        """
+        models, errors = None, {}
+        if cycles and len(cycles) >= FADE_MIN_OBSERVATIONS and max(cycles) - min(cycles) >= FADE_MIN_CYCLE_SPAN:
+            models = {}
+            for name, features in self.FEATURES.items():
+                try:
+                    models[name], errors[name] = RecursiveLeastSquares.fit([features(c) for c in cycles], soh)
+                except (ValueError, ArithmeticError) as e:
+                    logging.warning("Could not fit the %s fade model: %s", name, e)
+                    models = None
+                    break
+        with self._lock:
+            if battery in self.packs:
+                return False
+            if models is None:
+                for c, value in zip(cycles, soh):
+                    self._observe(battery, c, value)
+                self._pack(battery)["seeded_until"] = until
+                self._save()
+                return False
+            self.packs[battery] = {"models": models, "errors": errors, "first_cycles": min(cycles),
+                                   "last_cycles": max(cycles), "seeded_until": until}
+            self._save()
+        logging.info("Fade models for %s seeded from %d capacity history rows. Residuals: %s",
+                     battery, len(cycles), errors)
+        return True
+
+    def extend(self, battery: str, cycles: List[float], soh: List[float], until: float):
+        """
+        Folds capacity history rows newer than seeded_until() into a battery's
+        models, one O(1) update each, and moves seeded_until() up to `until`.
+        """
+        with self._lock:
+            for c, value in zip(cycles, soh):
+                self._observe(battery, c, value)
+            self._pack(battery)["seeded_until"] = until
+            self._save()
+
+    def seeded_until(self, battery: str) -> Optional[float]:
+        """Timestamp of the newest capacity history row folded in, or None if there is none."""
+        with self._lock:
+            pack = self.packs.get(battery)
+            return pack["seeded_until"] if pack else None
+
+    def best_model(self, battery: str) -> Optional[Tuple[str, RecursiveLeastSquares]]:
+        """The better-predicting model of a battery, or None until its observations are enough."""
+        with self._lock:
+            pack = self.packs.get(battery)
+            if pack is None:
+                return None
+            models = pack["models"]
+            if (models["sqrt"].count < FADE_MIN_OBSERVATIONS or
+                    pack["last_cycles"] - pack["first_cycles"] < FADE_MIN_CYCLE_SPAN):
+                return None
+            errors = pack["errors"]
+            # Without a comparison yet, prefer the square root: early Li-ion fade is sub-linear.
+            name = "linear" if (errors["linear"] is not None and errors["sqrt"] is not None
+                                and errors["linear"] < errors["sqrt"]) else "sqrt"
+            return name, models[name]
+
+    def eol_cycles(self, battery: str, threshold_soh: float) -> Optional[float]:
+        """The cycle count at which the pack's fit reaches `threshold_soh`, or None if it never does."""
+        best = self.best_model(battery)
+        if best is None:
+            return None
+        name, model = best
+        intercept, slope = model.theta
+        if slope >= 0 or intercept <= threshold_soh:
+            return None
+        crossing = (threshold_soh - intercept) / slope
+        return crossing if name == "linear" else crossing * crossing
+
+    def trajectory(self, battery: str, from_cycles: float, to_cycles: float,
+                   points: int = FADE_TRAJECTORY_POINTS) -> List[Tuple[float, float]]:
+        """(cycle count, fitted SOH) pairs, evenly spaced between two cycle counts."""
+        best = self.best_model(battery)
+        if best is None or to_cycles <= from_cycles:
+            return []
+        name, model = best
+        step = (to_cycles - from_cycles) / (points - 1)
+        return [(from_cycles + i * step, model.predict(self.FEATURES[name](from_cycles + i * step)))
+                for i in range(points)]
+
+# ============================================================================
+# SECTION 5.20: BATCH FLEET SCORING
+# Description: calculate_health and estimate_remaining_life score one BatteryData
+#              at a time and log every call. score_fleet applies the same generic
+#              health model, HEALTH_STATUS_MAP buckets and RUL rules to columns
+#              of thousands of machines at once: vectorized with NumPy, or a
+#              plain loop when NumPy is missing. Missing values are NaN (or None
+#              on the pure-Python path). Pack-specific fade fits and measured
+#              usage rates need a machine's own history, so they are not used
+#              here; `age_days` supplies the usage rate instead.
+# ============================================================================
+
+def _score_battery(design: float, fcc: float, cycles: float, rated: float, age: float,
+                   threshold_soh: float, horizon_days: int) -> Tuple[float, str, int, str, float]:
+    """One battery through the batch scoring rules. Returns (soh, status, rul_days, rul_status, cycles_per_day)."""
+    def missing(value):
+        return value is None or value != value
+    # Health: the generic model of calculate_health.
+    valid = not missing(design) and not missing(fcc) and design > 1000
+    soh = weighted_health(design, fcc, cycles, rated)[0] if valid else 0.0
+    status = get_health_status(soh)[0]
+
+    # RUL: the rules of estimate_remaining_life, with the age standing in for the install date.
+    if not valid or missing(cycles) or cycles < 0 or missing(rated) or rated <= 0:
+        return soh, status, -1, "N/A", math.nan
+    cycles_per_day = cycles / age if not missing(age) and age > 0 and cycles > 0 else DEFAULT_CYCLES_PER_DAY
+    if cycles_per_day <= LOW_USAGE_CYCLES_PER_DAY:
+        return soh, status, 3650, "Low Usage", cycles_per_day
+    if soh < threshold_soh:
+        return soh, status, 0, "Replace Now", cycles_per_day
+    days = days_until_health_below(cycles, cycles_per_day, rated, threshold_soh, horizon_days)
+    if days == -1:
+        return soh, status, horizon_days, "Excellent", cycles_per_day
+    return soh, status, days, "Calculated", cycles_per_day
+
+def _score_fleet_np(design, fcc, cycles, rated, age, threshold_soh: float, horizon_days: int) -> Dict[str, Any]:
+    design, fcc, cycles, rated, age = (np.asarray(c, dtype=np.float64) for c in (design, fcc, cycles, rated, age))
+    # NaN compares False, so rows with a missing value drop out of every mask below.
+    # The health rule is weighted_health, vectorized.
+    valid = (design > 1000) & ~np.isnan(fcc)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cycle_ratio = np.minimum(np.where(cycles >= 0, cycles, 0.0) / np.where(rated > 0, rated, 1000.0), 1.5)
+        soh_cyc = 100.0 * (1 - (CYCLE_HEALTH_FADE * (cycle_ratio ** CYCLE_HEALTH_EXPONENT)))
+        capacity_weight = np.select([cycle_ratio < 0.1, cycle_ratio > 0.8], [0.4, 0.8], 0.7)
+        soh = np.clip(fcc / design * 100.0 * capacity_weight + soh_cyc * (1 - capacity_weight), 0.0, 100.0)
+    soh = np.where(valid, soh, 0.0)
+
+    labels = np.array([label for _, _, label, _ in HEALTH_STATUS_MAP] + ["Unknown"])
+    bucket = np.select([(soh >= low) & (soh < high + 1) for low, high, _, _ in HEALTH_STATUS_MAP],
+                       np.arange(len(HEALTH_STATUS_MAP)), len(HEALTH_STATUS_MAP))
+
+    projectable = valid & (cycles >= 0) & (rated > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cycles_per_day = np.where((age > 0) & (cycles > 0), cycles / age, DEFAULT_CYCLES_PER_DAY)
+    cycles_per_day = np.where(projectable, cycles_per_day, np.nan)
+    low_usage = projectable & (cycles_per_day <= LOW_USAGE_CYCLES_PER_DAY)
+    replace_now = projectable & ~low_usage & (soh < threshold_soh)
+    project = projectable & ~low_usage & ~replace_now
+    days = np.full(soh.shape, -1, dtype=np.int64)
+    if project.any():
+        days[project] = days_until_health_below_np(cycles[project], cycles_per_day[project], rated[project],
+                                                   threshold_soh, horizon_days)
+    capped = project & (days == -1)
+    rul_status = np.select([~projectable, low_usage, replace_now, capped],
+                           ["N/A", "Low Usage", "Replace Now", "Excellent"], "Calculated")
+    rul_days = np.select([~projectable, low_usage, replace_now, capped], [-1, 3650, 0, horizon_days], days)
+    return {"soh": soh, "status": labels[bucket], "rul_days": rul_days, "rul_status": rul_status,
+            "cycles_per_day": cycles_per_day}
+
+def score_fleet(design_capacity_mwh, full_charge_capacity_mwh, cycle_count, rated_cycles, age_days,
+                threshold_soh: float = FLEET_RUL_THRESHOLD_SOH,
+                horizon_days: int = FLEET_RUL_HORIZON_DAYS) -> Dict[str, Any]:
+    """
+    Scores a fleet of batteries given as equal-length columns (one entry per machine).
+
+    Args:
+        design_capacity_mwh, full_charge_capacity_mwh: Capacities in mWh.
+        cycle_count, rated_cycles: Observed and rated cycle counts.
+        age_days: Battery age in days, which gives the usage rate (cycles per day).
+        threshold_soh (float): End-of-life health for the RUL.
+        horizon_days (int): The RUL projection horizon.
+
+    Returns:
+        Dict[str, Any]: Columns 'soh' (%), 'status' (HEALTH_STATUS_MAP label), 'rul_days',
+            'rul_status' ("Calculated", "Excellent" (past the horizon), "Replace Now",
+            "Low Usage" or "N/A") and 'cycles_per_day'. NumPy arrays, or lists without NumPy.
+    """
+    start = time.perf_counter()
+    if NUMPY_AVAILABLE:
+        result = _score_fleet_np(design_capacity_mwh, full_charge_capacity_mwh, cycle_count, rated_cycles,
+                                 age_days, threshold_soh, horizon_days)
+        count = len(result["soh"])
+    else:
+        rows = [_score_battery(*row, threshold_soh, horizon_days) for row in zip(
+            design_capacity_mwh, full_charge_capacity_mwh, cycle_count, rated_cycles, age_days)]
+        columns = list(zip(*rows)) if rows else [()] * 5
+        result = {name: list(column) for name, column in
+                  zip(("soh", "status", "rul_days", "rul_status", "cycles_per_day"), columns)}
+        count = len(rows)
+    logging.info("Scored a fleet of %d batteries in %.1f ms.", count, (time.perf_counter() - start) * 1000)
+    return result
+
+def score_fleet_csv(input_path: str, output_path: str) -> int:
+    """
+    Scores a CSV with the FLEET_COLUMNS (other columns, e.g., a machine ID, are
+    passed through) and writes it back out with the score columns appended.
+
+    Returns:
+        int: The number of batteries scored.
+    """
+    def number(value):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return math.nan
+    with open(input_path, newline='', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        missing = [c for c in FLEET_COLUMNS if c not in (reader.fieldnames or [])]
+        if missing:
+            raise ValueError(f"Missing column(s): {', '.join(missing)}")
+        rows = list(reader)
+    scores = score_fleet(*([number(row[c]) for row in rows] for c in FLEET_COLUMNS))
+    score_names = ["soh", "status", "rul_days", "rul_status", "cycles_per_day"]
+    with open(output_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(list(reader.fieldnames) + score_names)
+        for i, row in enumerate(rows):
+            soh, status, rul_days, rul_status, cycles_per_day = (scores[name][i] for name in score_names)
+            writer.writerow([row[c] for c in reader.fieldnames] +
+                            [f"{soh:.2f}", status, int(rul_days), rul_status,
+                             "" if cycles_per_day != cycles_per_day else f"{cycles_per_day:.4f}"])
+    return len(rows)
+
+# ============================================================================
+# PART 2
+# ============================================================================
+
+# ============================================================================
+# SECTION 6: CORE LOGIC - BATTERY INTELLIGENCE CLASS
+# Description: This is the central class for all backend logic. It encapsulates
+#              data fetching, caching, and health/RUL calculations. This class
+#              replaces the multiple logic classes from the original main.py
+#              (WindowsBatteryDataFetcher, BatteryHealthCalculator, RULPredictor)
+#              with a single, more robust, and maintainable implementation
+#              inspired by reference.py.
+# ============================================================================
+
+class BatteryIntelligence:
+    """
+    This class handles all backend operations: fetching battery data through
+    a BatteryProvider, caching the results for performance, consolidating the data,
+    and performing health and remaining life calculations. It is designed to be
+    the single source of truth for battery status.
+    """
+    
+    # The __init__ method is the constructor for the class.
+    def __init__(self, provider: Optional[BatteryProvider] = None, wmi_backend=None, persist: bool = True):
+        """
+        Initializes the BatteryIntelligence class by setting up paths for data
+        persistence, loading cached data, and preparing for data collection.
+
+        Args:
+            provider (BatteryProvider): Where raw battery data is read from.
+                Defaults to the provider for the current platform.
+            wmi_backend: Optional backend for the default provider's WMI connection
+                manager. Pass a FakeWMIBackend to run the WMI code paths without Windows.
+            persist (bool): False keeps the cache, install date, wear log and fade models
+                in memory, for data that is not this machine's (benchmarks, tests). Always
+                False while a recording is replayed.
+        """
+        # Nothing about a replayed or synthetic battery may end up in the user's BatteryZ_Data.
+        self.persist = persist and not REPLAY_PATH
+
+        # --- Path Configuration for Data Persistence ---
+        # Get the user's AppData/Roaming directory path (or the XDG data directory on Linux).
+        # Storing data here is the correct practice, as it's a user-specific location.
+        self.appdata_path = get_app_data_dir()
+        # Create the directory if it doesn't exist to prevent errors when writing files.
+        os.makedirs(self.appdata_path, exist_ok=True)
+        
+        # Define the full paths for all persistent data files.
+        self.cache_file = os.path.join(self.appdata_path, 'battery_cache.json')
+        self.report_path = os.path.join(self.appdata_path, 'battery_report.xml')
+        self.install_date_path = os.path.join(self.appdata_path, 'install_date.json')
+        
+        # --- Logging Setup ---
+        # Configure logging to write to a file within our AppData folder.
+        # This provides a persistent record of operations and errors for debugging.
+        log_file = os.path.join(self.appdata_path, 'battery_z.log')
+        # Use a RotatingFileHandler to automatically manage log file size, preventing it from
+        # growing indefinitely. It will keep 3 backup logs, each up to 5MB.
+        log_handler = RotatingFileHandler(log_file, maxBytes=5*1024*1024, backupCount=3)
+        # Set the logging level to INFO, and define a clear format for log messages.
+        logging.basicConfig(
+            level=logging.INFO,
+            format='%(asctime)s - %(levelname)s - %(message)s',
+            handlers=[log_handler]
+        )
+        
+        # --- Cache Initialization ---
+        # Load the cache from disk. This is a dictionary holding semi-static battery
+        # information to speed up subsequent app launches.
+        self.cache = self.load_cache()
+        # Log the result of the cache loading operation.
+        logging.info("BatteryIntelligence initialized. Cache loaded with %d items.", len(self.cache))
+        # Static fields are cached per battery, inside the same file.
+        self.static_cache = StaticBatteryCache(self.cache.setdefault("static_cache", {}))
+        # The OS install date is resolved once and persisted next to the cache.
+        self.install_date = (InstallDateResolver.for_path(self.install_date_path) if self.persist else
+                             InstallDateResolver(None))
+        # The daily wear log gives the measured usage rate.
+        self.wear_log = (WearRateTracker.for_path(os.path.join(self.appdata_path, WEAR_LOG_FILE)) if self.persist else
+                         WearRateTracker(None))
+        # ...and this pack's own capacity-fade curve.
+        self.fade_models = (CapacityFadeTracker.for_path(os.path.join(self.appdata_path, FADE_MODEL_FILE))
+                            if self.persist else CapacityFadeTracker(None))
+
+        # --- Battery Data Provider ---
+        # All raw data acquisition goes through the provider (WMI on Windows, sysfs on Linux).
+        self.provider = provider or create_default_provider(self.report_path, wmi_backend)
+        logging.info("Using battery provider: %s", self.provider.name)
+
+        # --- Concurrent Collection Engine ---
+        # The pool threads live as long as this object and keep their provider resources (e.g., WMI
+        # connections) from one fetch to the next. Each releases them once, on itself, when it exits.
+        self.collector = DataCollectionEngine(thread_cleanup=self.provider.release)
+
+    # --- Caching Methods ---
+    
+    def load_cache(self) -> Dict:
+        """
+        Loads the battery data cache from a JSON file. The cache is considered
+        valid for 24 hours to balance performance with data freshness.
+
+        Returns:
+            Dict: The loaded cache dictionary, or an empty dictionary if the
+                cache is invalid, missing, or corrupt.
+        """
+        # Check if the cache file actually exists on disk.
+        if self.persist and os.path.exists(self.cache_file):
+            # Use a try-except block to handle potential file reading or JSON parsing errors.
+            try:
+                # Open the cache file for reading.
+                with open(self.cache_file, 'r') as f:
+                    # Parse the JSON content into a Python dictionary.
+                    cache = json.load(f)
+                    # Define cache validity period in seconds (24 hours).
+                    cache_validity_seconds = 86400
+                    # Check if the cache is still fresh by comparing its timestamp to the current time.
+                    if time.time() - cache.get("last_updated", 0) < cache_validity_seconds:
+                        # If the cache is fresh, log it and return the data.
+                        logging.info("Valid cache found. Loading data from cache.")
+                        return cache
+                    else:
+                        # If the cache is stale, log it and it will be overwritten. The per-battery
+                        # static cache has its own per-field TTLs, so it is carried over.
+                        logging.info("Cache is stale. A new cache will be created.")
+                        return {"static_cache": cache.get("static_cache", {})}
+            # If any error occurs (e.g., corrupted JSON), log the error.
+            except Exception as e:
+                logging.error("Failed to load or validate cache: %s", e)
+        # If the file doesn't exist or loading failed, return an empty dictionary.
+        return {}
+
+    def save_cache(self):
+        """
+        Saves the current state of the self.cache dictionary to the JSON file.
+        It also injects a 'last_updated' timestamp.
+        """
+        if not self.persist:
+            return
+        # Use a try-except block to handle potential file writing errors.
+        try:
+            # Add/update the timestamp to mark when this cache was saved.
+            self.cache["last_updated"] = time.time()
+            # Open the cache file for writing.
+            with open(self.cache_file, 'w') as f:
+                # Dump the cache dictionary to the file with an indent for readability.
+                json.dump(self.cache, f, indent=4)
+            # Log the successful save operation.
+            logging.info("Cache saved successfully to %s", self.cache_file)
+        # If an error occurs (e.g., disk full, permissions error), log it.
+        except Exception as e:
+            logging.error("Failed to save cache: %s", e)
+            
+    def _static_cache_key(self) -> Optional[str]:
+        """Returns the static cache key for the installed battery, or None if it cannot be identified."""
+        try:
+            identity = self.provider.get_battery_identity()
+        except Exception as e:
+            logging.warning("Battery identity check failed: %s", e)
+            return None
+        return StaticBatteryCache.make_key(identity) if identity else None
+            
+    # --- Primary Data Orchestration Method ---
+    
+    def get_all_data(self) -> BatteryData:
+        """
+        This is the main orchestration method. It calls all individual data
+        fetching functions, populates the BatteryData object, performs calculations,
+        and returns the final, consolidated result.
+
+        Returns:
+            BatteryData: A fully populated dataclass with all available battery info.
+        """
+        # Create a new, empty BatteryData object for this fetch cycle.
+        data = BatteryData()
+        # Record the start time of the fetch operation.
+        data.fetch_timestamp = datetime.datetime.now()
+        
+        # --- Step 1: Check for Battery Presence ---
+        # Ask the provider for a fast check of whether a battery exists.
+        data.battery_present = self.provider.is_battery_present()
+            
+        # If no battery is present, we can stop early.
+        if not data.battery_present:
+            # Populate basic system info even for desktops.
+            data.laptop_manufacturer, data.laptop_model = self.provider.get_system_info()
+            return data
+            
+        # --- Step 2: Serve Static Sources from the Per-Battery Cache ---
+        # One cheap identity check decides whether the cached static fields belong to
+        # the installed battery. Sources whose fields are all fresh are not queried.
+        cache_key = self._static_cache_key()
+        cached = {}
+        if cache_key is not None:
+            for name in StaticBatteryCache.SOURCE_FIELDS:
+                hit, value = self.static_cache.lookup(cache_key, name)
+                if hit:
+                    cached[name] = value
+            if cached:
+                logging.info("Static cache hit for %s: %s", cache_key, ", ".join(sorted(cached)))
+
+        # --- Step 3: Fetch the Remaining Sources Concurrently ---
+        # Each source keeps its own multi-layered fallback chain internally. Sources are
+        # independent, except that the report-based ones wait for the report to be generated.
+        sources = [
+            CollectionSource("system_info", self.provider.get_system_info, default=("Unknown", "System"),
+                             deadline=SOURCE_DEADLINES["system_info"]),
+            CollectionSource("static_info", self.provider.get_static_battery_info, default={},
+                             deadline=SOURCE_DEADLINES["static_info"], depends_on=("battery_report",)),
+            CollectionSource("cycle_count", self.provider.get_cycle_count,
+                             deadline=SOURCE_DEADLINES["cycle_count"], depends_on=("battery_report",)),
+            CollectionSource("chemistry", self.provider.get_chemistry,
+                             deadline=SOURCE_DEADLINES["chemistry"], depends_on=("battery_report",)),
+            CollectionSource("dynamic_status", self.provider.get_dynamic_status, default={},
+                             deadline=SOURCE_DEADLINES["dynamic_status"]),
+            CollectionSource("temperature", self.provider.get_temperature,
+                             deadline=SOURCE_DEADLINES["temperature"]),
+            # Resolved here, on the fetch thread, so the UI never has to look it up.
+            CollectionSource("install_date", self.install_date.get,
+                             deadline=SOURCE_DEADLINES["install_date"]),
+        ]
+        sources = [source for source in sources if source.name not in cached]
+        # The report is only needed if a source that reads it still has to run.
+        if any("battery_report" in source.depends_on for source in sources):
+            sources.append(CollectionSource("battery_report", self.provider.refresh_report,
+                                            deadline=SOURCE_DEADLINES["battery_report"]))
+        results, errors, failed = self.collector.run(sources)
+        data.fetch_errors.extend(errors)
+
+        # Cache what was freshly queried. Failed or late sources only hold defaults, so they are skipped.
+        if cache_key is not None:
+            for name in StaticBatteryCache.SOURCE_FIELDS:
+                if name in results and name not in failed:
+                    self.static_cache.update(cache_key, name, results[name])
+        results.update(cached)
+
+        # --- Step 4: Consolidate the Results ---
+        data.laptop_manufacturer, data.laptop_model = results["system_info"]
+        
+        # Static data (things that don't change often, like serial number, design capacity).
+        # A failed or late source still gets the same last-resort defaults as the fallback chain.
+        static_info = self._apply_static_info_defaults(dict(results["static_info"] or {}))
+        data.battery_name = static_info.get("name")
+        data.battery_manufacturer = static_info.get("manufacturer")
+        data.battery_serial = static_info.get("serial")
+        data.design_capacity_mwh = static_info.get("design_capacity")
+        data.full_charge_capacity_mwh = static_info.get("full_charge_capacity")
+        
+        # Cycle count, resolved by its own multi-fallback logic. Only a count the hardware reports is
+        # cached; when there is none, it is estimated from capacity fade on every fetch instead.
+        data.cycle_count = results["cycle_count"]
+        if data.cycle_count is None:
+            data.cycle_count = self._estimate_cycle_count()
+            data.cycle_count_estimated = data.cycle_count is not None
+        
+        # Chemistry, resolved by its own multi-fallback logic.
+        raw_chem = results["chemistry"]
+        # Normalize the fetched chemistry name for consistency.
+        data.battery_chemistry = normalize_chemistry_name(raw_chem)
+        
+        # Look up rated cycles based on the fetched data.
+        data.rated_cycle_life = get_manufacturer_rated_cycles(
+            data.laptop_manufacturer, 
+            data.laptop_model, 
+            data.battery_chemistry
+        )
+        
+        # Real-time dynamic data. This changes frequently (charge level, voltage, etc.).
+        dynamic_info = results["dynamic_status"] or {}
+        data.current_percentage = dynamic_info.get("percent")
+        data.ac_online = dynamic_info.get("ac_online")
+        data.is_charging = dynamic_info.get("is_charging")
+        data.time_to_empty_seconds = dynamic_info.get("time_remaining")
+        data.current_voltage_mv = dynamic_info.get("voltage_mv")
+        data.power_draw_watts = dynamic_info.get("power_watts")
+        data.temperature_celsius = results["temperature"] # Temperature has its own fallback chain.
+        data.install_date = results["install_date"]
+        
+        # --- Step 5: Final Calculations and Data Cleanup ---
+        
+        # If a custom cycle count is set by the user, override the fetched value.
+        if CUSTOM_CYCLE_COUNT is not None:
+            data.cycle_count = CUSTOM_CYCLE_COUNT
+            data.cycle_count_estimated = False
+        
+        # Log today's wear. A custom or estimated cycle count is not an observation, so only the capacity is logged then.
+        if data.battery_present:
+            self.wear_log.record(data, self._observed_cycle_count(data))
+            self.update_fade_model(data)
+            
+        # Save the consolidated static data to cache for the next run.
+        self.cache.update({
+            "manufacturer": data.battery_manufacturer,
+            "serial_number": data.battery_serial,
+            "chemistry": data.battery_chemistry,
+            "design_capacity": data.design_capacity_mwh,
+            "full_charge_capacity": data.full_charge_capacity_mwh,
+            "total_cycles": data.rated_cycle_life,
+            "battery_name": data.battery_name
+        })
+        # An estimate is recomputed from the capacities on every fetch, so only a reported count is kept.
+        if not data.cycle_count_estimated:
+            self.cache["cycle_count"] = data.cycle_count
+        self.save_cache()
+        
+        # Log a summary of the key fetched values for debugging.
+        logging.info(
+            "Data fetch complete. Cycles: %s, Design: %s mWh, FCC: %s mWh, Chem: %s",
+            data.cycle_count, data.design_capacity_mwh, data.full_charge_capacity_mwh, data.battery_chemistry
+        )
+        
+        # Return the final, populated data object.
+        return data
+
+    # --- Calculation Methods (from reference.py) ---
+
+    def calculate_health(self, data: BatteryData) -> float:
+        """
+        [ALGORITHM FIXED] Calculates battery health using a research-based,
+        multi-factor model. The bug that incorrectly capped the health value,
+        ignoring the cycle count's impact, has been removed.
+
+        Args:
+            data (BatteryData): The populated battery data object.
+
+        Returns:
+            float: The calculated health percentage (0-100).
+        """
+        if not data.has_valid_capacity_data():
+            logging.warning("Cannot calculate health due to invalid capacity data.")
+            return 0.0
+
+        # Capacity health and cycle health, fused with weights that depend on the cycle ratio,
+        # then clamped. The rule is shared with the fleet scoring (see weighted_health).
+        # BUG FIX: The line 'final_health = min(final_health, soh_c)' has been REMOVED.
         # This line was the root cause of the previous issue, as it was incorrectly
         # overriding the weighted calculation and preventing the cycle count from
         # having its full, intended effect on the final health score.
-        final_health = max(0.0, min(final_health, 100.0))
+        final_health, soh_c, soh_cyc = weighted_health(
+            float(data.design_capacity_mwh), float(data.full_charge_capacity_mwh),
+            data.cycle_count, data.rated_cycle_life
+        )
         
         logging.info(
             "Health calculated. SOH_c: %.1f%%, SOH_cyc: %.1f%%. Final Weighted SOH: %.1f%%",
@@ -1362,94 +6051,379 @@ class BatteryIntelligence:
             return default_rul
 
         # --- Step 1: Calculate historical usage rate ---
-        install_date = get_windows_install_date()
-        if install_date and (datetime.datetime.now() - install_date).days > 0:
-            age_days = (datetime.datetime.now() - install_date).days
-        else:
-            # Fallback: estimate age from cycle count assuming 0.7 cycles/day for a typical user.
-            age_days = int(data.cycle_count / 0.7) if data.cycle_count > 0 else 1
+        cycles_per_day, source = self.usage_rate(data)
+        # Returned with every estimate, so the UI shows the same rate the projection used.
+        usage = {"cycles_per_day": cycles_per_day, "usage_rate_source": source,
+                 "capacity_loss_per_cycle_mwh": self.wear_log.capacity_loss_per_cycle(data),
+                 "pack_fade": self.pack_fade_forecast(data, cycles_per_day, 80.0)}
         
-        age_days = max(age_days, 1) # Avoid division by zero
-        cycles_per_day = data.cycle_count / age_days
-        
-        if cycles_per_day <= 0.01: # Handle very low or zero usage
+        if cycles_per_day <= LOW_USAGE_CYCLES_PER_DAY: # Handle very low or zero usage
             logging.warning("Usage rate is too low to make a reliable RUL projection.")
-            return {"years": 10, "months": 0, "days": 0, "status": "Low Usage"}
+            return {"years": 10, "months": 0, "days": 0, "status": "Low Usage", **usage}
 
-        # --- Step 2: Project future degradation day-by-day ---
+        # --- Step 2: Project future degradation ---
         # The industry standard for battery end-of-life is 80% of original capacity.
         REPLACEMENT_THRESHOLD_SOH = 80.0
         
         current_soh = self.calculate_health(data)
         if current_soh < REPLACEMENT_THRESHOLD_SOH:
-            return {"years": 0, "months": 0, "days": 0, "status": "Replace Now"}
+            return {"years": 0, "months": 0, "days": 0, "status": "Replace Now", **usage}
+
+        # The probabilistic replacement window, around the point estimate below.
+        distribution = self.estimate_rul_distribution(data, cycles_per_day, REPLACEMENT_THRESHOLD_SOH)
+            
+        # Solve for the day the projected cycle health (the same non-linear formula as
+        # calculate_health) crosses the threshold, within a 15-year (5475-day) horizon.
+        days_to_eol = days_until_health_below(
+            data.cycle_count, cycles_per_day, data.rated_cycle_life, REPLACEMENT_THRESHOLD_SOH, 5475
+        )
+        
+        if days_to_eol == -1:
+            logging.info("RUL projection exceeds 15 years. Capping result.")
+            return {"years": 15, "months": 0, "days": 0, "status": "Excellent", "distribution": distribution, **usage}
+
+        # --- Step 3: Convert remaining days to Years, Months, Days ---
+        years = days_to_eol // 365
+        months = (days_to_eol % 365) // 30
+        days = (days_to_eol % 365) % 30
+
+        logging.info(
+            "RUL Estimated. Usage: %.2f cycles/day (%s). Days to 80%% SOH: %d -> %d years, %d months",
+            cycles_per_day, source, days_to_eol, years, months
+        )
+        
+        return {"years": years, "months": months, "days": days, "status": "Calculated", "distribution": distribution,
+                **usage}
+
+    def pack_fade_forecast(self, data: BatteryData, cycles_per_day: float,
+                           threshold_soh: float) -> Optional[Dict[str, Any]]:
+        """
+        The pack-specific fade forecast, or None until the pack has a usable fit.
+
+        Returns:
+            Dict: 'model' ("linear" or "sqrt"), 'eol_cycles' and 'eol_date' (None if the
+                fit never reaches the threshold), and a 'trajectory' of (cycles, SOH) pairs.
+        """
+        battery = WearRateTracker.battery_key(data)
+        best = self.fade_models.best_model(battery)
+        if best is None:
+            return None
+        eol_cycles = self.fade_models.eol_cycles(battery, threshold_soh)
+        eol_date = None
+        if eol_cycles is not None and cycles_per_day > 0:
+            days = max(eol_cycles - data.cycle_count, 0) / cycles_per_day
+            if days < 365 * 50:
+                eol_date = datetime.date.today() + datetime.timedelta(days=int(days))
+        end = eol_cycles if eol_cycles is not None and eol_cycles > data.cycle_count else data.rated_cycle_life
+        return {"model": best[0], "eol_cycles": eol_cycles, "eol_date": eol_date,
+                "trajectory": self.fade_models.trajectory(battery, data.cycle_count, max(end, data.cycle_count + 1))}
+
+    def usage_rate(self, data: BatteryData) -> Tuple[float, str]:
+        """
+        The battery's usage in cycles per day, and where it came from: "measured"
+        (the wear log), "install date" (cycles since the OS install) or "assumed"
+        (DEFAULT_CYCLES_PER_DAY).
+        """
+        measured = self.wear_log.cycles_per_day(data)
+        if measured is not None:
+            return measured, "measured"
+        # The install date is resolved during the fetch, so this is pure computation.
+        install_date = data.install_date
+        if install_date and (datetime.datetime.now() - install_date).days > 0 and data.cycle_count:
+            return data.cycle_count / (datetime.datetime.now() - install_date).days, "install date"
+        return DEFAULT_CYCLES_PER_DAY, "assumed"
+
+    def estimate_rul_distribution(self, data: BatteryData, cycles_per_day: float,
+                                  threshold_soh: float = 80.0) -> Dict[str, Any]:
+        """
+        Runs the Monte Carlo RUL for this battery and converts the P10/P50/P90
+        days into replacement dates.
+
+        Args:
+            data (BatteryData): The populated battery data object.
+            cycles_per_day (float): The historical usage rate.
+            threshold_soh (float): The end-of-life health threshold.
+
+        Returns:
+            Dict[str, Any]: monte_carlo_rul()'s result, plus 'p10_date', 'p50_date'
+                and 'p90_date' (datetime.date) and the 'quality_tier' used.
+        """
+        tier = get_manufacturer_quality_tier(data.laptop_manufacturer, data.laptop_model)
+        start = time.perf_counter()
+        result = monte_carlo_rul(data.cycle_count, cycles_per_day, data.rated_cycle_life, tier, threshold_soh)
+        today = datetime.date.today()
+        for key in ("p10", "p50", "p90"):
+            result[f"{key}_date"] = today + datetime.timedelta(days=result[f"{key}_days"])
+        result["quality_tier"] = tier
+        logging.info(
+            "Monte Carlo RUL (%d trajectories, %s tier) in %.1f ms. P10/P50/P90 days: %d / %d / %d",
+            result["trajectories"], tier, (time.perf_counter() - start) * 1000,
+            result["p10_days"], result["p50_days"], result["p90_days"]
+        )
+        return result
+    
+    def rederive_report_fields(self) -> Dict[str, Any]:
+        """
+        Re-runs the report-dependent sources after a new powercfg report has landed.
+        The fallback chains are re-run as a whole, so the usual source priorities
+        still apply (e.g., a WMI cycle count still wins over the report's).
+
+        Returns:
+            Dict[str, Any]: The refreshed values, keyed by BatteryData field name.
+        """
+        results, _, failed = self.collector.run([
+            CollectionSource("static_info", self.provider.get_static_battery_info, default={},
+                             deadline=SOURCE_DEADLINES["static_info"]),
+            CollectionSource("cycle_count", self.provider.get_cycle_count, deadline=SOURCE_DEADLINES["cycle_count"]),
+            CollectionSource("chemistry", self.provider.get_chemistry, deadline=SOURCE_DEADLINES["chemistry"]),
+        ])
+        # Keep the per-battery cache in step with the new report.
+        cache_key = self._static_cache_key()
+        if cache_key is not None:
+            for name in ("static_info", "cycle_count", "chemistry"):
+                if name not in failed:
+                    self.static_cache.update(cache_key, name, results[name])
+            self.save_cache()
+        static_info = self._apply_static_info_defaults(dict(results["static_info"] or {}))
+        return {
+            "battery_name": static_info.get("name"),
+            "battery_manufacturer": static_info.get("manufacturer"),
+            "battery_serial": static_info.get("serial"),
+            "design_capacity_mwh": static_info.get("design_capacity"),
+            "full_charge_capacity_mwh": static_info.get("full_charge_capacity"),
+            "cycle_count": results["cycle_count"],
+            "battery_chemistry": normalize_chemistry_name(results["chemistry"]),
+        }
+
+    def apply_report_fields(self, data: BatteryData, fields: Dict[str, Any]) -> bool:
+        """
+        Applies values from rederive_report_fields() to an existing BatteryData.
+
+        Returns:
+            bool: True if any value changed.
+        """
+        changed = False
+        for name, value in fields.items():
+            # Never overwrite a known value with a missing one, or the user's custom cycle count.
+            if value is None or (name == "cycle_count" and CUSTOM_CYCLE_COUNT is not None):
+                continue
+            # A reported cycle count replaces an estimate, even if the two happen to agree.
+            if name == "cycle_count" and data.cycle_count_estimated:
+                data.cycle_count_estimated = False
+                changed = True
+            if getattr(data, name) != value:
+                setattr(data, name, value)
+                changed = True
+        if changed:
+            data.rated_cycle_life = get_manufacturer_rated_cycles(
+                data.laptop_manufacturer, data.laptop_model, data.battery_chemistry
+            )
+            if data.battery_present:
+                self.wear_log.record(data, self._observed_cycle_count(data))
+                self.update_fade_model(data)
+            logging.info(
+                "Report-derived fields refreshed. Cycles: %s, Design: %s mWh, FCC: %s mWh",
+                data.cycle_count, data.design_capacity_mwh, data.full_charge_capacity_mwh
+            )
+        return changed
+
+    @staticmethod
+    def _observed_cycle_count(data: BatteryData) -> Optional[int]:
+        """The cycle count the battery reported, or None if it was set by the user or estimated."""
+        if CUSTOM_CYCLE_COUNT is not None or data.cycle_count_estimated:
+            return None
+        return data.cycle_count
+
+    def update_fade_model(self, data: BatteryData):
+        """
+        Feeds the current (cycle count, capacity) observation into the pack's fade
+        models, after seeding them from the imported powercfg capacity history if
+        that has grown since they were last seeded. Only a cycle count the battery
+        reported is used; an estimate is derived from the capacity it would be fitted to.
+        """
+        cycle_count = self._observed_cycle_count(data)
+        if cycle_count is None or cycle_count < 0 or not data.has_valid_capacity_data():
+            return
+        battery = WearRateTracker.battery_key(data)
+        history = get_battery_history() if self.persist else None
+        if history is not None:
+            time_range = history.report_capacity.time_range()
+            seeded_until = self.fade_models.seeded_until(battery)
+            if time_range is not None and (seeded_until is None or time_range[1] > seeded_until):
+                if seeded_until is None:
+                    # The report history was never read for this pack: only the rows of its own tenure count.
+                    rows = self._pack_capacity_rows(history.report_capacity.query(-math.inf, math.inf),
+                                                    data.design_capacity_mwh, cycle_count)
+                else:
+                    # Only the rows imported since.
+                    rows = [r for r in history.report_capacity.query(seeded_until, math.inf)
+                            if r[0] > seeded_until and r[2] == data.design_capacity_mwh and r[3] > 0
+                            and not math.isnan(r[4])]
+                cycles, soh = [r[4] for r in rows], [r[3] / r[2] * 100.0 for r in rows]
+                # A new pack starts with one batch fit; after that every row is an O(1) update.
+                if self.fade_models.has_models(battery):
+                    self.fade_models.extend(battery, cycles, soh, time_range[1])
+                else:
+                    self.fade_models.seed(battery, cycles, soh, time_range[1])
+        self.fade_models.observe(battery, float(cycle_count),
+                                 data.full_charge_capacity_mwh / data.design_capacity_mwh * 100.0)
+    
+    @staticmethod
+    def _pack_capacity_rows(rows: List[tuple], design_capacity: int, cycle_count: int) -> List[tuple]:
+        """
+        The capacity history rows of the installed pack, oldest first. The report
+        history is system-wide and has no serial, so the pack's tenure is taken to
+        be the newest run of rows with its design capacity and a cycle count that
+        never goes down and does not exceed today's.
+        """
+        tenure = []
+        bound = cycle_count
+        for row in reversed(rows):
+            if row[3] <= 0 or math.isnan(row[4]):
+                continue
+            if row[2] != design_capacity or row[4] > bound:
+                break
+            tenure.append(row)
+            bound = row[4]
+        tenure.reverse()
+        return tenure
+
+    def _apply_static_info_defaults(self, info: Dict) -> Dict:
+        """
+        Final sanity checks and fallbacks for static info. If after all methods some
+        data is still missing, use defaults or derive them.
+        """
+        if 'design_capacity' not in info or info['design_capacity'] <= 0:
+            info['design_capacity'] = 50000 # Default to 50Wh
+            logging.warning("Design capacity not found. Using default value: %d mWh", info['design_capacity'])
+        
+        if 'full_charge_capacity' not in info or info['full_charge_capacity'] <= 0:
+            # As a last resort, estimate FCC as 90% of design capacity.
+            info['full_charge_capacity'] = int(info['design_capacity'] * 0.9)
+            logging.warning("Full charge capacity not found. Estimating based on design capacity: %d mWh", info['full_charge_capacity'])
             
-        days_to_eol = -1
-        # Project forward for a maximum of 15 years (5475 days) to prevent infinite loops.
-        for day in range(1, 5475):
-            # Project the future cycle count based on historical usage rate.
-            projected_cycles = data.cycle_count + (day * cycles_per_day)
+        return info
+
+    def _estimate_cycle_count(self) -> Optional[int]:
+        """
+        Estimates the cycle count from capacity degradation. Only used when the
+        hardware does not report a cycle count.
+
+        Returns:
+            Optional[int]: The estimated cycle count, or None if it cannot be estimated.
+        """
+        # --- Estimation from Capacity Degradation (Last Resort) ---
+        # This is an estimation, not a direct reading, and is only used if all other methods fail.
+        logging.warning("All direct methods for cycle count failed. Falling back to estimation.")
+        try:
+            design = self.cache.get('design_capacity')
+            fcc = self.cache.get('full_charge_capacity')
+            total_cycles = self.cache.get('total_cycles', 1000)
             
-            # Use the same non-linear cycle health formula from calculate_health to project SOH.
-            cycle_ratio = projected_cycles / data.rated_cycle_life
-            projected_soh = 100.0 * (1 - (0.2 * (cycle_ratio ** 1.5)))
+            if design and fcc and design > 0 and fcc > 0:
+                # The logic from reference.py: assume 20% total wear over the battery's lifespan.
+                # We can reverse this to estimate how many cycles correspond to the current wear level.
+                wear_level = 1.0 - (fcc / design)
+                if wear_level > 0:
+                    # (wear_level / 0.20) gives the fraction of lifespan used. Multiply by total cycles.
+                    estimated_count = int((wear_level / 0.20) * total_cycles)
+                    logging.info("SUCCESS: Estimated cycle count from capacity degradation is %d.", estimated_count)
+                    return estimated_count
+        except Exception as e:
+            logging.error("Cycle count estimation failed: %s", e)
+
+        # If all methods fail, return None.
+        logging.error("CRITICAL: Could not determine cycle count from any available method.")
+        return None
+
+
+# ============================================================================
+# SECTION 6.5: WINDOWS BATTERY PROVIDER
+# Description: The Windows implementation of BatteryProvider. Each source keeps
+#              its multi-layered fallback chain over WMI, GetSystemPowerStatus,
+#              psutil, PowerShell and the powercfg battery report.
+# ============================================================================
+
+class WindowsBatteryProvider(BatteryProvider):
+    """
+    Reads battery data from the Windows APIs. WMI connections are pooled per
+    thread, and the powercfg report is regenerated in the background.
+    """
+    name = "windows"
+
+    def __init__(self, report_path: str, wmi_backend=None):
+        """
+        Args:
+            report_path (str): Where the powercfg XML battery report is kept.
+            wmi_backend: Optional backend for the WMI connection manager. Pass a
+                FakeWMIBackend to run the WMI code paths without Windows.
+        """
+        self.report_path = report_path
+        # --- WMI Connection Pool ---
+        # Connections are cached per thread, so the polling worker reuses the same
+        # connections on every tick instead of rebuilding them.
+        self.wmi = WMIConnectionManager(wmi_backend)
+
+    def release(self):
+        """Releases the calling thread's pooled WMI connections and uninitializes COM."""
+        self.wmi.release()
+
+    def get_battery_identity(self) -> Optional[Tuple[str, str]]:
+        """
+        Two queries over the pooled WMI connections, instead of the full static
+        chain (three WMI classes, the powercfg report and PowerShell).
+        """
+        if not self.wmi.available:
+            return None
+        try:
+            system = self.wmi.query("Win32_ComputerSystemProduct")
+            model = system[0].Name.strip() if system else "System"
+            serial = None
+            static_data = self.wmi.query("BatteryStaticData", WMI_BATTERY_NAMESPACE)
+            if static_data and getattr(static_data[0], 'SerialNumber', None):
+                serial = static_data[0].SerialNumber.strip('\x00').strip()
+            if not serial:
+                # Win32_Battery's DeviceID usually combines serial, manufacturer and name.
+                battery = self.wmi.query("Win32_Battery")
+                if battery and getattr(battery[0], 'DeviceID', None):
+                    serial = battery[0].DeviceID.strip()
+            return (model, serial) if serial else None
+        except Exception as e:
+            logging.warning("Battery identity check via WMI failed: %s", e)
+            return None
+
+    def refresh_report(self):
+        """
+        Makes sure a powercfg battery report is available without blocking on
+        powercfg whenever a previous report exists (stale-while-revalidate). A
+        report older than REPORT_MAX_AGE_SECONDS is served as-is while a fresh
+        one is generated in the background and swapped in atomically. Only the
+        very first launch, with no report at all, waits for powercfg.
+        """
+        generator = BackgroundReportGenerator.for_path(self.report_path)
 
-            # Check if the projected health has crossed the replacement threshold.
-            if projected_soh < REPLACEMENT_THRESHOLD_SOH:
-                days_to_eol = day
-                break
-        
-        if days_to_eol == -1:
-            logging.info("RUL projection exceeds 15 years. Capping result.")
-            return {"years": 15, "months": 0, "days": 0, "status": "Excellent"}
+        # Serve the existing report immediately.
+        if os.path.exists(self.report_path):
+            if generator.is_stale():
+                logging.info("Powercfg report is stale. Serving it while a new one is generated in the background.")
+                generator.refresh_async()
+            else:
+                logging.info("Recent powercfg report found. Skipping generation.")
+            return
 
-        # --- Step 3: Convert remaining days to Years, Months, Days ---
-        years = days_to_eol // 365
-        months = (days_to_eol % 365) // 30
-        days = (days_to_eol % 365) % 30
+        # No report exists yet, so there is nothing to serve: generate it now.
+        generator.generate_now()
 
-        logging.info(
-            "RUL Estimated. Usage: %.2f cycles/day. Days to 80%% SOH: %d -> %d years, %d months",
-            cycles_per_day, days_to_eol, years, months
-        )
-        
-        return {"years": years, "months": months, "days": days, "status": "Calculated"}
-    
-    def _generate_battery_report(self):
+    def _load_report_battery(self) -> Optional[ReportBattery]:
         """
-        Generates a powercfg battery report in XML format. It only generates a new
-        report if the existing one is missing or stale (older than 1 hour). This
-        is a key performance optimization.
+        Returns the primary battery from the powercfg report. The underlying parse
+        is memoized on the file's (path, mtime, size), so repeated calls within a
+        fetch cycle cost a single stat() instead of a re-read of the file.
         """
-        # Check if a fresh report already exists.
-        if os.path.exists(self.report_path) and time.time() - os.path.getmtime(self.report_path) < 3600:
-            logging.info("Recent powercfg report found. Skipping generation.")
-            return
+        report = load_battery_report(self.report_path)
+        return report.primary_battery if report else None
 
-        # If no fresh report, generate a new one.
-        logging.info("Generating new powercfg battery report...")
-        try:
-            # Use subprocess to run the powercfg command. The /xml flag is more machine-readable than /html.
-            subprocess.run(
-                ["powercfg", "/batteryreport", "/xml", "/output", self.report_path],
-                check=True,         # Raise an exception if the command fails.
-                capture_output=True,# Suppress output from appearing in the console.
-                timeout=POWERCFG_TIMEOUT # Prevent the app from hanging.
-            )
-            # Add a small delay to ensure the file is fully written to disk before we try to read it.
-            time.sleep(1)
-            logging.info("Powercfg report generated successfully at %s", self.report_path)
-        except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
-            # If the command fails, log a detailed error.
-            logging.error("Failed to generate powercfg battery report: %s", e)
-            # Try to delete a potentially corrupted or incomplete report file.
-            if os.path.exists(self.report_path):
-                try:
-                    os.remove(self.report_path)
-                except OSError as E:
-                    logging.error("Could not remove corrupted report file: %s" ,E)
-    
-    def _get_system_info(self) -> Tuple[str, str]:
+    def get_system_info(self) -> Tuple[str, str]:
         """
         Retrieves the system manufacturer and model using WMI. This provides
         context for the battery data.
@@ -1461,26 +6435,19 @@ class BatteryIntelligence:
         manufacturer, model = "Unknown", "System"
         
         # Check if WMI is available.
-        if not WMI_AVAILABLE:
+        if not self.wmi.available:
             return manufacturer, model
             
         # Use a try-except block for the WMI query.
         try:
-            # Initialize COM for the current thread.
-            pythoncom.CoInitialize()
-            # Create a WMI connection.
-            c = wmi.WMI()
-            # Query the Win32_ComputerSystemProduct class for system info.
-            system_info = c.Win32_ComputerSystemProduct()[0]
+            # Query the Win32_ComputerSystemProduct class for system info over the pooled connection.
+            system_info = self.wmi.query("Win32_ComputerSystemProduct")[0]
             # Get the vendor (manufacturer) and name (model).
             manufacturer = system_info.Vendor.strip()
             model = system_info.Name.strip()
         except Exception as e:
             # Log any errors that occur.
             logging.error("Failed to get system info via WMI: %s", e)
-        finally:
-            # CRITICAL: Always uninitialize COM in a multi-threaded app.
-            pythoncom.CoUninitialize()
             
         # Return the retrieved or default values.
         return manufacturer, model
@@ -1489,7 +6456,7 @@ class BatteryIntelligence:
 # PART 3
 # ============================================================================
 
-    def _get_static_battery_info(self) -> Dict:
+    def get_static_battery_info(self) -> Dict:
         """
         Retrieves static battery information (data that doesn't change frequently)
         using a multi-layered fallback strategy to ensure maximum accuracy and
@@ -1510,30 +6477,20 @@ class BatteryIntelligence:
         # --- Method 1: Parse the Powercfg XML Report ---
         # This is often the most comprehensive and reliable source.
         try:
-            # Check if the report file exists.
-            if os.path.exists(self.report_path):
-                # Open and read the entire file content.
-                with open(self.report_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                
-                # Use regex to find and extract key values from the XML structure.
-                design_match = re.search(r'<DesignCapacity>(\d+)</DesignCapacity>', content)
-                full_match = re.search(r'<FullChargeCapacity>(\d+)</FullChargeCapacity>', content)
-                manuf_match = re.search(r'<Manufacturer>(.*?)</Manufacturer>', content)
-                serial_match = re.search(r'<SerialNumber>(.*?)</SerialNumber>', content)
-                name_match = re.search(r'<Name>(.*?)</Name>', content)
-                
-                # For each matched value, convert it to the correct type and add to our info dict.
-                if design_match:
-                    info['design_capacity'] = safe_int(design_match.group(1))
-                if full_match:
-                    info['full_charge_capacity'] = safe_int(full_match.group(1))
-                if manuf_match and manuf_match.group(1).strip():
-                    info['manufacturer'] = manuf_match.group(1).strip()
-                if serial_match and serial_match.group(1).strip():
-                    info['serial'] = serial_match.group(1).strip()
-                if name_match and name_match.group(1).strip():
-                    info['name'] = name_match.group(1).strip()
+            # The parsed report is memoized, so this is shared with the cycle count and chemistry lookups.
+            battery = self._load_report_battery()
+            if battery:
+                # For each value present in the report, add it to our info dict.
+                if battery.design_capacity_mwh is not None:
+                    info['design_capacity'] = battery.design_capacity_mwh
+                if battery.full_charge_capacity_mwh is not None:
+                    info['full_charge_capacity'] = battery.full_charge_capacity_mwh
+                if battery.manufacturer:
+                    info['manufacturer'] = battery.manufacturer
+                if battery.serial:
+                    info['serial'] = battery.serial
+                if battery.name:
+                    info['name'] = battery.name
                 
                 logging.info("Successfully parsed data from powercfg XML report.")
         except Exception as e:
@@ -1541,17 +6498,10 @@ class BatteryIntelligence:
 
         # --- Method 2: WMI (ROOT\WMI and root\cimv2) ---
         # WMI is a powerful native Windows API that often provides direct hardware access.
-        if WMI_AVAILABLE:
+        if self.wmi.available:
             try:
-                # Initialize COM for this thread.
-                pythoncom.CoInitialize()
-                # Connect to the advanced 'root\wmi' namespace.
-                c_wmi = wmi.WMI(namespace="root\\wmi")
-                # Connect to the standard 'root\cimv2' namespace.
-                c_cimv2 = wmi.WMI()
-
-                # Get static data like serial, manufacturer from BatteryStaticData class.
-                static_data_list = c_wmi.BatteryStaticData()
+                # Get static data like serial, manufacturer from BatteryStaticData class (advanced 'root\wmi' namespace).
+                static_data_list = self.wmi.query("BatteryStaticData", WMI_BATTERY_NAMESPACE)
                 if static_data_list:
                     static_data = static_data_list[0]
                     if 'manufacturer' not in info and hasattr(static_data, 'ManufactureName') and static_data.ManufactureName.strip():
@@ -1562,41 +6512,28 @@ class BatteryIntelligence:
                         info['design_capacity'] = static_data.DesignedCapacity
                 
                 # Get full charge capacity from BatteryFullChargedCapacity class.
-                fcc_data_list = c_wmi.BatteryFullChargedCapacity()
+                fcc_data_list = self.wmi.query("BatteryFullChargedCapacity", WMI_BATTERY_NAMESPACE)
                 if fcc_data_list and 'full_charge_capacity' not in info:
                     if hasattr(fcc_data_list[0], 'FullChargedCapacity') and fcc_data_list[0].FullChargedCapacity > 0:
                         info['full_charge_capacity'] = fcc_data_list[0].FullChargedCapacity
 
                 # Get battery name/model from Win32_Battery class as another fallback.
-                battery_data_list = c_cimv2.Win32_Battery()
+                battery_data_list = self.wmi.query("Win32_Battery")
                 if battery_data_list and 'name' not in info:
                     if hasattr(battery_data_list[0], 'DeviceID') and battery_data_list[0].DeviceID.strip():
                          info['name'] = battery_data_list[0].DeviceID.strip()
 
             except Exception as e:
                 logging.error("Failed to get static info via WMI: %s", e)
-            finally:
-                # Always ensure COM is uninitialized.
-                pythoncom.CoUninitialize()
 
-        # --- Final Sanity Checks and Fallbacks ---
-        # If after all methods, some data is still missing, use defaults or derive them.
-        if 'design_capacity' not in info or info['design_capacity'] <= 0:
-            info['design_capacity'] = 50000 # Default to 50Wh
-            logging.warning("Design capacity not found. Using default value: %d mWh", info['design_capacity'])
-        
-        if 'full_charge_capacity' not in info or info['full_charge_capacity'] <= 0:
-            # As a last resort, estimate FCC as 90% of design capacity.
-            info['full_charge_capacity'] = int(info['design_capacity'] * 0.9)
-            logging.warning("Full charge capacity not found. Estimating based on design capacity: %d mWh", info['full_charge_capacity'])
-            
+        # Defaults for anything still missing are applied by BatteryIntelligence.
         return info
 
-    def _get_cycle_count(self) -> Optional[int]:
+    def get_cycle_count(self) -> Optional[int]:
         """
         Retrieves the battery cycle count using an extensive chain of fallback
         methods to ensure the highest possible accuracy. It tries direct hardware
-        queries first, then report parsing, and finally estimation.
+        queries first, then report parsing, and finally PowerShell.
 
         Returns:
             Optional[int]: The detected cycle count, or None if all methods fail.
@@ -1605,32 +6542,24 @@ class BatteryIntelligence:
         
         # --- Method 1: WMI (ROOT\WMI - BatteryCycleCount) ---
         # This is often the most direct and accurate hardware query.
-        if WMI_AVAILABLE:
+        if self.wmi.available:
             try:
-                pythoncom.CoInitialize()
-                c = wmi.WMI(namespace="root\\wmi")
-                cycle_data = c.BatteryCycleCount()
+                cycle_data = self.wmi.query("BatteryCycleCount", WMI_BATTERY_NAMESPACE)
                 if cycle_data and hasattr(cycle_data[0], 'CycleCount'):
                     count = cycle_data[0].CycleCount
                     logging.info("SUCCESS: Cycle count from WMI (root\\wmi) is %d.", count)
-                    pythoncom.CoUninitialize()
                     return int(count)
             except Exception as e:
                 logging.warning("WMI (root\\wmi) for cycle count failed: %s. Trying next method.", e)
-            finally:
-                pythoncom.CoUninitialize()
         
         # --- Method 2: Powercfg XML Report ---
         # If WMI fails, the next best source is the generated report.
         try:
-            if os.path.exists(self.report_path):
-                with open(self.report_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                match = re.search(r'<CycleCount>(\d+)</CycleCount>', content)
-                if match:
-                    count = int(match.group(1))
-                    logging.info("SUCCESS: Cycle count from powercfg XML is %d.", count)
-                    return count
+            battery = self._load_report_battery()
+            if battery and battery.cycle_count is not None:
+                count = battery.cycle_count
+                logging.info("SUCCESS: Cycle count from powercfg XML is %d.", count)
+                return count
         except Exception as e:
             logging.warning("Parsing powercfg XML for cycle count failed: %s. Trying next method.", e)
 
@@ -1651,31 +6580,10 @@ class BatteryIntelligence:
         except Exception as e:
             logging.warning("PowerShell for cycle count failed: %s. Trying next method.", e)
 
-        # --- Method 4: Estimation from Capacity Degradation (Last Resort) ---
-        # This is an estimation, not a direct reading, and is only used if all other methods fail.
-        logging.warning("All direct methods for cycle count failed. Falling back to estimation.")
-        try:
-            design = self.cache.get('design_capacity')
-            fcc = self.cache.get('full_charge_capacity')
-            total_cycles = self.cache.get('total_cycles', 1000)
-            
-            if design and fcc and design > 0 and fcc > 0:
-                # The logic from reference.py: assume 20% total wear over the battery's lifespan.
-                # We can reverse this to estimate how many cycles correspond to the current wear level.
-                wear_level = 1.0 - (fcc / design)
-                if wear_level > 0:
-                    # (wear_level / 0.20) gives the fraction of lifespan used. Multiply by total cycles.
-                    estimated_count = int((wear_level / 0.20) * total_cycles)
-                    logging.info("SUCCESS: Estimated cycle count from capacity degradation is %d.", estimated_count)
-                    return estimated_count
-        except Exception as e:
-            logging.error("Cycle count estimation failed: %s", e)
-
-        # If all methods fail, return None.
-        logging.error("CRITICAL: Could not determine cycle count from any available method.")
+        # No direct reading. BatteryIntelligence falls back to an estimate.
         return None
 
-    def _get_chemistry(self) -> Optional[Union[str, int]]:
+    def get_chemistry(self) -> Optional[Union[str, int]]:
         """
         Retrieves the battery chemistry using multiple fallback methods. It prioritizes
         string-based names but will also fetch numeric codes. The result should
@@ -1688,57 +6596,44 @@ class BatteryIntelligence:
         
         # --- Method 1: WMI (ROOT\WMI - BatteryStaticData) ---
         # Often provides a descriptive string like "LION".
-        if WMI_AVAILABLE:
+        if self.wmi.available:
             try:
-                pythoncom.CoInitialize()
-                c = wmi.WMI(namespace="root\\wmi")
-                static_data = c.BatteryStaticData()
+                static_data = self.wmi.query("BatteryStaticData", WMI_BATTERY_NAMESPACE)
                 if static_data and hasattr(static_data[0], 'Chemistry') and static_data[0].Chemistry:
                     chem = static_data[0].Chemistry.strip('\x00').strip()
                     if chem:
                         logging.info("SUCCESS: Chemistry from WMI (root\\wmi) is '%s'.", chem)
-                        pythoncom.CoUninitialize()
                         return chem
             except Exception as e:
                 logging.warning("WMI (root\\wmi) for chemistry failed: %s.", e)
-            finally:
-                pythoncom.CoUninitialize()
 
         # --- Method 2: Powercfg XML Report ---
         try:
-            if os.path.exists(self.report_path):
-                with open(self.report_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                match = re.search(r'<Chemistry>(.*?)</Chemistry>', content)
-                if match and match.group(1).strip():
-                    chem = match.group(1).strip()
-                    logging.info("SUCCESS: Chemistry from powercfg XML is '%s'.", chem)
-                    return chem
+            battery = self._load_report_battery()
+            if battery and battery.chemistry:
+                chem = battery.chemistry
+                logging.info("SUCCESS: Chemistry from powercfg XML is '%s'.", chem)
+                return chem
         except Exception as e:
             logging.warning("Parsing powercfg XML for chemistry failed: %s.", e)
 
         # --- Method 3: WMI (root\cimv2 - Win32_Battery) ---
         # This usually returns a numeric code.
-        if WMI_AVAILABLE:
+        if self.wmi.available:
             try:
-                pythoncom.CoInitialize()
-                c = wmi.WMI()
-                battery_data = c.Win32_Battery()
+                battery_data = self.wmi.query("Win32_Battery")
                 if battery_data and hasattr(battery_data[0], 'Chemistry'):
                     code = battery_data[0].Chemistry
                     logging.info("SUCCESS: Chemistry code from WMI (cimv2) is %d.", code)
-                    pythoncom.CoUninitialize()
                     return code
             except Exception as e:
                 logging.warning("WMI (cimv2) for chemistry failed: %s.", e)
-            finally:
-                pythoncom.CoUninitialize()
 
         # If all methods fail, return None.
         logging.error("CRITICAL: Could not determine chemistry from any available method.")
         return None
 
-    def _get_dynamic_battery_status(self) -> Dict:
+    def get_dynamic_status(self) -> Dict:
         """
         Retrieves real-time, dynamic battery status information (charge, status,
         time remaining, etc.) using the fastest and most reliable methods.
@@ -1798,14 +6693,10 @@ class BatteryIntelligence:
                 
         # --- Method 3: WMI (Last Resort for dynamic data) ---
         # WMI can also provide this, but is generally slower than the other two methods.
-        if WMI_AVAILABLE and ('percent' not in status or 'voltage_mv' not in status):
+        if self.wmi.available and ('percent' not in status or 'voltage_mv' not in status):
             try:
-                pythoncom.CoInitialize()
-                c_wmi = wmi.WMI(namespace="root\\wmi")
-                c_cimv2 = wmi.WMI()
-                
-                # Get voltage and power draw from root\wmi.
-                wmi_status_list = c_wmi.BatteryStatus()
+                # Get voltage and power draw from root\wmi, over the thread's pooled connection.
+                wmi_status_list = self.wmi.query("BatteryStatus", WMI_BATTERY_NAMESPACE)
                 if wmi_status_list:
                     wmi_status = wmi_status_list[0]
                     if hasattr(wmi_status, 'Voltage') and wmi_status.Voltage > 0:
@@ -1813,22 +6704,23 @@ class BatteryIntelligence:
                     # DischargeRate is in milliwatts, negative for discharge, positive for charge.
                     if hasattr(wmi_status, 'DischargeRate') and wmi_status.DischargeRate != 0:
                         status['power_watts'] = abs(wmi_status.DischargeRate) / 1000.0
+                    # RemainingCapacity is in mWh; it gives our own time to empty a real energy figure.
+                    if getattr(wmi_status, 'RemainingCapacity', None):
+                        status['remaining_mwh'] = wmi_status.RemainingCapacity
 
                 # Get percentage from root\cimv2 as a final fallback.
                 if 'percent' not in status:
-                    wmi_battery = c_cimv2.Win32_Battery()
+                    wmi_battery = self.wmi.query("Win32_Battery")
                     if wmi_battery and hasattr(wmi_battery[0], 'EstimatedChargeRemaining'):
                         status['percent'] = wmi_battery[0].EstimatedChargeRemaining
 
             except Exception as e:
                 logging.error("Final WMI fallback for dynamic status failed: %s", e)
-            finally:
-                pythoncom.CoUninitialize()
 
         # Return the consolidated status dictionary.
         return status
         
-    def _get_temperature(self) -> Optional[float]:
+    def get_temperature(self) -> Optional[float]:
         """
         Retrieves the battery temperature using WMI, as it's the most common
         source for this data on Windows.
@@ -1837,14 +6729,12 @@ class BatteryIntelligence:
             Optional[float]: Temperature in Celsius, or None if not available.
         """
         # This data is almost exclusively available via this WMI class.
-        if not WMI_AVAILABLE:
+        if not self.wmi.available:
             return None
             
         try:
-            pythoncom.CoInitialize()
-            c = wmi.WMI(namespace="root\\wmi")
             # Query the MSAcpi_ThermalZoneTemperature class. Often, one of the zones corresponds to the battery.
-            temp_zones = c.MSAcpi_ThermalZoneTemperature()
+            temp_zones = self.wmi.query("MSAcpi_ThermalZoneTemperature", WMI_BATTERY_NAMESPACE)
             if temp_zones:
                 # The temperature is given in tenths of a Kelvin.
                 temp_kelvin = temp_zones[0].CurrentTemperature / 10.0
@@ -1854,13 +6744,10 @@ class BatteryIntelligence:
                 # Perform a sanity check on the value.
                 if -20 < temp_celsius < 120:
                     logging.info("SUCCESS: Temperature from WMI is %.1f °C.", temp_celsius)
-                    pythoncom.CoUninitialize()
                     return round(temp_celsius, 1)
         except Exception as e:
             # It's common for this query to fail if the hardware doesn't expose temperature data.
             logging.warning("Could not retrieve temperature from WMI: %s", e)
-        finally:
-            pythoncom.CoUninitialize()
             
         # Return None if not found.
         return None
@@ -1891,6 +6778,8 @@ class RealtimeUpdateWorker(QObject):
     high_temp_alert = pyqtSignal(float)
     # Define a signal for low-battery alerts, carrying the percentage value.
     low_battery_alert = pyqtSignal(int)
+    # Define a signal for readings far outside this machine's baseline, carrying the anomaly dictionary.
+    anomaly_detected = pyqtSignal(dict)
     
     # The __init__ method is the constructor for the class.
     def __init__(self, intelligence_instance: BatteryIntelligence):
@@ -1910,6 +6799,17 @@ class RealtimeUpdateWorker(QObject):
         # Flags to prevent spamming notifications for the same event.
         self.high_temp_notified = False
         self.low_battery_notified = False
+        # Every poll is persisted to the on-disk history, unless the samples are a replay. Opening
+        # it replays the open rollup buckets, so that happens on the worker thread, in poll_realtime_data.
+        self.history: Optional[BatteryHistory] = None
+        # Smooths the power draw and time to empty for display.
+        self.smoother = RealtimeSmoother()
+        # Learns the normal power draw and temperature rise of this machine. Replays don't touch its baselines.
+        self.anomaly_detector = AnomalyDetector(
+            None if REPLAY_PATH else os.path.join(get_app_data_dir(), ANOMALY_BASELINE_FILE))
+        # Predicts when charging will finish, from a charge curve learned from past sessions.
+        self.charge_predictor = ChargeTimePredictor(
+            None if REPLAY_PATH else os.path.join(get_app_data_dir(), CHARGE_MODEL_FILE))
 
     # This method stops the worker's execution loop.
     def stop(self):
@@ -1927,16 +6827,40 @@ class RealtimeUpdateWorker(QObject):
         """
         # Log that the worker's polling loop has started.
         logging.info("Realtime polling worker started on a new thread.")
+        try:
+            self.history = get_battery_history()
+        except Exception as e:
+            logging.error("Failed to open the battery history. Samples will not be persisted: %s", e)
         # Loop indefinitely as long as the 'running' flag is True.
         while self.running:
             # Use a try-except block to catch any errors during a poll cycle.
             try:
                 # Call the backend method to get the latest dynamic battery status.
-                realtime_data = self.intelligence._get_dynamic_battery_status()
+                realtime_data = self.intelligence.provider.get_dynamic_status()
                 # Also fetch the latest temperature reading.
-                temperature = self.intelligence._get_temperature()
+                temperature = self.intelligence.provider.get_temperature()
                 # Add the temperature to the data dictionary.
                 realtime_data['temperature_celsius'] = temperature
+                # Add the smoothed power draw and time to empty. The raw readings are kept as they are.
+                now = time.time()
+                realtime_data.update(self.smoother.update(realtime_data, now))
+                realtime_data.update(self.charge_predictor.update(realtime_data))
+                
+                # The sample, in the history's record layout.
+                sample = (
+                    now,
+                    realtime_data.get('percent'),
+                    realtime_data.get('voltage_mv'),
+                    realtime_data.get('power_watts'),
+                    temperature,
+                    BatteryHistory.make_flags(realtime_data.get('is_charging'), realtime_data.get('ac_online')),
+                )
+                # Persist it. Writes are batched, so most polls touch no file.
+                if self.history is not None:
+                    self.history.record(*sample)
+                    # Learn the charge curve of sessions that have finished since.
+                    if self.charge_predictor.needs_learning:
+                        self.charge_predictor.learn(self.history)
                 
                 # --- Alerting Logic ---
                 # Check for high temperature.
@@ -1965,6 +6889,10 @@ class RealtimeUpdateWorker(QObject):
                     # Reset the flag once battery is charged or plugged in.
                     self.low_battery_notified = False
                 
+                # Check for departures from this machine's own baseline.
+                for anomaly in self.anomaly_detector.update(sample[0], realtime_data):
+                    self.anomaly_detected.emit(anomaly)
+                
                 # --- Data Emission ---
                 # Emit the signal with the newly fetched data dictionary.
                 self.data_updated.emit(realtime_data)
@@ -1983,6 +6911,15 @@ class RealtimeUpdateWorker(QObject):
                     break
                 time.sleep(0.1)
         
+        # Release this thread's provider resources (e.g., pooled WMI connections) before the thread exits.
+        self.intelligence.provider.release()
+        # Write out any samples still waiting for a batched write, and the learned baselines.
+        if self.history is not None:
+            try:
+                self.history.flush()
+            except (OSError, sqlite3.Error) as e:
+                logging.error("Failed to write the last history samples: %s", e)
+        self.anomaly_detector.save()
         # Log that the worker's loop has terminated.
         logging.info("Realtime polling worker has stopped.")
 
@@ -2057,6 +6994,65 @@ class BatteryDataWorker(QObject):
             logging.error(traceback.format_exc())
             # Emit the 'error' signal to notify the main thread of the failure.
             self.error.emit(error_msg)
+        finally:
+            # The fetch thread is about to exit, so release its provider resources.
+            self.intelligence.provider.release()
+
+class InstallDateWorker(QObject):
+    """
+    Delivers an install date that was still unresolved when the initial fetch
+    finished (e.g., the systeminfo fallback missed its deadline) to the UI thread.
+    """
+    # --- Signals ---
+    # Emitted with the resolved datetime (or None if it could not be determined).
+    resolved = pyqtSignal(object)
+
+    def request(self, resolver: InstallDateResolver):
+        """Asks the resolver for the date without blocking the calling (UI) thread."""
+        resolver.get_async(self.resolved.emit)
+
+class ReportRefreshWorker(QObject):
+    """
+    Re-derives the report-dependent fields (design capacity, cycle count, ...)
+    whenever the BackgroundReportGenerator swaps in a new powercfg report, and
+    hands them to the UI thread through a signal.
+    """
+    # --- Signals ---
+    # Emitted with a dictionary of refreshed BatteryData field values.
+    fields_ready = pyqtSignal(dict)
+
+    def __init__(self, intelligence_instance: BatteryIntelligence):
+        """
+        Args:
+            intelligence_instance (BatteryIntelligence): The backend instance used to re-derive fields.
+        """
+        super().__init__()
+        self.intelligence = intelligence_instance
+
+    def on_report_ready(self, report_path: str):
+        """
+        Listener registered with the BackgroundReportGenerator. Runs on the
+        generator's background thread; the signal is delivered to the UI thread.
+        """
+        logging.info("New powercfg report available at %s. Re-deriving report fields.", report_path)
+        try:
+            self.fields_ready.emit(self.intelligence.rederive_report_fields())
+        except Exception as e:
+            logging.error("Failed to re-derive fields from the new powercfg report: %s", e)
+        finally:
+            # The generator thread is about to exit, so release its provider resources.
+            self.intelligence.provider.release()
+        self.import_history(report_path)
+
+    def import_history(self, report_path: str):
+        """Appends the report's new capacity and usage history rows to the battery history."""
+        history = get_battery_history()
+        if history is None or not os.path.exists(report_path):
+            return
+        try:
+            history.import_battery_report(report_path)
+        except (ET.ParseError, OSError) as e:
+            logging.error("Failed to import history from the powercfg report: %s", e)
 
 
 # ============================================================================
@@ -2395,6 +7391,8 @@ class SystemTrayManager:
         self.health_info_action.setEnabled(False)
         self.temp_info_action = QAction("Temp: --°C", menu)
         self.temp_info_action.setEnabled(False)
+        self.power_info_action = QAction("Power: -- W", menu)
+        self.power_info_action.setEnabled(False)
         # Action to show the "About" dialog.
         about_action = QAction("About Battery-Z", menu)
         # Action to exit the application.
@@ -2416,6 +7414,7 @@ class SystemTrayManager:
         menu.addAction(self.battery_info_action)
         menu.addAction(self.health_info_action)
         menu.addAction(self.temp_info_action)
+        menu.addAction(self.power_info_action)
         menu.addSeparator()
         menu.addAction(about_action)
         menu.addSeparator()
@@ -2456,6 +7455,13 @@ class SystemTrayManager:
                 self.temp_info_action.setText(
                     f"Temp: {battery_data.temperature_celsius:.1f}°C"
                 )
+            
+            # Update the (smoothed) power draw, with the time left when on battery.
+            if battery_data.power_draw_watts is not None:
+                text = f"Power: {battery_data.power_draw_watts:.1f} W"
+                if not battery_data.ac_online and battery_data.time_to_empty_seconds and battery_data.time_to_empty_seconds > 0:
+                    text += f" · {format_time_duration(battery_data.time_to_empty_seconds)} left"
+                self.power_info_action.setText(text)
         except Exception as e:
             logging.error("Failed to update tray menu text: %s", e)
 
@@ -2489,6 +7495,7 @@ class NotificationManager:
         # Timestamps for the last time a notification of each type was sent.
         self.last_high_temp_notification = None
         self.last_low_battery_notification = None
+        self.last_anomaly_notification = None
         # Cooldown period in seconds (5 minutes) to prevent notification spam.
         self.notification_cooldown = 300
         logging.info("Notification manager initialized.")
@@ -2516,6 +7523,14 @@ class NotificationManager:
                 if elapsed < self.notification_cooldown:
                     return False
             self.last_low_battery_notification = now
+        
+        # Check cooldown for baseline anomaly alerts.
+        elif notification_type == "anomaly":
+            if self.last_anomaly_notification:
+                elapsed = (now - self.last_anomaly_notification).total_seconds()
+                if elapsed < self.notification_cooldown:
+                    return False
+            self.last_anomaly_notification = now
             
         # If cooldown has passed, return True.
         return True
@@ -2551,6 +7566,19 @@ class NotificationManager:
             
         logging.warning("Low battery alert sent for %d%%", percentage)
 
+    def send_anomaly_alert(self, anomaly: Dict):
+        """Sends a notification for a reading far outside the machine's baseline, if the cooldown allows."""
+        if not self._can_send_notification("anomaly"):
+            return
+        
+        title = "📈 Unusual Battery Activity"
+        message = anomaly.get("message", "A battery reading is far outside its usual range.")
+        
+        if self.tray_manager:
+            self.tray_manager.show_notification(title, message, QSystemTrayIcon.MessageIcon.Warning)
+        
+        logging.warning("Anomaly alert sent: %s", message)
+
 # ============================================================================
 # SECTION 9: CUSTOM UI WIDGETS (PART 1)
 # Description: This section contains the custom PyQt5 widgets that make up the
@@ -3728,6 +8756,355 @@ class AboutDialog(QDialog):
             logging.error("Failed to open URL '%s': %s", url, e)
 
 
+class HistoryChartWidget(QWidget):
+    """
+    A pannable, zoomable line chart for long battery histories. The visible data
+    is decimated to the screen width with LTTB and turned into a QPainterPath that
+    covers three screen-widths of time, which is rasterized once (stroking a wide,
+    antialiased path is far too slow to repeat every frame). Panning only
+    translates that cached image; the path is rebuilt when the zoom or size
+    changes or the view leaves it. Live points are appended to a separate tail
+    path, without a rebuild.
+    """
+    def __init__(self, dm: DisplayManager, parent=None):
+        super().__init__(parent)
+        
+        # --- Initialization ---
+        self.dm = dm                    # Store the DisplayManager for scaling.
+        self.unit = ""                  # Suffix for the value labels (e.g., "%").
+        self._t = []                    # Timestamps of the loaded series (NumPy array when available).
+        self._v = []                    # Values of the loaded series.
+        self._tail_t: List[float] = []  # Live points appended since the last rebuild.
+        self._tail_v: List[float] = []
+        self._gap = math.inf            # Time steps longer than this are drawn as gaps.
+        self._low, self._high = 0.0, 1.0            # Fixed value range, so panning never rescales the path.
+        self._view_start, self._view_end = 0.0, 1.0  # The visible time window.
+        self._drag_x: Optional[float] = None        # Mouse x at the last drag event.
+        
+        # --- Path Cache ---
+        self._path: Optional[QPainterPath] = None   # Decimated series, in pixels relative to _cache_t0.
+        self._pixmap: Optional[QPixmap] = None      # The path, rasterized.
+        self._tail_path = QPainterPath()            # Live points drawn after the cached series.
+        self._cache_key = None                      # (span, plot size, value range) the path was built for.
+        self._cache_t0 = self._cache_t1 = 0.0       # Time range the cached path covers.
+        self._tail_open = False                     # Whether the tail path has a current point.
+        
+        # Set a minimum size to ensure the chart is readable.
+        self.setMinimumSize(dm.scale(640), dm.scale(300))
+        self.setCursor(Qt.CursorShape.OpenHandCursor)
+
+    # --- Data ---
+
+    def set_series(self, timestamps, values, unit: str):
+        """Replaces the plotted series and shows all of it. NaN values are dropped."""
+        if NUMPY_AVAILABLE:
+            # Bulk conversion; a year of samples must not be filtered point by point.
+            t = np.asarray(timestamps, dtype=np.float64)
+            v = np.asarray(values, dtype=np.float64)
+            valid = ~np.isnan(v)
+            self._t, self._v = t[valid], v[valid]
+        else:
+            pairs = [(t, v) for t, v in zip(timestamps, values) if v == v]
+            self._t = [t for t, _ in pairs]
+            self._v = [v for _, v in pairs]
+        self._tail_t, self._tail_v = [], []
+        self.unit = unit
+        n = len(self._t)
+        if n:
+            self._set_value_range(float(min(self._v)), float(max(self._v)))
+            self._view_start, self._view_end = float(self._t[0]), max(float(self._t[-1]), float(self._t[0]) + 1.0)
+        if n > 1:
+            # The typical spacing, from a sample of at most ~1000 steps.
+            stride = max(1, n // 1000)
+            steps = sorted(self._t[i + 1] - self._t[i] for i in range(0, n - 1, stride))
+            self._gap = float(steps[len(steps) // 2]) * HISTORY_CHART_GAP_FACTOR
+        else:
+            self._gap = math.inf
+        self._invalidate()
+
+    def append_point(self, timestamp: float, value: Optional[float]):
+        """Appends a live point. The chart follows it if the newest data is in view."""
+        if value is None or value != value:
+            return
+        last = self._tail_t[-1] if self._tail_t else (self._t[-1] if len(self._t) else None)
+        if last is not None and timestamp <= last:
+            return
+        following = last is not None and self._view_end >= last
+        self._tail_t.append(timestamp)
+        self._tail_v.append(value)
+        if last is None:
+            # The first point of an empty chart.
+            self._set_value_range(value, value)
+            self._view_start, self._view_end = timestamp - 3600, timestamp
+            self._invalidate()
+            return
+        if value < self._low or value > self._high:
+            # Out of range: the value axis changes, so the whole path must be rebuilt.
+            self._set_value_range(min(self._low, value), max(self._high, value))
+            self._invalidate()
+        elif self._path is not None and self._cache_t0 <= timestamp <= self._cache_t1:
+            # Extend the tail path incrementally.
+            point = self._to_point(timestamp, value)
+            if self._tail_open:
+                self._tail_path.lineTo(point)
+            else:
+                self._tail_path.moveTo(self._to_point(last, self._tail_v[-2] if len(self._tail_v) > 1 else self._v[-1]))
+                self._tail_path.lineTo(point)
+                self._tail_open = True
+        if following:
+            self._view_start += timestamp - self._view_end
+            self._view_end = timestamp
+        self.update()
+
+    def _set_value_range(self, low: float, high: float):
+        pad = max((high - low) * 0.05, 0.5)
+        self._low, self._high = low - pad, high + pad
+
+    def _invalidate(self):
+        self._cache_key = None
+        self.update()
+
+    # --- Geometry ---
+
+    def _plot_rect(self) -> QRectF:
+        margin = self.dm.scale(80)
+        return QRectF(margin, self.dm.scale(15), self.width() - margin - self.dm.scale(15), self.height() - self.dm.scale(50))
+
+    def _scale(self) -> float:
+        """Pixels per second at the current zoom."""
+        return self._plot_rect().width() / max(self._view_end - self._view_start, 1e-6)
+
+    def _to_point(self, timestamp: float, value: float) -> QPointF:
+        """Maps a data point to path coordinates (x relative to the cached range)."""
+        plot = self._plot_rect()
+        return QPointF((timestamp - self._cache_t0) * self._scale(),
+                       plot.bottom() - (value - self._low) / (self._high - self._low) * plot.height())
+
+    def _ensure_path(self):
+        """Rebuilds the cached path if the zoom, size or value range changed or the view left it."""
+        plot = self._plot_rect()
+        span = self._view_end - self._view_start
+        key = (span, plot.width(), plot.height(), self._low, self._high)
+        if key == self._cache_key and self._cache_t0 <= self._view_start and self._view_end <= self._cache_t1:
+            return
+        # Fold the live tail into the main series.
+        if self._tail_t:
+            if NUMPY_AVAILABLE:
+                self._t = np.concatenate((self._t, self._tail_t))
+                self._v = np.concatenate((self._v, self._tail_v))
+            else:
+                self._t = self._t + self._tail_t
+                self._v = self._v + self._tail_v
+            self._tail_t, self._tail_v = [], []
+        self._tail_path = QPainterPath()
+        self._tail_open = False
+        self._cache_key = key
+        self._cache_t0, self._cache_t1 = self._view_start - span, self._view_end + span
+
+        # One point outside each end, so the line runs to the plot edges.
+        lo = max(bisect.bisect_left(self._t, self._cache_t0) - 1, 0)
+        hi = min(bisect.bisect_right(self._t, self._cache_t1) + 1, len(self._t))
+        xs, ys = lttb_decimate(self._t[lo:hi], self._v[lo:hi], max(int(plot.width()) * 3, 3))
+        gap = max(self._gap, 3 * (self._cache_t1 - self._cache_t0) / max(plot.width() * 3, 1))
+
+        path = QPainterPath()
+        previous = None
+        for t, v in zip(xs, ys):
+            point = self._to_point(float(t), float(v))
+            if previous is None or t - previous > gap:
+                path.moveTo(point)
+            else:
+                path.lineTo(point)
+            previous = t
+        self._path = path
+
+        # Rasterize the path once, at the screen's pixel density.
+        ratio = self.devicePixelRatioF()
+        width = int(math.ceil((self._cache_t1 - self._cache_t0) * self._scale())) + 2
+        self._pixmap = QPixmap(int(width * ratio), int(self.height() * ratio))
+        self._pixmap.setDevicePixelRatio(ratio)
+        self._pixmap.fill(Qt.GlobalColor.transparent)
+        raster = QPainter(self._pixmap)
+        raster.setRenderHint(QPainter.RenderHint.Antialiasing)
+        raster.setPen(QPen(QColor("#00ff00"), 2))
+        raster.drawPath(path)
+        raster.end()
+
+    # --- Interaction ---
+
+    def mousePressEvent(self, event):
+        self._drag_x = event.x()
+        self.setCursor(Qt.CursorShape.ClosedHandCursor)
+
+    def mouseMoveEvent(self, event):
+        if self._drag_x is None:
+            return
+        # Dragging only shifts the view; the cached path is translated, not rebuilt.
+        shift = (self._drag_x - event.x()) / self._scale()
+        self._drag_x = event.x()
+        self._view_start += shift
+        self._view_end += shift
+        self.update()
+
+    def mouseReleaseEvent(self, event):
+        self._drag_x = None
+        self.setCursor(Qt.CursorShape.OpenHandCursor)
+
+    def wheelEvent(self, event):
+        # Zoom around the time under the cursor.
+        plot = self._plot_rect()
+        factor = 0.8 if event.angleDelta().y() > 0 else 1.25
+        anchor = self._view_start + (event.x() - plot.left()) / self._scale()
+        self._view_start = anchor - (anchor - self._view_start) * factor
+        self._view_end = anchor + (self._view_end - anchor) * factor
+        self.update()
+
+    # --- Painting ---
+
+    def paintEvent(self, event):
+        # Create a QPainter for this widget.
+        painter = QPainter(self)
+        # Enable antialiasing for smooth lines.
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        painter.fillRect(self.rect(), QColor("#0a0a0a"))
+        plot = self._plot_rect()
+        margin = plot.left()
+
+        # Horizontal grid lines.
+        painter.setPen(QPen(QColor(255, 255, 255, 30), 1))
+        for i in range(5):
+            y = plot.top() + plot.height() * i / 4
+            painter.drawLine(QPointF(plot.left(), y), QPointF(plot.right(), y))
+
+        painter.setPen(QColor("#888888"))
+        if not len(self._t) and not self._tail_t:
+            painter.drawText(plot, Qt.AlignmentFlag.AlignCenter, "No history recorded for this period yet.")
+            return
+
+        # Axis labels: value range on the left, visible time range underneath.
+        painter.drawText(QRectF(0, plot.top() - 8, margin - 5, 16), Qt.AlignmentFlag.AlignRight, f"{self._high:.1f}{self.unit}")
+        painter.drawText(QRectF(0, plot.bottom() - 8, margin - 5, 16), Qt.AlignmentFlag.AlignRight, f"{self._low:.1f}{self.unit}")
+        fmt = "%H:%M" if self._view_end - self._view_start <= 86400 else "%b %d"
+        for t, align, x in ((self._view_start, Qt.AlignmentFlag.AlignLeft, plot.left()),
+                            (self._view_end, Qt.AlignmentFlag.AlignRight, plot.right() - 150)):
+            try:
+                label = datetime.datetime.fromtimestamp(t).strftime(fmt)
+            except (OverflowError, OSError, ValueError):
+                continue
+            painter.drawText(QRectF(x, plot.bottom() + 5, 150, 20), align, label)
+
+        # The series: the cached image (and live tail), translated to the current view.
+        self._ensure_path()
+        painter.setClipRect(plot)
+        painter.translate(plot.left() - (self._view_start - self._cache_t0) * self._scale(), 0)
+        painter.drawPixmap(QPointF(0, 0), self._pixmap)
+        painter.setPen(QPen(QColor("#00ff00"), 2))
+        painter.drawPath(self._tail_path)
+
+
+class HistoryDialog(QDialog):
+    """Plots the persisted battery history for a chosen metric and time range."""
+    # Metric label -> (history field, unit suffix).
+    METRICS = {
+        "Charge Level": ("percent", "%"),
+        "Power Draw": ("power_watts", " W"),
+        "Voltage": ("voltage_mv", " mV"),
+        "Temperature": ("temperature", "°C"),
+        "Full Charge Capacity": ("full_charge_capacity_mwh", " mWh"),
+    }
+    # Range label -> seconds.
+    RANGES = {"1 Hour": 3600, "24 Hours": 86400, "7 Days": 7 * 86400, "30 Days": 30 * 86400,
+              "1 Year": 365 * 86400}
+
+    # History field -> key of the same reading in RealtimeUpdateWorker's data.
+    LIVE_KEYS = {"percent": "percent", "power_watts": "power_watts", "voltage_mv": "voltage_mv",
+                 "temperature": "temperature_celsius"}
+
+    def __init__(self, parent, dm: DisplayManager, history: BatteryHistory, live_updates=None):
+        """
+        Args:
+            parent: The parent widget.
+            dm (DisplayManager): For scaling.
+            history (BatteryHistory): The history to plot.
+            live_updates: Optional signal carrying each real-time data dictionary, to extend the chart live.
+        """
+        super().__init__(parent)
+        self.dm = dm
+        self.history = history
+        self.live_updates = live_updates
+        self.setWindowTitle("Battery History")
+        self.setModal(True)
+        self.setMinimumSize(dm.scale(760), dm.scale(440))
+        self.setStyleSheet(f"""
+            QDialog {{ background-color: #000000; border: 2px solid rgba(0, 255, 0, 0.3); }}
+            QLabel {{ color: #ffffff; background-color: transparent; }}
+            QComboBox {{ background-color: #1a1a1a; color: #ffffff; border: 1px solid #333333;
+                         padding: {dm.scale(4)}px; font-size: {dm.scale_font_size(12)}px; }}
+        """)
+
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(dm.scale(20), dm.scale(20), dm.scale(20), dm.scale(20))
+        controls = QHBoxLayout()
+        title = QLabel("Battery History")
+        title.setStyleSheet(f"font-size: {dm.scale_font_size(18)}px; font-weight: 700; color: #00ff00;")
+        controls.addWidget(title)
+        controls.addStretch()
+        self.resolution_label = QLabel("")
+        self.resolution_label.setStyleSheet(f"font-size: {dm.scale_font_size(11)}px; color: #888888;")
+        controls.addWidget(self.resolution_label)
+        self.metric_box = QComboBox()
+        self.metric_box.addItems(list(self.METRICS))
+        self.range_box = QComboBox()
+        self.range_box.addItems(list(self.RANGES))
+        self.range_box.setCurrentText("24 Hours")
+        controls.addWidget(self.metric_box)
+        controls.addWidget(self.range_box)
+        layout.addLayout(controls)
+
+        self.chart = HistoryChartWidget(dm, self)
+        layout.addWidget(self.chart)
+        self.metric_box.currentTextChanged.connect(self.refresh)
+        self.range_box.currentTextChanged.connect(self.refresh)
+        self.refresh()
+        if live_updates is not None:
+            live_updates.connect(self._on_live_update)
+
+    def refresh(self):
+        """Re-queries the history for the selected metric and range and redraws the chart."""
+        field_name, unit = self.METRICS[self.metric_box.currentText()]
+        end = time.time()
+        start = end - self.RANGES[self.range_box.currentText()]
+        if field_name not in HISTORY_ROLLUP_METRICS:
+            # Imported from the powercfg report's capacity history.
+            rows = self.history.query_report(field_name, start, end)
+            self.resolution_label.setText("Windows battery report")
+            self.chart.set_series([r[0] for r in rows], [r[1] for r in rows], unit)
+            return
+        # Long ranges are drawn from the rollups. Loading a few points per pixel leaves headroom for zooming in.
+        width = max(1, self.chart.width()) * HISTORY_CHART_OVERSAMPLING
+        resolution, rows = self.history.query_for_width(field_name, start, end, width)
+        self.resolution_label.setText({0: "Raw samples", 60: "1-minute averages", 3600: "Hourly averages",
+                                       86400: "Daily averages"}.get(resolution, f"{resolution} s averages"))
+        self.chart.set_series([r[0] for r in rows], [r[1] for r in rows], unit)
+
+    def _on_live_update(self, realtime_data: Dict):
+        """Appends the newest reading of the selected metric to the chart."""
+        field_name, _ = self.METRICS[self.metric_box.currentText()]
+        if field_name not in self.LIVE_KEYS:
+            return
+        self.chart.append_point(time.time(), realtime_data.get(self.LIVE_KEYS[field_name]))
+
+    def done(self, result):
+        # Stop receiving live updates once the dialog closes.
+        if self.live_updates is not None:
+            try:
+                self.live_updates.disconnect(self._on_live_update)
+            except TypeError:
+                pass
+            self.live_updates = None
+        super().done(result)
+
+
 # ============================================================================
 # SECTION 10: MAIN APPLICATION WINDOW
 # Description: This is the main QMainWindow class that orchestrates the entire
@@ -3792,6 +9169,10 @@ class MainWindow(QMainWindow):
             self._start_realtime_updates()
         else:
             logging.info("Real-time updates disabled (no battery detected).")
+        # Re-derive report fields whenever a background powercfg report lands.
+        self._start_report_refresh_listener()
+        # Fill in the install date later if the fetch could not resolve it in time.
+        self._request_install_date()
         
         # --- Final UI Steps ---
         # Trigger the startup animations for the cards.
@@ -4291,11 +9672,13 @@ class MainWindow(QMainWindow):
             self.basic_labels["Current Health"].setValue("Calculating...")
             self.basic_labels["Current Health"].setStyle("") # Reset style
             
-        # Update cycle count, adding a "(Custom)" note if it's user-defined.
+        # Update cycle count, adding a "(Custom)" or "(Estimated)" note if it was not reported by the battery.
         if data.cycle_count is not None and data.cycle_count >= 0:
             cycle_text = str(data.cycle_count)
             if CUSTOM_CYCLE_COUNT is not None:
                 cycle_text += " (Custom)"
+            elif data.cycle_count_estimated:
+                cycle_text = f"~{cycle_text} (Estimated)"
             self.basic_labels["Cycle Count"].setValue(cycle_text)
         else:
             self.basic_labels["Cycle Count"].setValue("Not Available")
@@ -4303,8 +9686,8 @@ class MainWindow(QMainWindow):
         # Update rated cycle life.
         self.basic_labels["Rated Cycle Life"].setValue(f"{format_with_commas(data.rated_cycle_life)} cycles")
         
-        # Estimate and display battery age.
-        install_date = get_windows_install_date()
+        # Estimate and display battery age from the install date resolved during the fetch.
+        install_date = data.install_date
         if install_date:
             age_days = (datetime.datetime.now() - install_date).days
             years = age_days // 365
@@ -4401,6 +9784,8 @@ class MainWindow(QMainWindow):
             if data.time_to_full_seconds and data.time_to_full_seconds > 0:
                 # Format the seconds into a human-readable string.
                 time_str = format_time_duration(data.time_to_full_seconds)
+                if data.time_to_80_seconds:
+                    time_str += f" (80% in {format_time_duration(data.time_to_80_seconds)})"
                 self.time_display_label.setText(f"{time_str} until full")
             else:
                 # If no time is available, provide a contextual message.
@@ -4420,8 +9805,11 @@ class MainWindow(QMainWindow):
             
             # Check if there's an estimated time to empty.
             if data.time_to_empty_seconds and data.time_to_empty_seconds > 0:
-                # Format and display the time remaining.
+                # Format and display the time remaining, with its uncertainty band if known.
                 time_str = format_time_duration(data.time_to_empty_seconds)
+                time_range = data.time_to_empty_range_seconds
+                if time_range and time_range[0] > 0:
+                    time_str += f" ({format_time_duration(time_range[0])} – {format_time_duration(time_range[1])})"
                 self.time_display_label.setText(f"{time_str} remaining")
             else:
                 self.time_display_label.setText("Calculating time remaining...")
@@ -4464,23 +9852,18 @@ class MainWindow(QMainWindow):
         # critically degraded (60% health). It answers "How much useful life is left?".
         # First, we calculate the total predicted lifespan in days until 60% health.
         CRITICAL_THRESHOLD = 60.0
-        cycles_per_day = 0.7 # Assume a default if age is unknown
-        install_date = get_windows_install_date()
+        # The usage rate the RUL projection used (measured from the wear log when available).
+        cycles_per_day = self.rul_prediction.get("cycles_per_day") or DEFAULT_CYCLES_PER_DAY
+        # Without an install date, estimate the age from the cycle count at that rate.
+        age_days = max(int(cycle_count / cycles_per_day), 1)
+        install_date = data.install_date
         if install_date and (datetime.datetime.now() - install_date).days > 0:
             age_days = (datetime.datetime.now() - install_date).days
-            if age_days > 0 and cycle_count > 0:
-                cycles_per_day = cycle_count / age_days
         
         days_to_critical = -1
         if cycles_per_day > 0.01:
-            for day in range(1, 7300): # Project up to 20 years
-                proj_cycles = cycle_count + (day * cycles_per_day)
-                cycle_ratio = proj_cycles / rated_cycles
-                # Project SoH using the same formula as the backend
-                proj_soh = 100.0 * (1 - (0.2 * (cycle_ratio ** 1.5)))
-                if proj_soh < CRITICAL_THRESHOLD:
-                    days_to_critical = day
-                    break
+            # Project SoH using the same formula as the backend, up to 20 years ahead.
+            days_to_critical = days_until_health_below(cycle_count, cycles_per_day, rated_cycles, CRITICAL_THRESHOLD, 7300)
         
         # Now, calculate the percentage of future viability remaining
         total_lifespan_days = (age_days + days_to_critical) if days_to_critical != -1 else (age_days / (cycle_count / rated_cycles) if cycle_count > 0 else 5475)
@@ -4598,7 +9981,8 @@ class MainWindow(QMainWindow):
             # Distinguish between charging and discharging in the label.
             rate_label = "Charge Rate" if data.is_charging else "Power Draw"
             self.power_value_row.label.setText(rate_label)
-            self.power_value_row.setValue(f"{power_w:.2f} W")
+            band = data.power_draw_band_watts
+            self.power_value_row.setValue(f"{power_w:.2f} W" + (f" ± {band:.2f}" if band else ""))
             self.power_value_row.setStyle(f"color: {power_color}; font-weight: 700; font-size: {self.dm.scale_font_size(15)}px;")
         else:
             self.power_value_row.label.setText("Power Draw")
@@ -4643,21 +10027,21 @@ class MainWindow(QMainWindow):
             summary += f"Based on current trends, you have approximately <strong>{years} years and {months} months</strong> remaining until your battery health degrades to the 80% replacement threshold.<br><br>"
         else:
             summary += "Your battery is at or below the 80% replacement threshold. Reduced runtime and performance are expected.<br><br>"
+
+        # 2b. Probabilistic replacement window (Monte Carlo P10/P50/P90).
+        distribution = rul.get("distribution")
+        if distribution:
+            summary += "🎲 <strong>Replacement Window:</strong><br>"
+            summary += (f"Allowing for changes in usage and pack-to-pack variation, replacement is likely between "
+                        f"<strong>{distribution['p10_date']:%b %Y}</strong> and <strong>{distribution['p90_date']:%b %Y}</strong> "
+                        f"(80% confidence), most likely around <strong>{distribution['p50_date']:%b %Y}</strong>.<br><br>")
         
         # 3. NEW: Critical Lifespan Forecast (to 60%)
-        install_date = get_windows_install_date()
-        age_days = max(1, (datetime.datetime.now() - install_date).days if install_date else int((data.cycle_count or 0) / 0.7) or 1)
-        cycles_per_day = (data.cycle_count or 0) / age_days
+        cycles_per_day = rul.get("cycles_per_day") or 0.0
 
         days_to_critical = -1
         if cycles_per_day > 0.01 and health_pct > 60:
-            for day in range(1, 5475):
-                proj_cycles = (data.cycle_count or 0) + (day * cycles_per_day)
-                cycle_ratio = proj_cycles / data.rated_cycle_life
-                proj_soh = 100.0 * (1 - (0.2 * (cycle_ratio ** 1.5)))
-                if proj_soh < 60.0:
-                    days_to_critical = day
-                    break
+            days_to_critical = days_until_health_below(data.cycle_count or 0, cycles_per_day, data.rated_cycle_life, 60.0, 5475)
         
         if days_to_critical != -1:
             crit_years = days_to_critical // 365
@@ -4665,6 +10049,24 @@ class MainWindow(QMainWindow):
             summary += "📉 <strong>Critical Lifespan Forecast:</strong><br>"
             summary += f"You have roughly <strong>{crit_years} years and {crit_months} months</strong> of total predicted life until the battery reaches a critical 60% health, where runtime will be severely impacted.<br><br>"
 
+        # 3b. Measured wear, from the daily wear log.
+        if rul.get("usage_rate_source") == "measured":
+            summary += "📏 <strong>Measured Wear:</strong><br>"
+            summary += f"Over the last {WEAR_WINDOW_DAYS} days this battery has averaged <strong>{cycles_per_day:.2f} cycles/day</strong>"
+            loss = rul.get("capacity_loss_per_cycle_mwh")
+            if loss is not None and loss > 0:
+                summary += f", losing <strong>{loss:.1f} mWh</strong> of capacity per cycle"
+            summary += ".<br><br>"
+
+        # 3c. This pack's own fade curve.
+        pack_fade = rul.get("pack_fade")
+        if pack_fade and pack_fade.get("eol_date"):
+            curve = "square-root" if pack_fade["model"] == "sqrt" else "linear"
+            summary += "🔬 <strong>Pack Fade Forecast:</strong><br>"
+            summary += (f"Fitted to this pack's own capacity history ({curve} fade), it reaches 80% health at about "
+                        f"<strong>{pack_fade['eol_cycles']:.0f} cycles</strong>, around "
+                        f"<strong>{pack_fade['eol_date']:%b %Y}</strong> at your current usage.<br><br>")
+
         # 4. NEW: User Profile Analysis
         summary += f"💡 <strong>Analysis & Top Recommendation:</strong><br>"
         chem_info = f"Your <strong>{data.battery_chemistry}</strong> battery is rated for ~<strong>{data.rated_cycle_life}</strong> cycles. "
@@ -4691,6 +10093,9 @@ class MainWindow(QMainWindow):
         # Create the thread and the worker.
         self.realtime_thread = QThread()
         self.realtime_worker = RealtimeUpdateWorker(intelligence_instance)
+        # Time to empty is derived from the smoothed power draw once the capacity is known.
+        self.realtime_worker.smoother.full_charge_capacity_mwh = self.battery_data.full_charge_capacity_mwh
+        self.realtime_worker.charge_predictor.full_charge_capacity_mwh = self.battery_data.full_charge_capacity_mwh
         
         # Move the worker object to the new thread.
         self.realtime_worker.moveToThread(self.realtime_thread)
@@ -4701,6 +10106,7 @@ class MainWindow(QMainWindow):
         # Connect the alert signals to their respective handler slots.
         self.realtime_worker.high_temp_alert.connect(self._on_high_temp_alert)
         self.realtime_worker.low_battery_alert.connect(self._on_low_battery_alert)
+        self.realtime_worker.anomaly_detected.connect(self._on_anomaly_detected)
         # When the thread starts, it will call the worker's main polling method.
         self.realtime_thread.started.connect(self.realtime_worker.poll_realtime_data)
         
@@ -4708,6 +10114,75 @@ class MainWindow(QMainWindow):
         self.realtime_thread.start()
         logging.info("Real-time update thread started.")
 
+    def _start_report_refresh_listener(self):
+        """
+        Subscribes to the shared BackgroundReportGenerator, so a powercfg report
+        regenerated in the background updates the report-derived fields in place.
+        """
+        intelligence_instance = BatteryIntelligence()
+        self.report_refresh_worker = ReportRefreshWorker(intelligence_instance)
+        # The worker lives on the UI thread, so the signal is queued across from the generator thread.
+        self.report_refresh_worker.fields_ready.connect(self._on_report_fields_ready)
+        self.report_generator = BackgroundReportGenerator.for_path(intelligence_instance.report_path)
+        self.report_generator.add_listener(self.report_refresh_worker.on_report_ready)
+
+        # The job may have finished before we subscribed. If so, catch up now. Either way the
+        # work runs off the UI thread, as it does when the generator calls the listener itself.
+        completed_at = self.report_generator.last_completed_at
+        fetched_at = self.battery_data.fetch_timestamp
+        if completed_at is not None and (fetched_at is None or completed_at > fetched_at.timestamp()):
+            target = self.report_refresh_worker.on_report_ready
+        else:
+            # Only import the history of the report already on disk.
+            target = self.report_refresh_worker.import_history
+        threading.Thread(target=target, args=(intelligence_instance.report_path,),
+                         name="BatteryZ-ReportCatchUp", daemon=True).start()
+
+    def _request_install_date(self):
+        """
+        If the install date was not resolved during the fetch, resolves it in the
+        background and refreshes the age-dependent fields once it arrives.
+        """
+        resolver = self.report_refresh_worker.intelligence.install_date
+        if self.battery_data.install_date is not None or (resolver.is_resolved() and resolver.peek() is None):
+            return
+        self.install_date_worker = InstallDateWorker()
+        self.install_date_worker.resolved.connect(self._on_install_date_resolved)
+        self.install_date_worker.request(resolver)
+
+    def _on_install_date_resolved(self, install_date):
+        """SLOT called on the UI thread when a late install date lookup completes."""
+        if install_date is None or self.battery_data.install_date is not None:
+            return
+        try:
+            self.battery_data.install_date = install_date
+            intelligence = self.report_refresh_worker.intelligence
+            self.rul_prediction.update(intelligence.estimate_remaining_life(self.battery_data))
+            self._populate_initial_data()
+        except Exception as e:
+            logging.error("Failed to apply the resolved install date: %s", e)
+
+    def _on_report_fields_ready(self, fields: Dict):
+        """
+        SLOT called on the UI thread with fields re-derived from a new powercfg
+        report. Updates the data object, re-runs SOH/RUL and refreshes the UI.
+        """
+        try:
+            intelligence = self.report_refresh_worker.intelligence
+            if not intelligence.apply_report_fields(self.battery_data, fields):
+                return
+            if hasattr(self, 'realtime_worker'):
+                self.realtime_worker.smoother.full_charge_capacity_mwh = self.battery_data.full_charge_capacity_mwh
+                self.realtime_worker.charge_predictor.full_charge_capacity_mwh = self.battery_data.full_charge_capacity_mwh
+            self.soh_result['soh_percentage'] = intelligence.calculate_health(self.battery_data)
+            self.rul_prediction.update(intelligence.estimate_remaining_life(self.battery_data))
+            self.rul_prediction['cycle_count_available'] = self.battery_data.cycle_count is not None
+            self.rul_prediction['cycles_used'] = self.battery_data.cycle_count
+            self.rul_prediction['rated_cycles'] = self.battery_data.rated_cycle_life
+            self._populate_initial_data()
+        except Exception as e:
+            logging.error("Failed to apply refreshed report fields: %s", e)
+
     def _on_realtime_data_update(self, realtime_data: Dict):
         """
         This is the SLOT that is called on the main UI thread whenever the
@@ -4721,14 +10196,26 @@ class MainWindow(QMainWindow):
                 self.battery_data.is_charging = realtime_data['is_charging']
             if realtime_data.get('ac_online') is not None:
                 self.battery_data.ac_online = realtime_data['ac_online']
-            if realtime_data.get('time_remaining') is not None:
+            # Prefer the smoothed time to empty and power draw, with their uncertainty bands.
+            if realtime_data.get('time_remaining_smoothed') is not None:
+                self.battery_data.time_to_empty_seconds = realtime_data['time_remaining_smoothed']
+                self.battery_data.time_to_empty_range_seconds = realtime_data.get('time_remaining_range')
+            elif realtime_data.get('time_remaining') is not None:
                 self.battery_data.time_to_empty_seconds = realtime_data['time_remaining']
+                self.battery_data.time_to_empty_range_seconds = None
+            # The predicted charge times, cleared when not charging.
+            self.battery_data.time_to_full_seconds = realtime_data.get('time_to_full')
+            self.battery_data.time_to_80_seconds = realtime_data.get('time_to_80')
             if realtime_data.get('temperature_celsius') is not None:
                 self.battery_data.temperature_celsius = realtime_data['temperature_celsius']
             if realtime_data.get('voltage_mv') is not None:
                 self.battery_data.current_voltage_mv = realtime_data['voltage_mv']
-            if realtime_data.get('power_watts') is not None:
+            if realtime_data.get('power_watts_smoothed') is not None:
+                self.battery_data.power_draw_watts = realtime_data['power_watts_smoothed']
+                self.battery_data.power_draw_band_watts = realtime_data.get('power_watts_band')
+            elif realtime_data.get('power_watts') is not None:
                 self.battery_data.power_draw_watts = realtime_data['power_watts']
+                self.battery_data.power_draw_band_watts = None
             
             # Call the specific UI update methods for the affected cards.
             self._update_charging_state()
@@ -4752,6 +10239,11 @@ class MainWindow(QMainWindow):
         logging.warning("Received low battery alert signal for %d%%", percentage)
         self.notification_manager.send_low_battery_alert(percentage)
 
+    def _on_anomaly_detected(self, anomaly: Dict):
+        """Slot to handle readings far outside this machine's baseline."""
+        logging.warning("Received anomaly signal: %s (z=%.1f)", anomaly.get("message"), anomaly.get("z", 0.0))
+        self.notification_manager.send_anomaly_alert(anomaly)
+
     def show_previous_tip(self):
         """Cycles to the previous tip in the 'Quick Battery Tips' card."""
         self.current_tip_index = (self.current_tip_index - 1 + len(self.tips)) % len(self.tips)
@@ -4831,23 +10323,26 @@ class MainWindow(QMainWindow):
 
     def show_battery_history(self):
         """
-        [NEW FEATURE] This function, which was a placeholder in the original
-        main.py, is now fully implemented. It launches a dialog that shows a
-        graph of battery percentage over time.
+        Launches a dialog that graphs the persisted battery history (charge
+        level, power draw, voltage or temperature) over time.
         """
         # This feature is only available if a battery is present.
         if not self.battery_data.battery_present:
             QMessageBox.information(self, "Feature Not Available", "Battery history is not applicable for desktop PCs without a battery.")
             return
 
-        # Create and execute the HistoryDialog.
-        # This will be defined later in the file.
-        # try:
-        #     dialog = HistoryDialog(self)
-        #     dialog.exec_()
-        # except NameError:
-        # Placeholder for now, as HistoryDialog is defined later.
-        QMessageBox.information(self, "Coming Soon", "The history plotting feature is being integrated.")
+        # History is not persisted while replaying a recording.
+        if REPLAY_PATH:
+            QMessageBox.information(self, "Feature Not Available", "Battery history is not recorded in replay mode.")
+            return
+        # The polling worker opens the history on its own thread, shortly after start-up.
+        history = self.realtime_worker.history
+        if history is None:
+            QMessageBox.information(self, "History Not Ready", "The battery history is still being opened. Please try again in a moment.")
+            return
+
+        dialog = HistoryDialog(self, self.dm, history, self.realtime_worker.data_updated)
+        dialog.exec_()
 
     def show_about_dialog(self):
         """Creates and shows the custom 'About' dialog."""
@@ -4926,6 +10421,8 @@ class MainWindow(QMainWindow):
             intelligence = BatteryIntelligence()
             # The get_all_data() function will automatically use CUSTOM_CYCLE_COUNT if it's set
             self.battery_data = intelligence.get_all_data()
+            # This fetch ran on the UI thread, so don't keep its provider resources alive afterwards.
+            intelligence.provider.release()
             
             self.soh_result['soh_percentage'] = intelligence.calculate_health(self.battery_data)
             
@@ -4998,6 +10495,10 @@ class MainWindow(QMainWindow):
             except Exception as e:
                 logging.error("Error cleaning up real-time thread: %s", e)
         
+        # Stop listening for background powercfg reports.
+        if hasattr(self, 'report_generator'):
+            self.report_generator.remove_listener(self.report_refresh_worker.on_report_ready)
+        
         # --- Cleanup UI Elements ---
         # Clean up the system tray icon.
         if hasattr(self, 'tray_manager') and self.tray_manager:
@@ -5158,6 +10659,13 @@ def print_help():
     print("  --help, -h       Show this help message.")
     print("  --version, -v    Show version information.")
     print("  --no-gui         Run in console-only mode for a quick data dump.")
+    print("  --benchmark NAME Run a performance benchmark ('all' for every one; omit NAME to list them).")
+    print("  --record FILE    Record every raw battery data response to FILE (.jsonl.gz).")
+    print("  --replay FILE    Replay a recording instead of reading the hardware.")
+    print("  --replay-speed N Replay speed: 1 = real time (default), N = N× faster, 0 = as fast as possible.")
+    print("  --export-history FILE [--days N]  Export the recorded sample history (or its last N days) to a compressed .bza archive.")
+    print("  --history-backend NAME  Store history in 'segments' (default) or 'sqlite' (BatteryZ_Data/history/history.sqlite3, queryable with SQL).")
+    print(f"  --score-fleet IN OUT  Score a fleet CSV (columns: {', '.join(FLEET_COLUMNS)}) and write it with SOH, status and RUL added.")
 
 def run_console_mode():
     """
@@ -5203,6 +10711,16 @@ def run_console_mode():
     print("\n--- USAGE & LIFESPAN ---")
     print(f"  Cycle Count:    {battery_data.cycle_count} / {battery_data.rated_cycle_life}")
     print(f"  Est. Lifespan:  {rul['years']} years, {rul['months']} months")
+    if rul.get("cycles_per_day") is not None:
+        print(f"  Usage Rate:     {rul['cycles_per_day']:.2f} cycles/day ({rul['usage_rate_source']})")
+    pack_fade = rul.get("pack_fade")
+    if pack_fade and pack_fade.get("eol_date"):
+        print(f"  Pack Fade Fit:  80% at ~{pack_fade['eol_cycles']:.0f} cycles ({pack_fade['model']}), "
+              f"around {pack_fade['eol_date']}")
+    distribution = rul.get("distribution")
+    if distribution:
+        print(f"  Replace Window: {distribution['p10_date']} to {distribution['p90_date']} "
+              f"(P10-P90, median {distribution['p50_date']})")
     
     print("\n--- REAL-TIME STATUS ---")
     print(f"  Charge Level:   {battery_data.current_percentage}%")
@@ -5212,6 +10730,434 @@ def run_console_mode():
     
     print("\n" + "="*80 + "\n")
 
+
+# ============================================================================
+# SECTION 12: PERFORMANCE BENCHMARKS
+# Description: Self-contained benchmarks for the data pipeline, run with
+#              `--benchmark NAME`. They generate synthetic inputs, so they run
+#              on any machine, including build servers without a battery.
+# ============================================================================
+
+def _write_synthetic_battery_report(path: str, target_bytes: int) -> int:
+    """
+    Writes a synthetic powercfg XML report of roughly `target_bytes`, padded
+    with RecentUsage and History rows the way a long-lived machine's report is.
+
+    Returns:
+        int: The number of usage rows written.
+    """
+    header = (
+        '<?xml version="1.0" encoding="utf-8"?>\n'
+        '<BatteryReport xmlns="http://schemas.microsoft.com/battery/2012">\n'
+        '<SystemInformation><ComputerName>BENCH</ComputerName><SystemManufacturer>Dell Inc.</SystemManufacturer>'
+        '<SystemProductName>XPS 15 9520</SystemProductName></SystemInformation>\n'
+        '<Batteries><Battery><Id>DELL 71R31C7</Id><Manufacturer>SMP</Manufacturer><SerialNumber>1234</SerialNumber>'
+        '<Chemistry>LION</Chemistry><LongTerm>1</LongTerm><DesignCapacity>86000</DesignCapacity>'
+        '<FullChargeCapacity>78000</FullChargeCapacity><CycleCount>212</CycleCount></Battery></Batteries>\n'
+    )
+    start = datetime.datetime(2024, 1, 1)
+    rows_written = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(header)
+        written = len(header)
+        # Every 20th row is a weekly History row; the rest are RecentUsage rows.
+        f.write("<RecentUsage>\n")
+        while written < target_bytes:
+            ts = (start + datetime.timedelta(minutes=5 * rows_written)).isoformat()
+            row = (f'<UsageEntry Timestamp="{ts}Z" LocalTimestamp="{ts}" Duration="PT5M" Ac="{rows_written % 2}" '
+                   f'EntryType="Active" ChargeCapacity="{40000 + rows_written % 30000}" Discharge="120" '
+                   f'FullChargeCapacity="78000" IsNextOnBattery="0" />\n')
+            f.write(row)
+            written += len(row)
+            rows_written += 1
+        f.write("</RecentUsage>\n<History>\n")
+        for week in range(max(1, rows_written // 20)):
+            day = (start + datetime.timedelta(weeks=week)).isoformat()
+            f.write(f'<HistoryEntry LocalStartDate="{day}" LocalEndDate="{day}" DesignCapacity="86000" '
+                    f'FullChargeCapacity="{86000 - week * 10}" CycleCount="{week}" />\n')
+        f.write("</History>\n</BatteryReport>\n")
+    return rows_written
+
+def benchmark_report_parser():
+    """
+    Compares the old approach (three full reads, each regex-scanned) against
+    the header parse the data sources use, the memoized lookup and the full
+    streaming parse the history import uses, for 10 KB to 50 MB reports.
+    """
+    import tracemalloc
+    sizes = [10 * 1024, 100 * 1024, 1024 * 1024, 10 * 1024 * 1024, 50 * 1024 * 1024]
+    print(f"{'Size':>10} {'Rows':>9} {'3x regex':>11} {'Header parse':>13} {'Memo hit':>10} "
+          f"{'Full stream':>12} {'MB/s':>8} {'Peak mem':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            path = os.path.join(tmp, f"report_{size}.xml")
+            rows = _write_synthetic_battery_report(path, size)
+            actual = os.path.getsize(path)
+
+            # Baseline: the previous implementation read and regex-scanned the file three times.
+            start = time.perf_counter()
+            for pattern in (r'<DesignCapacity>(\d+)</DesignCapacity>', r'<CycleCount>(\d+)</CycleCount>',
+                            r'<Chemistry>(.*?)</Chemistry>'):
+                with open(path, 'r', encoding='utf-8') as f:
+                    re.search(pattern, f.read())
+            legacy_ms = (time.perf_counter() - start) * 1000
+
+            start = time.perf_counter()
+            report = parse_battery_report(path)
+            header_ms = (time.perf_counter() - start) * 1000
+            assert report.primary_battery.cycle_count == 212 and report.system_info
+
+            start = time.perf_counter()
+            report = parse_battery_report(path, history=True)
+            parse_ms = (time.perf_counter() - start) * 1000
+            assert report.primary_battery.cycle_count == 212 and len(report.usage_history) == rows
+
+            load_battery_report(path)  # Prime the memo.
+            start = time.perf_counter()
+            for _ in range(1000):
+                load_battery_report(path)
+            memo_us = (time.perf_counter() - start) * 1000
+
+            # Peak memory is measured in a separate pass because tracing slows the parser down.
+            tracemalloc.start()
+            for _ in iter_battery_report(path):
+                pass
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            print(f"{actual / 1024:>8.0f}KB {rows:>9,} {legacy_ms:>9.1f}ms {header_ms:>11.2f}ms {memo_us:>8.2f}us "
+                  f"{parse_ms:>10.1f}ms {actual / 1048576 / (parse_ms / 1000):>8.1f} {peak / 1024:>8.0f}KB")
+    print("\n'Full stream' reads every history row and runs only when the history store imports a new report.")
+    print("'Peak mem' is the full streaming pass alone (no row objects retained), which stays flat as the report grows.")
+
+# Representative per-source latencies (seconds) of a Windows laptop with a warm WMI
+# service and an up-to-date powercfg report. Used to build the synthetic recording.
+_SYNTHETIC_SOURCE_LATENCIES = {
+    "is_battery_present": 0.002, "refresh_report": 0.001, "get_battery_identity": 0.060, "get_system_info": 0.180,
+    "get_static_battery_info": 0.350, "get_cycle_count": 0.220, "get_chemistry": 0.150,
+    "get_dynamic_status": 0.040, "get_temperature": 0.090,
+}
+
+def _write_synthetic_recording(path: str, polls: int) -> int:
+    """
+    Writes a provider recording with one full fetch followed by `polls` real-time polls.
+
+    Returns:
+        int: The number of responses written.
+    """
+    values = {
+        "is_battery_present": True, "refresh_report": None, "get_battery_identity": ["XPS 15 9520", "1234"],
+        "get_system_info": ["Dell Inc.", "XPS 15 9520"],
+        "get_static_battery_info": {"design_capacity": 86000, "full_charge_capacity": 78000,
+                                    "manufacturer": "SMP", "serial": "1234", "name": "DELL 71R31C7"},
+        "get_cycle_count": 212, "get_chemistry": "LION", "get_temperature": 34.5,
+    }
+    t = 0.0
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        f.write(json.dumps({"format": RECORDING_FORMAT, "version": 1, "provider": "synthetic",
+                            "platform": "Windows", "started_at": 0}) + "\n")
+        def write(source, value):
+            nonlocal t
+            t += _SYNTHETIC_SOURCE_LATENCIES[source]
+            f.write(json.dumps({"t": round(t, 6), "source": source,
+                                "latency": _SYNTHETIC_SOURCE_LATENCIES[source], "value": value}) + "\n")
+        for source, value in values.items():
+            write(source, value)
+        for i in range(polls + 1):
+            write("get_dynamic_status", {"percent": 80 - i % 50, "ac_online": False, "is_charging": False,
+                                         "time_remaining": 7200, "voltage_mv": 11800, "power_watts": 9.5 + i % 7})
+            write("get_temperature", 34.5)
+    return len(values) + 2 * (polls + 1)
+
+def benchmark_provider_pipeline():
+    """
+    Replays a synthetic recording through the full get_all_data pipeline and the
+    real-time poll, at real-time speed, 10× and as fast as possible. Real time
+    shows what users wait for; 'max' isolates the pipeline's own overhead.
+    """
+    polls = 2000
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "recording.jsonl.gz")
+        responses = _write_synthetic_recording(path, polls)
+        print(f"Recording: {os.path.getsize(path):,} bytes for {responses:,} responses.")
+        sequential = sum(_SYNTHETIC_SOURCE_LATENCIES.values())
+        print(f"Sum of recorded source latencies for one full fetch: {sequential * 1000:.0f} ms\n")
+        print(f"{'Speed':>8} {'get_all_data':>14} {'warm cache':>12} {'Realtime poll':>15}")
+        for speed, label in ((1.0, "1x"), (10.0, "10x"), (0, "max")):
+            provider = ReplayBatteryProvider(path, speed)
+            # The synthetic battery must stay out of the user's cache, wear log and fade models.
+            intelligence = BatteryIntelligence(provider=provider, persist=False)
+
+            start = time.perf_counter()
+            data = intelligence.get_all_data()
+            fetch_ms = (time.perf_counter() - start) * 1000
+            assert data.cycle_count == 212 and not data.fetch_errors
+
+            # A second fetch serves the static sources from the per-battery cache.
+            start = time.perf_counter()
+            data = intelligence.get_all_data()
+            warm_ms = (time.perf_counter() - start) * 1000
+            assert data.cycle_count == 212 and not data.fetch_errors
+
+            # The real-time worker's per-tick work, minus its sleep.
+            count = polls if speed == 0 else 20
+            start = time.perf_counter()
+            for _ in range(count):
+                provider.get_dynamic_status()
+                provider.get_temperature()
+            poll_us = (time.perf_counter() - start) / count * 1e6
+            print(f"{label:>8} {fetch_ms:>12.1f}ms {warm_ms:>10.1f}ms {poll_us:>13.1f}us")
+
+def _day_loop_reference(cycle_count, cycles_per_day, rated_cycles, threshold_soh, max_days):
+    """The former day-by-day projection loop, kept as the reference for the RUL benchmark."""
+    for day in range(1, max_days):
+        projected_cycles = cycle_count + (day * cycles_per_day)
+        cycle_ratio = projected_cycles / rated_cycles
+        if 100.0 * (1 - (0.2 * (cycle_ratio ** 1.5))) < threshold_soh:
+            return day
+    return -1
+
+def benchmark_rul_projection():
+    """
+    Checks the closed-form and vectorized RUL projections against the former day
+    loop on random batteries, for each threshold/horizon pair the app uses, and
+    compares their speed.
+    """
+    rng = random.Random(42)
+    count = 5000
+    scenarios = [(rng.uniform(0, 1500), rng.choice([0.0, rng.uniform(0.005, 0.05), rng.uniform(0.05, 5.0)]),
+                  rng.choice([300, 500, 800, 1000, 1500, 3000])) for _ in range(count)]
+    print(f"{count:,} random batteries per case.\n")
+    print(f"{'Threshold':>10} {'Horizon':>8} {'Day loop':>10} {'Closed form':>12} {'NumPy':>10} {'Identical':>10}")
+    for threshold, horizon in ((80.0, 5475), (60.0, 7300), (60.0, 5475)):
+        start = time.perf_counter()
+        reference = [_day_loop_reference(c, k, r, threshold, horizon) for c, k, r in scenarios]
+        loop_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        closed = [days_until_health_below(c, k, r, threshold, horizon) for c, k, r in scenarios]
+        closed_ms = (time.perf_counter() - start) * 1000
+        identical = closed == reference
+
+        numpy_text = "n/a"
+        if NUMPY_AVAILABLE:
+            columns = np.array(scenarios, dtype=np.float64).T
+            start = time.perf_counter()
+            vectorized = days_until_health_below_np(columns[0], columns[1], columns[2], threshold, horizon)
+            numpy_text = f"{(time.perf_counter() - start) * 1000:.2f}ms"
+            identical = identical and vectorized.tolist() == reference
+        print(f"{threshold:>9.0f}% {horizon:>8} {loop_ms:>8.0f}ms {closed_ms:>10.1f}ms {numpy_text:>10} {str(identical):>10}")
+        assert identical, "Closed-form RUL projection differs from the day loop"
+
+def benchmark_monte_carlo_rul():
+    """Times the Monte Carlo RUL on the NumPy path and the pure-Python fallback."""
+    global NUMPY_AVAILABLE
+    scenario = dict(cycle_count=240, cycles_per_day=0.6, rated_cycles=1000, quality_tier="Mid-range")
+    print(f"Scenario: {scenario}\n")
+    print(f"{'Path':>12} {'Trajectories':>13} {'Time':>10} {'P10':>7} {'P50':>7} {'P90':>7}")
+    paths = ([("numpy", True)] if NUMPY_AVAILABLE else []) + [("pure-python", False)]
+    numpy_available = NUMPY_AVAILABLE
+    try:
+        for label, use_numpy in paths:
+            NUMPY_AVAILABLE = use_numpy
+            monte_carlo_rul(**scenario)  # Warm up.
+            runs = 10
+            start = time.perf_counter()
+            for _ in range(runs):
+                result = monte_carlo_rul(**scenario)
+            elapsed_ms = (time.perf_counter() - start) / runs * 1000
+            print(f"{label:>12} {result['trajectories']:>13,} {elapsed_ms:>8.1f}ms "
+                  f"{result['p10_days']:>7} {result['p50_days']:>7} {result['p90_days']:>7}")
+    finally:
+        NUMPY_AVAILABLE = numpy_available
+    point = days_until_health_below(scenario["cycle_count"], scenario["cycles_per_day"], scenario["rated_cycles"], 80.0, 5475)
+    print(f"\nDeterministic estimate for comparison: {point} days.")
+
+def benchmark_history_chart():
+    """Times LTTB decimation and the history chart's rebuild and pan frames over a year of data."""
+    if not PYQT5_AVAILABLE:
+        print("PyQt5 is not available; skipping.")
+        return
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    # A year of 1-minute points: a slow daily charge cycle with noise.
+    count = 365 * 24 * 60
+    rng = random.Random(7)
+    t0 = time.time() - count * 60
+    timestamps = [t0 + 60 * i for i in range(count)]
+    values = [50 + 40 * math.sin(i / 720.0) + rng.uniform(-2, 2) for i in range(count)]
+
+    start = time.perf_counter()
+    lttb_decimate(timestamps, values, 3000)
+    print(f"LTTB {count:,} -> 3,000 points: {(time.perf_counter() - start) * 1000:.1f}ms")
+
+    chart = HistoryChartWidget(DisplayManager(app.primaryScreen()))
+    chart.resize(1000, 400)
+    chart.set_series(timestamps, values, "%")
+    # Zoom in to 30 days, so there is room to pan.
+    chart._view_start = chart._view_end - 30 * 86400
+    pixmap = QPixmap(chart.size())
+    start = time.perf_counter()
+    chart.render(pixmap)
+    print(f"Path rebuild (zoom): {(time.perf_counter() - start) * 1000:.1f}ms")
+
+    frames, rebuilds = 240, 0
+    step = 30 * 86400 / 200      # Pan left by 5 px worth of time per frame.
+    start = time.perf_counter()
+    for _ in range(frames):
+        chart._view_start -= step
+        chart._view_end -= step
+        key_before = (chart._cache_key, chart._cache_t0)
+        chart.render(pixmap)
+        rebuilds += (chart._cache_key, chart._cache_t0) != key_before
+    elapsed = time.perf_counter() - start
+    print(f"Pan: {frames} frames in {elapsed * 1000:.0f}ms ({frames / elapsed:.0f} fps, {rebuilds} path rebuilds)")
+
+def benchmark_telemetry_archive():
+    """Round-trips a day of synthetic 3-second samples through the .bza archive format."""
+    rng = random.Random(11)
+    samples = []
+    t, percent = 1_700_000_000.0, 95.0
+    for i in range(28800):
+        t += 3.0 + rng.uniform(-0.004, 0.004)             # Poll jitter of a few milliseconds.
+        charging = (i // 3600) % 2 == 1
+        percent = min(100.0, max(5.0, percent + (0.01 if charging else -0.008)))
+        samples.append((round(t, 3), round(percent), 11000 + rng.randrange(-40, 40) * 2,
+                        round(rng.uniform(6.0, 9.0), 2), 31.0 + (i // 600) % 5,
+                        BatteryHistory.make_flags(charging, charging)))
+    # What the archive stores: float32 values and millisecond timestamps.
+    expected = [(s[0],) + tuple(array.array('f', s[1:5])) + (s[5],) for s in samples]
+
+    path = os.path.join(tempfile.gettempdir(), "batteryz_bench_archive.bza")
+    try:
+        start = time.perf_counter()
+        with TelemetryArchiveWriter(path) as writer:
+            writer.write_many(samples)
+        encode = time.perf_counter() - start
+        size = os.path.getsize(path)
+        start = time.perf_counter()
+        with TelemetryArchiveReader(path) as reader:
+            decoded = list(reader)
+        decode = time.perf_counter() - start
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+    json_size = sum(len(json.dumps(dict(zip(TelemetryArchiveWriter.FIELDS, s)))) for s in samples)
+    record_size = struct.calcsize(HISTORY_SAMPLE_FORMAT)
+
+    print(f"Samples: {len(samples):,}   Round trip exact: {decoded == expected}")
+    print(f"{'Format':>14} {'Bytes':>12} {'Bytes/sample':>13}")
+    print(f"{'JSON':>14} {json_size:>12,} {json_size / len(samples):>13.2f}")
+    print(f"{'Segment store':>14} {record_size * len(samples):>12,} {record_size:>13.2f}")
+    print(f"{'.bza':>14} {size:>12,} {size / len(samples):>13.2f}")
+    print(f"\nEncode: {len(samples) / encode:,.0f} samples/s   Decode: {len(samples) / decode:,.0f} samples/s")
+
+def benchmark_history_backends():
+    """Compares the segment-file and SQLite history backends: inserts, worst poll-path latency and queries."""
+    count = 100_000
+    t0 = time.time() - count * 3
+    print(f"{'Backend':>9} {'Inserts/s':>11} {'Worst append':>13} {'Flush':>9} {'1-day query':>12} {'30-day hourly':>14}")
+    for backend in HISTORY_BACKENDS:
+        directory = tempfile.mkdtemp(prefix=f"batteryz_bench_{backend}_")
+        try:
+            history = BatteryHistory(directory, backend)
+            worst = 0.0
+            start = time.perf_counter()
+            for i in range(count):
+                tick = time.perf_counter()
+                history.record(t0 + 3 * i, 80.0 - (i % 500) * 0.1, 11800.0, 7.5 + (i % 7) * 0.1, 34.0, 1)
+                worst = max(worst, time.perf_counter() - tick)
+            insert_rate = count / (time.perf_counter() - start)
+            start = time.perf_counter()
+            history.flush()
+            flush_ms = (time.perf_counter() - start) * 1000
+            start = time.perf_counter()
+            day = history.query(t0 + 86400, t0 + 2 * 86400)
+            day_ms = (time.perf_counter() - start) * 1000
+            start = time.perf_counter()
+            hourly = history.query_rollup(3600, t0, t0 + 30 * 86400)
+            hourly_ms = (time.perf_counter() - start) * 1000
+            history.close()
+            print(f"{backend:>9} {insert_rate:>11,.0f} {worst * 1000:>11.2f}ms {flush_ms:>7.1f}ms "
+                  f"{day_ms:>10.1f}ms {hourly_ms:>12.1f}ms   ({len(day):,} samples, {len(hourly)} hours)")
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+def benchmark_fleet_scoring():
+    """Scores a synthetic fleet with the NumPy and pure-Python paths, checks they agree, and reports batteries/s."""
+    global NUMPY_AVAILABLE
+    rng = random.Random(7)
+    count = 200000
+    fleet = [[], [], [], [], []]
+    for _ in range(count):
+        design = rng.choice([45000.0, 56000.0, 70000.0, 86000.0, 99500.0])
+        rated = rng.choice([300.0, 500.0, 800.0, 1000.0, 1500.0])
+        cycles = rng.uniform(0, 1.3 * rated)
+        row = [design, design * rng.uniform(0.55, 1.02), cycles, rated, rng.uniform(30, 2000)]
+        # A few machines with missing readings, as real inventories have.
+        if rng.random() < 0.01:
+            row[rng.randrange(5)] = math.nan
+        for column, value in zip(fleet, row):
+            column.append(value)
+    print(f"{count:,} synthetic batteries.\n")
+    print(f"{'Path':>12} {'Batteries':>10} {'Time':>10} {'Batteries/s':>14}")
+    results = {}
+    numpy_available = NUMPY_AVAILABLE
+    try:
+        for label, use_numpy, size in ([("numpy", True, count)] if NUMPY_AVAILABLE else []) + [("pure-python", False, count // 10)]:
+            NUMPY_AVAILABLE = use_numpy
+            columns = [np.asarray(c[:size]) for c in fleet] if use_numpy else [c[:size] for c in fleet]
+            start = time.perf_counter()
+            results[label] = score_fleet(*columns)
+            elapsed = time.perf_counter() - start
+            print(f"{label:>12} {size:>10,} {elapsed * 1000:>8.1f}ms {size / elapsed:>14,.0f}")
+    finally:
+        NUMPY_AVAILABLE = numpy_available
+    if "numpy" in results:
+        size = count // 10
+        vectorized, reference = results["numpy"], results["pure-python"]
+        identical = (np.allclose(vectorized["soh"][:size], reference["soh"], atol=1e-9)
+                     and vectorized["status"][:size].tolist() == reference["status"]
+                     and vectorized["rul_days"][:size].tolist() == reference["rul_days"]
+                     and vectorized["rul_status"][:size].tolist() == reference["rul_status"])
+        print(f"\nNumPy and pure-Python results identical: {identical}")
+        assert identical, "Vectorized fleet scores differ from the pure-Python path"
+        statuses, counts = np.unique(vectorized["status"], return_counts=True)
+        print("Status buckets: " + ", ".join(f"{s} {c:,}" for s, c in zip(statuses, counts)))
+
+# The registry of available benchmarks: name -> (function, description).
+BENCHMARKS = {
+    "report-parser": (benchmark_report_parser, "Streaming powercfg report parser vs. repeated regex scans."),
+    "pipeline": (benchmark_provider_pipeline, "Full fetch and real-time poll, replayed from a recording."),
+    "rul": (benchmark_rul_projection, "Closed-form and vectorized RUL projection vs. the day-by-day loop."),
+    "rul-monte-carlo": (benchmark_monte_carlo_rul, "Monte Carlo P10/P50/P90 RUL, NumPy vs. pure Python."),
+    "history-chart": (benchmark_history_chart, "LTTB decimation and cached-path panning over a year of history."),
+    "archive": (benchmark_telemetry_archive, "Compressed .bza telemetry archive: size and encode/decode throughput."),
+    "history-backends": (benchmark_history_backends, "Segment-file vs. SQLite (WAL) history: insert rate and queries."),
+    "fleet-scoring": (benchmark_fleet_scoring, "Batch SOH, status and RUL over a fleet, NumPy vs. pure Python."),
+}
+
+def run_benchmark_mode(name: Optional[str]) -> int:
+    """
+    Runs one benchmark by name, or all of them for 'all'.
+
+    Returns:
+        int: A process exit code.
+    """
+    if name not in BENCHMARKS and name != "all":
+        print("\nAvailable benchmarks:")
+        for bench_name, (_, description) in BENCHMARKS.items():
+            print(f"  {bench_name:<18} {description}")
+        print(f"  {'all':<18} Run every benchmark.\n")
+        return 0 if name is None else 1
+    selected = BENCHMARKS if name == "all" else {name: BENCHMARKS[name]}
+    for bench_name, (func, description) in selected.items():
+        print("\n" + "="*80)
+        print(f"BENCHMARK: {bench_name} - {description}")
+        print("="*80)
+        func()
+    print()
+    return 0
+
 # This is the main entry point when the script is executed.
 if __name__ == "__main__":
     # Get command-line arguments, excluding the script name itself.
@@ -5226,6 +11172,90 @@ if __name__ == "__main__":
         print_version()
         sys.exit(0)
     
+    # Check for the benchmark flag. The benchmark name is the argument that follows it.
+    if "--benchmark" in args:
+        index = args.index("--benchmark")
+        bench_name = args[index + 1] if index + 1 < len(args) else None
+        sys.exit(run_benchmark_mode(bench_name))
+    
+    # Check for the record-and-replay flags. Each takes the argument that follows it.
+    if "--record" in args:
+        index = args.index("--record")
+        if index + 1 >= len(args):
+            print("[X] --record requires a file name.")
+            sys.exit(1)
+        RECORD_PATH = args[index + 1]
+        print(f"[✓] Recording battery data responses to {RECORD_PATH}")
+    
+    if "--replay" in args:
+        index = args.index("--replay")
+        if index + 1 >= len(args) or not os.path.exists(args[index + 1]):
+            print("[X] --replay requires an existing recording file.")
+            sys.exit(1)
+        REPLAY_PATH = args[index + 1]
+        if "--replay-speed" in args:
+            index = args.index("--replay-speed")
+            try:
+                REPLAY_SPEED = float(args[index + 1])
+            except (IndexError, ValueError):
+                print("[X] --replay-speed requires a number.")
+                sys.exit(1)
+        print(f"[✓] Replaying battery data from {REPLAY_PATH} at speed {REPLAY_SPEED:g}")
+    
+    # Check for the history backend flag. It must be set before the history is first opened.
+    if "--history-backend" in args:
+        index = args.index("--history-backend")
+        if index + 1 >= len(args) or args[index + 1] not in HISTORY_BACKENDS:
+            print(f"[X] --history-backend requires one of: {', '.join(HISTORY_BACKENDS)}.")
+            sys.exit(1)
+        HISTORY_BACKEND = args[index + 1]
+        print(f"[✓] Using the '{HISTORY_BACKEND}' history backend.")
+    
+    # Check for the history export flag. It takes the output file, and optionally --days N.
+    if "--export-history" in args:
+        index = args.index("--export-history")
+        if index + 1 >= len(args):
+            print("[X] --export-history requires a file name.")
+            sys.exit(1)
+        export_start = -math.inf
+        if "--days" in args:
+            try:
+                export_start = time.time() - float(args[args.index("--days") + 1]) * 86400
+            except (IndexError, ValueError):
+                print("[X] --days requires a number.")
+                sys.exit(1)
+        if REPLAY_PATH:
+            print("[X] History is not available in replay mode.")
+            sys.exit(1)
+        # Read-only, so an export never touches the files a running Battery-Z is writing.
+        try:
+            history = BatteryHistory.open_samples_read_only(os.path.join(get_app_data_dir(), HISTORY_DIR_NAME))
+        except (OSError, sqlite3.Error) as e:
+            print(f"[X] Could not open the history: {e}")
+            sys.exit(1)
+        if history is None:
+            print("[X] No history has been recorded yet.")
+            sys.exit(1)
+        written = export_history_archive(history, args[index + 1], start=export_start,
+                                         metadata={"app_version": APP_VERSION, "exported_at": time.time()})
+        print(f"[✓] Exported {written:,} samples to {args[index + 1]} ({os.path.getsize(args[index + 1]):,} bytes).")
+        sys.exit(0)
+    
+    # Check for the fleet scoring flag. It takes the input and output CSV files.
+    if "--score-fleet" in args:
+        index = args.index("--score-fleet")
+        if index + 2 >= len(args) or not os.path.exists(args[index + 1]):
+            print("[X] --score-fleet requires an existing input CSV and an output file name.")
+            sys.exit(1)
+        try:
+            start = time.perf_counter()
+            scored = score_fleet_csv(args[index + 1], args[index + 2])
+        except (OSError, ValueError) as e:
+            print(f"[X] Fleet scoring failed: {e}")
+            sys.exit(1)
+        print(f"[✓] Scored {scored:,} batteries in {time.perf_counter() - start:.2f} s. Results written to {args[index + 2]}.")
+        sys.exit(0)
+    
     # Check for the no-gui flag.
     if "--no-gui" in args:
         run_console_mode()